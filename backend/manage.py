@@ -0,0 +1,499 @@
+"""管理用コマンド
+
+backend/.env（または環境変数）の MONGO_URL / DB_NAME に接続して実行する。
+
+    python manage.py rebuild-snapshots [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+    python manage.py audit-queries [--reservations N] [--database NAME] [--keep | --no-seed] [--max-examined-ratio R]
+    python manage.py migrate-documents
+    python manage.py seed [--days N] [--benches N] [--users N] [--occupancy 0.6] [--peak-skew 2] [--database NAME] [--drop]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+import server
+
+# スナップショット再構築の同時実行数
+REBUILD_CONCURRENCY = 8
+
+
+async def rebuild_snapshots(args) -> int:
+    """Rebuild day_snapshots from the reservations collection"""
+    query = {}
+    snapshot_query = {}
+    if args.date_from or args.date_to:
+        date_from = args.date_from or args.date_to
+        date_to = args.date_to or args.date_from
+        query["start_time"] = server.jst_date_range_query(date_from, date_to)
+        snapshot_query["_id"] = {"$gte": date_from, "$lte": date_to}
+
+    groups = await server.db.reservations.aggregate([
+        {"$match": query},
+        {"$group": {"_id": {"$substrCP": ["$start_time", 0, 10]}}},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None)
+    days = [group["_id"] for group in groups if group["_id"]]
+
+    semaphore = asyncio.Semaphore(REBUILD_CONCURRENCY)
+
+    async def rebuild(day):
+        async with semaphore:
+            await server.refresh_day_snapshots([day])
+
+    await asyncio.gather(*(rebuild(day) for day in days))
+
+    # 予約がなくなった日のスナップショットは削除（読み込み時に空で作り直される）
+    removed = await server.db.day_snapshots.delete_many({**snapshot_query, "_id": {**snapshot_query.get("_id", {}), "$nin": days}})
+    # REDIS_URL を設定している場合は各インスタンスの読み込みキャッシュも無効化される
+    await server.mark_all_days_changed()
+    print(f"再構築: {len(days)}日分, 削除: {removed.deleted_count}件")
+    return 0
+
+
+# 検証用データの生成（7:00-22:00・30分刻み、ベンチごとに重なりなし）
+SEED_OPENING_SLOT_MINUTES = 7 * 60
+SEED_SLOTS_PER_DAY = 30
+SEED_DURATION_SLOTS = [1, 2, 3, 4]          # 30分〜2時間
+SEED_DURATION_WEIGHTS = [35, 35, 15, 15]
+SEED_PEAK_HOURS = {10, 11, 14, 15, 16}
+SEED_FUTURE_DAYS = 30
+SEED_BATCH_SIZE = 1000
+SEED_CONCURRENCY = 8
+
+
+def seed_bench_ids(count: int) -> list:
+    """The app's default bench ids first, then bench-03, bench-04, ..."""
+    default_ids = [bench["id"] for bench in server.DEFAULT_BENCHES]
+    return default_ids[:count] + [f"bench-{number:02d}" for number in range(len(default_ids) + 1, count + 1)]
+
+
+async def register_seed_benches(db, bench_ids: list) -> None:
+    defaults = {bench["id"]: bench for bench in server.DEFAULT_BENCHES}
+    for order, bench_id in enumerate(bench_ids):
+        bench = defaults.get(bench_id) or {"id": bench_id, "name": f"ベンチ{order + 1}", "room": None, "order": order, "active": True}
+        await db.benches.update_one({"id": bench_id}, {"$setOnInsert": dict(bench)}, upsert=True)
+
+
+def generate_reservations(rng: random.Random, days: list, bench_ids: list, user_count: int,
+                          occupancy: float, peak_skew: float, limit: Optional[int] = None) -> Iterator[dict]:
+    """Reservations in the stored document format, day by day and bench by bench.
+    
+    Each bench's day is walked slot by slot, so bookings never overlap. occupancy
+    is the approximate share of booked slots; slots in SEED_PEAK_HOURS are
+    (1 + peak_skew) times as likely to start a booking. A few users make most
+    of the bookings (weights 1/rank).
+    """
+    users = [f"利用者{number:05d}" for number in range(1, user_count + 1)]
+    user_keys = [server.normalize_user_key(user) for user in users]
+    user_weights = list(itertools.accumulate(1 / rank for rank in range(1, user_count + 1)))
+    
+    # 平均 d 枠の予約で枠の割合 o を埋めるには、空き枠ごとの開始確率 p = o / (d(1 - o) + o)
+    mean_slots = sum(s * w for s, w in zip(SEED_DURATION_SLOTS, SEED_DURATION_WEIGHTS)) / sum(SEED_DURATION_WEIGHTS)
+    base_probability = occupancy / (mean_slots * (1 - occupancy) + occupancy)
+    weights = [1 + peak_skew if 7 + slot // 2 in SEED_PEAK_HOURS else 1 for slot in range(SEED_SLOTS_PER_DAY)]
+    mean_weight = sum(weights) / len(weights)
+    start_probability = [min(0.95, base_probability * weight / mean_weight) for weight in weights]
+    
+    generated = 0
+    for day in days:
+        midnight = server.JST.localize(datetime.combine(day, datetime.min.time()))
+        for bench_id in bench_ids:
+            slot = 0
+            while slot < SEED_SLOTS_PER_DAY:
+                if rng.random() >= start_probability[slot]:
+                    slot += 1
+                    continue
+                length = min(rng.choices(SEED_DURATION_SLOTS, SEED_DURATION_WEIGHTS)[0], SEED_SLOTS_PER_DAY - slot)
+                start = midnight + timedelta(minutes=SEED_OPENING_SLOT_MINUTES + 30 * slot)
+                user = rng.choices(range(user_count), cum_weights=user_weights)[0]
+                yield {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    "bench_id": bench_id,
+                    "user_name": users[user],
+                    "user_key": user_keys[user],
+                    "start_time": start.isoformat(),
+                    "end_time": (start + timedelta(minutes=30 * length)).isoformat(),
+                    "created_at": (start - timedelta(days=rng.randint(0, 14), minutes=rng.randrange(24 * 60))).isoformat(),
+                    "version": 1,
+                }
+                generated += 1
+                if limit is not None and generated >= limit:
+                    return
+                slot += length
+
+
+async def insert_in_batches(collection, documents: Iterator[dict], batch_size: int = SEED_BATCH_SIZE,
+                            concurrency: int = SEED_CONCURRENCY, progress_every: int = 0) -> int:
+    """insert_many in batches with up to concurrency batches in flight; returns the inserted count"""
+    pending = set()
+    inserted = 0
+    reported = 0
+    
+    async def collect(return_when):
+        nonlocal pending, inserted
+        done, pending = await asyncio.wait(pending, return_when=return_when)
+        inserted += sum(len(task.result().inserted_ids) for task in done)
+    
+    for batch in iter(lambda: list(itertools.islice(documents, batch_size)), []):
+        pending.add(asyncio.ensure_future(collection.insert_many(batch, ordered=False)))
+        if len(pending) >= concurrency:
+            await collect(asyncio.FIRST_COMPLETED)
+        else:
+            await asyncio.sleep(0)  # 生成の合間に完了した書き込みを処理させる
+        if progress_every and inserted - reported >= progress_every:
+            reported = inserted
+            print(f"  {inserted:,}件", flush=True)
+    if pending:
+        await collect(asyncio.ALL_COMPLETED)
+    return inserted
+
+
+async def seed_reservations(args) -> int:
+    """Generate synthetic reservations into an empty (or --drop'ed) database"""
+    if not 0 < args.occupancy < 1:
+        print("--occupancy は 0 より大きく 1 未満で指定してください", file=sys.stderr)
+        return 2
+    database_name = args.database
+    target = server.client[database_name]
+    if args.drop and database_name == os.environ["DB_NAME"] and not args.yes_really:
+        print(f"{database_name} は本番のデータベースです（予約を削除して作り直す場合は --yes-really も指定してください）", file=sys.stderr)
+        return 2
+    if args.drop:
+        for collection in ("reservations", "day_snapshots", "reservation_events"):
+            await target[collection].drop()
+        await target.counters.delete_one({"_id": "reservation_events"})
+    elif await target.reservations.estimated_document_count():
+        print(f"{database_name} には予約があります（重なりを避けるため、--drop で削除してから作成してください）", file=sys.stderr)
+        return 2
+    
+    first_day = date.fromisoformat(args.date_from) if args.date_from else datetime.now(server.JST).date() - timedelta(days=args.days - SEED_FUTURE_DAYS)
+    days = [first_day + timedelta(days=offset) for offset in range(args.days)]
+    bench_ids = seed_bench_ids(args.benches)
+    print(f"{database_name}: {days[0]}〜{days[-1]}（{args.days}日）, ベンチ {len(bench_ids)}台, 利用者 {args.users}人, "
+          f"埋まり具合 {args.occupancy:.0%}, ピーク倍率 {1 + args.peak_skew:g}")
+    
+    started = time.monotonic()
+    documents = generate_reservations(random.Random(args.seed), days, bench_ids, args.users,
+                                      args.occupancy, args.peak_skew, limit=args.reservations)
+    inserted = await insert_in_batches(target.reservations, documents, args.batch_size, args.concurrency, progress_every=100_000)
+    elapsed = time.monotonic() - started
+    print(f"作成: {inserted:,}件 {elapsed:.1f}秒（{inserted / elapsed if elapsed else 0:,.0f}件/秒）")
+    
+    # インデックスは読み込み後にまとめて作る方が速い
+    await register_seed_benches(target, bench_ids)
+    production_db, server.db = server.db, target
+    try:
+        await server.ensure_indexes()
+    finally:
+        server.db = production_db
+    # 起動中のアプリが読むデータベースを作り直した場合だけ、キャッシュを無効化する
+    if database_name == server.db.name:
+        await server.mark_all_days_changed()
+    return 0
+
+
+# クエリ計画の監査で作る検証用データの件数と期間
+AUDIT_RESERVATIONS = 20000
+AUDIT_DAYS = 120
+AUDIT_USERS = 200
+# 返却件数あたりの読み取り件数（インデックスキー・ドキュメントの多い方）がこれを超えると選択性の低いクエリとして失敗する
+AUDIT_MAX_EXAMINED_RATIO = 10.0
+# 読み取り件数がこれ未満なら比率は見ない（数件の返却で数十件読むのは問題にならない）
+AUDIT_MIN_EXAMINED = 100
+
+
+async def seed_audit_database(db, count: int, day_count: int) -> None:
+    """Fill an empty database with count reservations shaped like production data (fixed seed)"""
+    first_day = datetime.now(server.JST).date() - timedelta(days=day_count - SEED_FUTURE_DAYS)
+    days = [first_day + timedelta(days=offset) for offset in range(day_count)]
+    # 埋まり具合 0.6 では1台あたり1日8件程度なので、件数に届くようにベンチを増やす
+    bench_ids = seed_bench_ids(max(len(server.DEFAULT_BENCHES), -(-count // (day_count * 8))))
+    await insert_in_batches(db.reservations, generate_reservations(random.Random(0), days, bench_ids, AUDIT_USERS, 0.6, 2.0, limit=count))
+    await register_seed_benches(db, bench_ids)
+
+    now = datetime.now(timezone.utc)
+    await db.reservation_events.insert_many([
+        {"op": "upsert", "id": f"audit-{seq:07d}", "day": first_day.isoformat(), "seq": seq, "at": now}
+        for seq in range(1, 1001)
+    ])
+    await db.counters.insert_one({"_id": "reservation_events", "seq": 1000})
+
+
+def find_command(collection: str, query: dict, projection=None, sort=None, limit=None) -> dict:
+    command = {"find": collection, "filter": query}
+    if projection is not None:
+        command["projection"] = projection
+    if sort is not None:
+        command["sort"] = sort
+    if limit is not None:
+        command["limit"] = limit
+    return command
+
+
+def aggregate_command(collection: str, pipeline: list) -> dict:
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+
+def count_command(collection: str, query: dict) -> dict:
+    # count_documents は $match + $group の集計として実行される
+    return aggregate_command(collection, [{"$match": query}, {"$group": {"_id": 1, "n": {"$sum": 1}}}])
+
+
+def query_shapes(sample: dict) -> list:
+    """(name, command, allowed COLLSCAN reason) for every query the app issues, with sample values"""
+    day_range = server.jst_date_range_query(sample["day"], sample["day"])
+    month_range = server.jst_date_range_query(sample["month_start"], sample["day"])
+    overlap = server.overlap_query(sample["start_time"], sample["end_time"])
+    active_ids = [bench["id"] for bench in server.DEFAULT_BENCHES]
+    return [
+        ("予約の取得・削除（id）", find_command("reservations", {"id": sample["id"]}, limit=1), None),
+        ("重複チェック（check_double_booking）",
+         find_command("reservations", {"bench_id": sample["bench_id"], **overlap, "id": {"$ne": sample["id"]}}, {"_id": 0, "id": 1}, limit=1), None),
+        ("更新（id + version）",
+         {"findAndModify": "reservations", "query": {"id": sample["id"], "version": server.version_condition(1)},
+          "update": {"$set": {"version": 2}}}, None),
+        ("一覧（全件、上限500件）", find_command("reservations", {}, limit=500), "条件なしの一覧は上限件数まで読むだけ"),
+        ("一覧（ベンチ指定）", find_command("reservations", {"bench_id": sample["bench_id"]}, limit=500), None),
+        ("日表示・スナップショット作成", find_command("reservations", {"start_time": day_range}, {"_id": 0}), None),
+        ("空き時間の提案", find_command("reservations", {"start_time": day_range},
+                                  {"_id": 0, "bench_id": 1, "start_time": 1, "end_time": 1}, sort={"start_time": 1}), None),
+        ("ウォームアップ", find_command("reservations", {"bench_id": {"$in": active_ids}, "start_time": day_range},
+                                 {"_id": 0, "bench_id": 1, "start_time": 1, "end_time": 1}), None),
+        ("週表示", aggregate_command("reservations", [
+            {"$match": {"start_time": month_range}},
+            {"$project": {"_id": 0}},
+            {"$group": {"_id": {"date": {"$substrCP": ["$start_time", 0, 10]}, "bench_id": "$bench_id"},
+                        "reservations": {"$push": "$$ROOT"}}},
+        ]), None),
+        ("利用率分析", find_command("reservations", {"start_time": month_range},
+                               {"_id": 0, "bench_id": 1, "start_time": 1, "end_time": 1}), None),
+        ("利用率分析（ベンチ指定）", find_command("reservations", {"start_time": month_range, "bench_id": sample["bench_id"]},
+                                     {"_id": 0, "bench_id": 1, "start_time": 1, "end_time": 1}), None),
+        ("エクスポート（期間）", find_command("reservations", {"start_time": month_range}, {"_id": 0}, sort={"start_time": 1}), None),
+        ("エクスポート（期間 + ベンチ）", find_command("reservations", {"start_time": month_range, "bench_id": sample["bench_id"]},
+                                          {"_id": 0}, sort={"start_time": 1}), None),
+        ("エクスポート（期間 + 利用者）", find_command("reservations", {"start_time": month_range, "user_key": sample["user_key"]},
+                                          {"_id": 0}, sort={"start_time": 1}), None),
+        ("利用者ごとの予約（今後）", find_command("reservations", {"user_key": sample["user_key"], "end_time": {"$gt": sample["now"]}},
+                                     {"_id": 0}, sort={"start_time": 1, "id": 1}, limit=21), None),
+        ("利用者ごとの予約（過去）", find_command("reservations", {"user_key": sample["user_key"], "end_time": {"$lte": sample["now"]}},
+                                     {"_id": 0}, sort={"start_time": -1, "id": -1}, limit=21), None),
+        ("利用者名の前方一致検索", aggregate_command("reservations", [
+            {"$match": {"user_key": {"$regex": f"^{re.escape(sample['user_key'][:2])}"}}},
+            {"$sort": {"user_key": -1, "start_time": -1}},
+            {"$group": {"_id": "$user_key", "user_name": {"$first": "$user_name"}, "reservation_count": {"$sum": 1},
+                        "last_reserved": {"$first": "$start_time"}}},
+            {"$sort": {"reservation_count": -1, "_id": 1}},
+            {"$limit": 10},
+        ]), None),
+        ("一括削除（期間 + ベンチ）", find_command("reservations", {"bench_id": sample["bench_id"], "start_time": day_range},
+                                       {"_id": 0, "id": 1, "bench_id": 1, "start_time": 1}), None),
+        ("一括削除（id 一覧）", {"delete": "reservations", "deletes": [{"q": {"id": {"$in": [sample["id"]]}}, "limit": 0}]}, None),
+        ("クリーンアップ", {"delete": "reservations", "deletes": [{"q": {"start_time": {"$lt": sample["cutoff"]}}, "limit": 0}]}, None),
+        ("アーカイブ（古い予約を月ごとに読み出す）", find_command("reservations", {"start_time": {"$lt": sample["cutoff"]}}, {"_id": 0},
+                                                sort={"start_time": 1}), None),
+        ("データベース状況（今日以降）", count_command("reservations", {"start_time": {"$gte": sample["today"]}}), None),
+        ("データベース状況（30日より前）", count_command("reservations", {"start_time": {"$lt": sample["cutoff"]}}), None),
+        ("ヘルスチェック", find_command("reservations", {}, limit=1), "1件目を読むだけ"),
+        ("起動時の移行（version なし）", {"update": "reservations", "updates": [
+            {"q": {"version": {"$exists": False}}, "u": {"$set": {"version": 1}}, "multi": True}]},
+         "初回起動時に1回だけ実行する移行（完了を migrations に記録）"),
+        ("起動時の移行（user_key なし）", find_command("reservations", {"user_key": {"$exists": False}}, {"_id": 1, "user_name": 1}), None),
+        ("起動時の移行（完了の記録）", find_command("migrations", {"_id": server.RESERVATION_MIGRATION_ID}, limit=1), None),
+        ("スナップショット（日付）", find_command("day_snapshots", {"_id": sample["day"]}, limit=1), None),
+        ("スナップショットの削除（古い日付）", {"delete": "day_snapshots", "deletes": [{"q": {"_id": {"$lt": sample["day"]}}, "limit": 0}]}, None),
+        ("差分同期（seq の連続性）", find_command("reservation_events", {"seq": {"$gt": 10}}, {"_id": 0, "seq": 1, "at": 1},
+                                       sort={"seq": 1}, limit=server.CHANGES_SCAN_LIMIT), None),
+        ("差分同期（日付指定）", find_command("reservation_events", {
+            "seq": {"$gt": 10, "$lte": 900},
+            "$or": [{"day": sample["day"]}, {"op": "purge", "before_day": {"$gt": sample["day"]}}]
+        }, {"_id": 0, "at": 0}, sort={"seq": 1}, limit=server.CHANGES_DEFAULT_LIMIT + 1), None),
+        ("差分同期（保持中の最古）", find_command("reservation_events", {}, {"_id": 0, "seq": 1}, sort={"seq": 1}, limit=1), None),
+        ("変更の連番", find_command("counters", {"_id": "reservation_events"}, limit=1), None),
+        ("再送キー", find_command("idempotency_keys", {"_id": "audit"}, limit=1), None),
+        ("ベンチ登録", find_command("benches", {}, {"_id": 0}), "登録ベンチは数件で、すべて読み込む"),
+        ("スケジューラーのリース", {"findAndModify": "scheduler_leases", "query": {
+            "_id": "scheduler-leader", "$or": [{"owner": "audit"}, {"expires_at": {"$lte": datetime.now(timezone.utc)}}]
+        }, "update": {"$set": {"owner": "audit"}}}, None),
+    ]
+
+
+def plan_stages(node) -> list:
+    """Every stage name in a winning plan (classic and slot-based engine layouts)"""
+    stages = []
+    if isinstance(node, dict):
+        if "stage" in node:
+            stages.append(node["stage"] + (f"({node['indexName']})" if node.get("indexName") else ""))
+        for key, value in node.items():
+            if key not in ("rejectedPlans", "slotBasedPlan"):
+                stages.extend(plan_stages(value))
+    elif isinstance(node, list):
+        for item in node:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def find_key(node, key):
+    """First value stored under key anywhere in a nested explain document"""
+    if isinstance(node, dict):
+        if key in node:
+            return node[key]
+        node = list(node.values())
+    if isinstance(node, list):
+        for item in node:
+            found = find_key(item, key)
+            if found is not None:
+                return found
+    return None
+
+
+def audit_explain(explain: dict, max_examined_ratio: float = AUDIT_MAX_EXAMINED_RATIO) -> dict:
+    """Plan, keys/documents examined against documents returned, and problem flags"""
+    stages = plan_stages(find_key(explain, "winningPlan"))
+    names = [stage.split("(")[0] for stage in stages]
+    stats = find_key(explain, "executionStats") or {}
+    flags = []
+    if "COLLSCAN" in names:
+        flags.append("COLLSCAN")
+    # 削除・更新は返却件数が0なので、対象になった件数と比べる
+    examined = max(stats.get("totalKeysExamined") or 0, stats.get("totalDocsExamined") or 0)
+    produced = max(stats.get("nReturned") or 0, find_key(stats, "nWouldDelete") or 0, find_key(stats, "nMatched") or 0)
+    ratio = examined / max(produced, 1)
+    if examined >= AUDIT_MIN_EXAMINED and ratio > max_examined_ratio:
+        flags.append("UNSELECTIVE")
+    # 並べ替えが問題になるのは $group より前（全件）のみ。集計結果の並べ替えは件数が少ない
+    # プランは根から順に並ぶので、GROUP より後ろに出てくる SORT がグループ化前のソート
+    first_group = names.index("GROUP") if "GROUP" in names else -1
+    if "SORT" in names[first_group + 1:]:
+        flags.append("SORT")
+    # 集計でクエリ層に押し込めなかった $sort（$cursor より後ろのステージ）
+    pipeline = [next(iter(stage)) for stage in explain.get("stages", [])[1:]]
+    if "GROUP" not in names and "$sort" in pipeline[:pipeline.index("$group") if "$group" in pipeline else None]:
+        flags.append("SORT")
+    return {
+        "plan": " <- ".join(stages) or "-",
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+        "examined_ratio": round(ratio, 1),
+        "flags": sorted(set(flags)),
+    }
+
+
+async def audit_queries(args) -> int:
+    """Explain every query shape against a seeded database and fail on COLLSCAN / in-memory SORT / unselective plans"""
+    database_name = args.database or f"{os.environ['DB_NAME']}_plan_audit"
+    audit_db = server.client[database_name]
+    if database_name == os.environ["DB_NAME"] and not args.no_seed:
+        print("本番のデータベースには検証用データを作成できません（--database で別の名前を指定してください）", file=sys.stderr)
+        return 2
+    production_db, server.db = server.db, audit_db
+    try:
+        if not args.no_seed:
+            await audit_db.client.drop_database(database_name)
+            await seed_audit_database(audit_db, args.reservations, AUDIT_DAYS)
+        await server.ensure_indexes()
+
+        sample = await audit_db.reservations.find_one({}, {"_id": False}, sort=[("start_time", -1)])
+        if sample is None:
+            print("予約データがありません", file=sys.stderr)
+            return 2
+        day = sample["start_time"][:10]
+        today = datetime.now(server.JST).date()
+        sample.update({
+            "day": day,
+            "month_start": (date.fromisoformat(day) - timedelta(days=27)).isoformat(),
+            "now": datetime.now(server.JST).isoformat(),
+            "today": server.JST.localize(datetime.combine(today, datetime.min.time())).isoformat(),
+            "cutoff": server.JST.localize(datetime.combine(today - timedelta(days=30), datetime.min.time())).isoformat(),
+        })
+
+        failures = 0
+        print(f"{'クエリ':<28} {'keys':>7} {'docs':>7} {'返却':>6} {'比率':>6}  判定  プラン")
+        for name, command, allowed in query_shapes(sample):
+            explain = await audit_db.command({"explain": command, "verbosity": "executionStats"})
+            result = audit_explain(explain, args.max_examined_ratio)
+            # 全件を読むことが前提のクエリ（許容理由あり）は COLLSCAN と読み取り件数の多さを許容する
+            flags = [flag for flag in result["flags"] if not (flag in ("COLLSCAN", "UNSELECTIVE") and allowed)]
+            failures += bool(flags)
+            verdict = "NG " + ",".join(flags) if flags else ("許容" if result["flags"] else "OK")
+            print(f"{name:<28} {result['keys_examined'] or 0:>7} {result['docs_examined'] or 0:>7} "
+                  f"{result['returned'] or 0:>6} {result['examined_ratio']:>6}  {verdict}  {result['plan']}")
+            if allowed and result["flags"]:
+                print(f"{'':<28} 許容理由: {allowed}")
+        print(f"問題のあるクエリ: {failures}件")
+        return 1 if failures else 0
+    finally:
+        server.db = production_db
+        if not args.keep and not args.no_seed:
+            await audit_db.client.drop_database(database_name)
+
+
+async def migrate_documents(args) -> int:
+    """Backfill version / user_key even if the startup migration was already recorded as done"""
+    await server.migrate_reservation_documents(force=True)
+    print("予約ドキュメントの移行が完了しました")
+    return 0
+
+
+async def run(args) -> int:
+    try:
+        return await args.handler(args)
+    finally:
+        await server.read_cache.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="クリーンベンチ予約システムの管理用コマンド")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-snapshots", help="予約コレクションから日付ごとのスナップショットを作り直す")
+    rebuild.add_argument("--from", dest="date_from", help="対象の開始日（YYYY-MM-DD、この日を含む）")
+    rebuild.add_argument("--to", dest="date_to", help="対象の終了日（YYYY-MM-DD、この日を含む）")
+    rebuild.set_defaults(handler=rebuild_snapshots)
+
+    migrate = commands.add_parser("migrate-documents", help="version・user_key のない予約に値を付与する（起動時の移行をやり直す）")
+    migrate.set_defaults(handler=migrate_documents)
+
+    audit = commands.add_parser("audit-queries", help="検証用データで全クエリの実行計画を確認し、COLLSCAN・メモリ上のソート・選択性の低いクエリがあれば失敗する")
+    audit.add_argument("--reservations", type=int, default=AUDIT_RESERVATIONS, help=f"作成する予約の件数（既定 {AUDIT_RESERVATIONS}）")
+    audit.add_argument("--database", help="検証に使うデータベース名（既定は DB_NAME + _plan_audit）")
+    audit.add_argument("--keep", action="store_true", help="終了後も検証用データベースを削除しない")
+    audit.add_argument("--no-seed", action="store_true", help="データを作らず、指定したデータベースの既存データで確認する")
+    audit.add_argument("--max-examined-ratio", type=float, default=AUDIT_MAX_EXAMINED_RATIO,
+                       help="返却1件あたりに許容する読み取り件数（既定 %(default)s）")
+    audit.set_defaults(handler=audit_queries)
+
+    seed = commands.add_parser("seed", help="規模の検証用に、予約ルールに沿った合成データを作成する")
+    seed.add_argument("--days", type=int, default=365, help=f"作成する日数（既定 365、今日から{SEED_FUTURE_DAYS}日先まで）")
+    seed.add_argument("--from", dest="date_from", help="最初の日（YYYY-MM-DD、指定すると --days 日分をこの日から作成）")
+    seed.add_argument("--benches", type=int, default=len(server.DEFAULT_BENCHES), help="ベンチの台数（既定 %(default)s）")
+    seed.add_argument("--users", type=int, default=200, help="利用者の人数（既定 %(default)s）")
+    seed.add_argument("--occupancy", type=float, default=0.6, help="予約で埋まる枠のおおよその割合（既定 %(default)s）")
+    seed.add_argument("--peak-skew", type=float, default=2.0, help="ピーク時間帯（10-12時・14-17時）の予約の入りやすさ（既定 %(default)s、0 で一様）")
+    seed.add_argument("--reservations", type=int, help="作成する件数の上限")
+    seed.add_argument("--seed", type=int, default=0, help="乱数のシード（既定 %(default)s）")
+    seed.add_argument("--batch-size", type=int, default=SEED_BATCH_SIZE, help="insert_many 1回あたりの件数（既定 %(default)s）")
+    seed.add_argument("--concurrency", type=int, default=SEED_CONCURRENCY, help="同時に実行する insert_many の数（既定 %(default)s）")
+    seed.add_argument("--database", required=True, help="作成先のデータベース名")
+    seed.add_argument("--drop", action="store_true", help="既存の予約・スナップショット・変更履歴を削除してから作成する")
+    seed.add_argument("--yes-really", action="store_true", help="--database が DB_NAME（本番）でも --drop を実行する")
+    seed.set_defaults(handler=seed_reservations)
+
+    args = parser.parse_args(argv)
+    try:
+        return asyncio.run(run(args))
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,492 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ExecutionTimeout, NetworkTimeout, PyMongoError
 import os
 import logging
+import logging.handlers
 import asyncio
+import cProfile
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import math
+import mmap
+import pstats
+import random
+import threading
+import re
+import socket
+import tempfile
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional
+from pydantic import AfterValidator, BaseModel, Field, TypeAdapter, ValidationInfo, field_validator
+from typing import Annotated, Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import pytz
+import numpy as np
 from dateutil import parser
 
+try:
+    import msgpack
+except ImportError:  # MessagePack は任意（未導入なら JSON のみ返す）
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # 未導入なら gzip のみ
+    brotli = None
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # REDIS_URL で L2 キャッシュを使う場合のみ必要
+    redis_asyncio = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# 接続プール設定
+# MONGO_POOL_PROFILE で配置形態ごとの既定値を選び、MONGO_MAX_POOL_SIZE などの環境変数で個別に上書きする
+MONGO_POOL_PROFILES = {
+    # Vercel などのサーバーレス: インスタンスが多く短命なため、待機接続を持たない
+    "serverless": {
+        "maxPoolSize": 5,
+        "minPoolSize": 0,
+        "maxIdleTimeMS": 30000,
+        "maxConnecting": 2,
+        "waitQueueTimeoutMS": 5000,
+    },
+    # 単一プロセスの uvicorn（従来の設定、無料プランに配慮）
+    "single-node": {
+        "maxPoolSize": 10,
+        "minPoolSize": 2,
+        "maxIdleTimeMS": 60000,
+        "maxConnecting": 2,
+        "waitQueueTimeoutMS": 10000,
+    },
+    # 複数ワーカー: ワーカー数 × maxPoolSize がクラスターの接続上限を超えないよう小さめにする
+    "multi-worker": {
+        "maxPoolSize": 6,
+        "minPoolSize": 1,
+        "maxIdleTimeMS": 120000,
+        "maxConnecting": 2,
+        "waitQueueTimeoutMS": 10000,
+    },
+}
+MONGO_COMMON_OPTIONS = {
+    "serverSelectionTimeoutMS": 5000,  # サーバー選択タイムアウト (5秒)
+    "connectTimeoutMS": 10000,         # 接続タイムアウト (10秒)
+    "socketTimeoutMS": 15000,          # ソケットタイムアウト (15秒)
+    "heartbeatFrequencyMS": 30000,     # ハートビート頻度 (30秒)
+}
+MONGO_OPTION_ENV = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "maxConnecting": "MONGO_MAX_CONNECTING",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+    "heartbeatFrequencyMS": "MONGO_HEARTBEAT_FREQUENCY_MS",
+}
+
+def load_mongo_client_options(default_profile: str) -> Tuple[str, dict]:
+    """Resolve Motor client options from MONGO_POOL_PROFILE plus per-option overrides"""
+    profile = os.environ.get('MONGO_POOL_PROFILE', default_profile)
+    if profile not in MONGO_POOL_PROFILES:
+        raise ValueError(f"MONGO_POOL_PROFILE must be one of {sorted(MONGO_POOL_PROFILES)}: {profile}")
+    options = {**MONGO_COMMON_OPTIONS, **MONGO_POOL_PROFILES[profile]}
+    for option, env_name in MONGO_OPTION_ENV.items():
+        if os.environ.get(env_name):
+            options[option] = int(os.environ[env_name])
+    return profile, options
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Collects connection pool events for the admin pool endpoint.
+    
+    PyMongo calls listeners from its own threads, so all state is guarded by a lock.
+    """
+    
+    def __init__(self, max_samples: int = 1000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pools: Dict[str, dict] = {}
+        self._waits_ms = deque(maxlen=max_samples)
+        self._recent_events = deque(maxlen=50)
+    
+    def _pool(self, address) -> dict:
+        key = f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {
+                "open": 0,
+                "in_use": 0,
+                "created": 0,
+                "closed": 0,
+                "closed_by_reason": {},
+                "checkouts": 0,
+                "checkout_failures": 0,
+                "checkout_failures_by_reason": {},
+                "cleared": 0,
+            }
+        return pool
+    
+    def _record(self, kind: str, address, detail: Optional[str] = None) -> None:
+        self._recent_events.append({
+            "time": datetime.now(timezone.utc).isoformat(),
+            "event": kind,
+            "address": f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address),
+            "detail": detail,
+        })
+    
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+            self._record("pool_created", event.address)
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        with self._lock:
+            self._pool(event.address)["cleared"] += 1
+            self._record("pool_cleared", event.address)
+    
+    def pool_closed(self, event):
+        with self._lock:
+            self._record("pool_closed", event.address)
+    
+    def connection_created(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["created"] += 1
+            pool["open"] += 1
+            self._record("connection_created", event.address)
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["closed"] += 1
+            pool["open"] = max(0, pool["open"] - 1)
+            pool["closed_by_reason"][event.reason] = pool["closed_by_reason"].get(event.reason, 0) + 1
+            self._record("connection_closed", event.address, event.reason)
+    
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+    
+    def _wait_ms(self, event) -> Optional[float]:
+        # PyMongo 4.7 以降はイベントに待ち時間（秒）が含まれる
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            return duration * 1000
+        started = getattr(self._local, "started", None)
+        return (time.monotonic() - started) * 1000 if started is not None else None
+    
+    def connection_check_out_failed(self, event):
+        wait_ms = self._wait_ms(event)
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["checkout_failures"] += 1
+            pool["checkout_failures_by_reason"][event.reason] = pool["checkout_failures_by_reason"].get(event.reason, 0) + 1
+            if wait_ms is not None:
+                self._waits_ms.append(wait_ms)
+            self._record("connection_check_out_failed", event.address, event.reason)
+    
+    def connection_checked_out(self, event):
+        wait_ms = self._wait_ms(event)
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["checkouts"] += 1
+            pool["in_use"] += 1
+            if wait_ms is not None:
+                self._waits_ms.append(wait_ms)
+    
+    def connection_checked_in(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["in_use"] = max(0, pool["in_use"] - 1)
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            pools = {
+                address: {**stats, "available": max(0, stats["open"] - stats["in_use"])}
+                for address, stats in self._pools.items()
+            }
+            recent = list(self._recent_events)
+        return {
+            "pools": pools,
+            "checkout_wait_ms": {
+                "samples": len(waits),
+                "p50": percentile(waits, 0.50),
+                "p95": percentile(waits, 0.95),
+                "p99": percentile(waits, 0.99),
+                "max": waits[-1] if waits else None,
+            },
+            "recent_events": recent,
+        }
+
+# 遅い操作の記録（クエリの形ごとの件数・パーセンタイルと、最も遅かった実行例）
+SLOW_OP_THRESHOLD_MS = float(os.environ.get('SLOW_OP_THRESHOLD_MS', '100'))
+SLOW_OP_SAMPLES_PER_SHAPE = int(os.environ.get('SLOW_OP_SAMPLES_PER_SHAPE', '10'))
+SLOW_OP_MAX_SHAPES = int(os.environ.get('SLOW_OP_MAX_SHAPES', '500'))
+SLOW_OP_LOG_FILE = os.environ.get('SLOW_OP_LOG_FILE', '')  # 空なら書き出さない
+SLOW_OP_LOG_MAX_BYTES = int(os.environ.get('SLOW_OP_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+SLOW_OP_LOG_BACKUPS = int(os.environ.get('SLOW_OP_LOG_BACKUPS', '5'))
+
+# 接続の確立・死活確認・認証のコマンドは記録しない
+SLOW_OP_IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions", "killCursors",
+    "saslStart", "saslContinue", "authenticate", "getnonce",
+}
+# クエリの形として扱う部分（それ以外のセッション情報などは含めない）
+COMMAND_SHAPE_FIELDS = {
+    "find": ("filter", "sort", "projection", "limit"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort", "update", "remove", "upsert"),
+    "update": ("updates",),
+    "delete": ("deletes",),
+}
+
+def strip_literals(value: Any) -> Any:
+    """Replace every literal with '?', keeping field names and operators.
+    
+    Lists collapse to their distinct shapes, so $in with 1 or 100 values is one shape.
+    """
+    if isinstance(value, dict):
+        return {key: strip_literals(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = strip_literals(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def command_shape(command_name: str, command: dict) -> dict:
+    shape = {}
+    for field in COMMAND_SHAPE_FIELDS.get(command_name, ()):
+        if field not in command:
+            continue
+        value = command[field]
+        if field == "sort":
+            shape[field] = dict(value)  # ソートの向きはプランに影響するので残す
+        elif field == "pipeline":
+            shape[field] = [
+                {name: dict(spec) if name == "$sort" else strip_literals(spec) for name, spec in stage.items()}
+                for stage in value
+            ]
+        elif field in ("updates", "deletes"):
+            # 書き込み内容ではなく対象の条件（q）と複数件かどうかだけを形とする
+            statements = []
+            for statement in value:
+                statement_shape = {"q": strip_literals(statement.get("q")), "multi": bool(statement.get("multi", statement.get("limit") == 0))}
+                if statement_shape not in statements:
+                    statements.append(statement_shape)
+            shape[field] = statements
+        elif field == "update":
+            # 更新演算子の名前（$set など）だけを残す
+            shape[field] = list(value.keys()) if isinstance(value, dict) else strip_literals(value)
+        else:
+            shape[field] = strip_literals(value)
+    return shape
+
+def command_fingerprint(command_name: str, command: dict) -> str:
+    """Query-shape fingerprint, e.g. 'find reservations {"filter":{"start_time":{"$gte":"?","$lt":"?"}}}'"""
+    collection = command.get(command_name)
+    prefix = f"{command_name} {collection}" if isinstance(collection, str) else command_name
+    shape = command_shape(command_name, command)
+    if not shape:
+        return prefix
+    return f"{prefix} {json.dumps(shape, ensure_ascii=False, separators=(',', ':'), default=str)}"
+
+class SlowOpRecorder(monitoring.CommandListener):
+    """Per query shape: count, duration percentiles and the slowest occurrences.
+    
+    Every command counts towards its shape; commands taking at least threshold_ms
+    are also kept (the slowest samples_per_shape per shape) and written to the
+    optional rotating log file. getMore batches are attributed to the shape of
+    the find/aggregate that opened the cursor. Like PoolMonitor, callbacks run
+    on PyMongo's threads, so state is guarded by a lock.
+    """
+    
+    def __init__(self, threshold_ms: float = SLOW_OP_THRESHOLD_MS, samples_per_shape: int = SLOW_OP_SAMPLES_PER_SHAPE,
+                 max_shapes: int = SLOW_OP_MAX_SHAPES, log_file: str = SLOW_OP_LOG_FILE):
+        self.threshold_ms = threshold_ms
+        self.samples_per_shape = samples_per_shape
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        self._shapes: "OrderedDict[str, dict]" = OrderedDict()
+        self._running: Dict[Tuple[Any, int], Tuple[str, float, str, Optional[int]]] = {}
+        self._cursors: "OrderedDict[int, str]" = OrderedDict()
+        self._sequence = 0
+        self._file_logger = None
+        if log_file:
+            self._file_logger = logging.getLogger("slow_ops")
+            self._file_logger.propagate = False
+            self._file_logger.setLevel(logging.INFO)
+            if not self._file_logger.handlers:
+                self._file_logger.addHandler(logging.handlers.RotatingFileHandler(
+                    log_file, maxBytes=SLOW_OP_LOG_MAX_BYTES, backupCount=SLOW_OP_LOG_BACKUPS, encoding="utf-8"
+                ))
+    
+    def started(self, event):
+        if event.command_name in SLOW_OP_IGNORED_COMMANDS:
+            return
+        command = event.command
+        cursor_id = None
+        if event.command_name == "getMore":
+            cursor_id = int(command.get("getMore", 0))
+            with self._lock:
+                origin = self._cursors.get(cursor_id)
+            fingerprint = f"getMore <- {origin}" if origin else f"getMore {command.get('collection')}"
+        else:
+            fingerprint = command_fingerprint(event.command_name, command)
+        # 実行例として残すのは形の部分の実際の値だけ（lsid や $clusterTime は含めない）
+        fields = COMMAND_SHAPE_FIELDS.get(event.command_name, ())
+        detail = json.dumps({field: command[field] for field in fields if field in command},
+                            ensure_ascii=False, default=str)[:2000]
+        with self._lock:
+            self._running[(event.connection_id, event.request_id)] = (fingerprint, time.monotonic(), detail, cursor_id)
+    
+    def succeeded(self, event):
+        self._finish(event, None)
+    
+    def failed(self, event):
+        self._finish(event, str(getattr(event, "failure", {}).get("errmsg", "")) or "failed")
+    
+    def _finish(self, event, error: Optional[str]) -> None:
+        with self._lock:
+            running = self._running.pop((event.connection_id, event.request_id), None)
+        if running is None:
+            return
+        fingerprint, _, detail, getmore_cursor_id = running
+        duration_ms = event.duration_micros / 1000
+        
+        reply = getattr(event, "reply", None) or {}
+        cursor = reply.get("cursor") if isinstance(reply, dict) else None
+        with self._lock:
+            if getmore_cursor_id is not None:
+                if error is not None or not cursor or not int(cursor.get("id", 0)):
+                    self._cursors.pop(getmore_cursor_id, None)  # カーソルを読み切った
+            elif cursor and int(cursor.get("id", 0)):
+                self._cursors[int(cursor["id"])] = fingerprint
+                while len(self._cursors) > 1000:
+                    self._cursors.popitem(last=False)
+            
+            stats = self._shapes.get(fingerprint)
+            if stats is None:
+                stats = self._shapes[fingerprint] = {
+                    "count": 0, "errors": 0, "slow_count": 0, "total_ms": 0.0,
+                    "durations_ms": deque(maxlen=1000), "slowest": []
+                }
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(fingerprint)
+            stats["count"] += 1
+            stats["errors"] += error is not None
+            stats["total_ms"] += duration_ms
+            stats["durations_ms"].append(duration_ms)
+            
+            if duration_ms < self.threshold_ms:
+                return
+            stats["slow_count"] += 1
+            self._sequence += 1
+            sample = {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "duration_ms": round(duration_ms, 3),
+                "database": event.database_name,
+                "command": detail,
+                "error": error,
+            }
+            # 最も遅い samples_per_shape 件だけを最小ヒープで残す
+            if len(stats["slowest"]) < self.samples_per_shape:
+                heapq.heappush(stats["slowest"], (duration_ms, self._sequence, sample))
+            elif duration_ms > stats["slowest"][0][0]:
+                heapq.heapreplace(stats["slowest"], (duration_ms, self._sequence, sample))
+        
+        if self._file_logger is not None:
+            self._file_logger.info(json.dumps({"fingerprint": fingerprint, **sample}, ensure_ascii=False))
+    
+    def longest_running(self) -> Optional[Tuple[str, float]]:
+        """(fingerprint, elapsed ms) of the oldest command still waiting for a reply"""
+        with self._lock:
+            if not self._running:
+                return None
+            fingerprint, started, _, _ = min(self._running.values(), key=lambda running: running[1])
+        return fingerprint, round((time.monotonic() - started) * 1000, 1)
+    
+    def snapshot(self, limit: int = 20) -> dict:
+        with self._lock:
+            shapes = [
+                (fingerprint, {**stats, "durations_ms": sorted(stats["durations_ms"]), "slowest": sorted(stats["slowest"], reverse=True)})
+                for fingerprint, stats in self._shapes.items()
+            ]
+            running = len(self._running)
+        shapes.sort(key=lambda item: item[1]["total_ms"], reverse=True)
+        return {
+            "threshold_ms": self.threshold_ms,
+            "tracked_shapes": len(shapes),
+            "running": running,
+            "shapes": [
+                {
+                    "fingerprint": fingerprint,
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "slow_count": stats["slow_count"],
+                    "total_ms": round(stats["total_ms"], 3),
+                    "p50_ms": percentile(stats["durations_ms"], 0.50),
+                    "p95_ms": percentile(stats["durations_ms"], 0.95),
+                    "p99_ms": percentile(stats["durations_ms"], 0.99),
+                    "max_ms": stats["durations_ms"][-1] if stats["durations_ms"] else None,
+                    "slowest": [sample for _, _, sample in stats["slowest"]],
+                }
+                for fingerprint, stats in shapes[:limit]
+            ],
+        }
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+
+pool_monitor = PoolMonitor()
+slow_op_recorder = SlowOpRecorder()
+
 # MongoDB connection with improved connection pooling
 mongo_url = os.environ['MONGO_URL']
+mongo_pool_profile, mongo_client_options = load_mongo_client_options('single-node')
 client = AsyncIOMotorClient(
     mongo_url,
-    maxPoolSize=10,           # 接続プール削減（無料プランに配慮）
-    minPoolSize=2,            # 最小接続数
-    maxIdleTimeMS=60000,      # アイドル接続のタイムアウト (1分)
-    serverSelectionTimeoutMS=5000,  # サーバー選択タイムアウト (5秒)
-    connectTimeoutMS=10000,   # 接続タイムアウト (10秒)
-    socketTimeoutMS=15000,    # ソケットタイムアウト (15秒)
     retryWrites=True,         # 書き込みリトライ
     retryReads=True,          # 読み込みリトライ追加
-    heartbeatFrequencyMS=30000,  # ハートビート頻度 (30秒)
-    maxConnecting=2           # 同時接続試行数制限
+    event_listeners=[pool_monitor, slow_op_recorder],  # 接続プールと遅い操作の計測
+    **mongo_client_options
 )
 db = client[os.environ['DB_NAME']]
 
@@ -65,6 +522,174 @@ async def ensure_database_connection():
         return await check_database_connection()
     return True
 
+# アドミッション制御（クライアントごとのレート制限と同時実行数の上限）
+# Mongo の接続プールの手前でリクエストを制限し、溢れた分は待たせずに早めに断る
+class AdmissionController:
+    """Per-client token buckets plus a global concurrency limit with a bounded wait queue"""
+    
+    def __init__(self, rate: float, burst: float, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._buckets: Dict[str, List[float]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.counters = {
+            "admitted": 0,
+            "rejected_rate_limited": 0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0,
+        }
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+        self.queued_requests = 0
+    
+    def check_rate(self, client_key: str) -> Optional[float]:
+        """Take a token for the client; returns Retry-After seconds when the bucket is empty"""
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        bucket = self._buckets.get(client_key)
+        if bucket is None:
+            if len(self._buckets) >= 10000:
+                self._evict_idle(now)
+            bucket = self._buckets[client_key] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            self.counters["rejected_rate_limited"] += 1
+            return (1 - tokens) / self.rate
+        bucket[0] = tokens - 1
+        return None
+    
+    def _evict_idle(self, now: float) -> None:
+        # 満タンまで回復したバケットは保持する必要がない
+        full_after = self.burst / self.rate
+        for key in [key for key, (_, last) in self._buckets.items() if now - last >= full_after]:
+            del self._buckets[key]
+    
+    async def acquire(self) -> Optional[str]:
+        """Wait for a concurrency slot; returns the rejection reason when the request is shed"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.counters["rejected_queue_full"] += 1
+                return "queue_full"
+            self.waiting += 1
+            self.queued_requests += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.waiting)
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.counters["rejected_queue_timeout"] += 1
+                return "queue_timeout"
+            finally:
+                self.waiting -= 1
+                self.total_wait_seconds += time.monotonic() - started
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        self.counters["admitted"] += 1
+        return None
+    
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+    
+    def metrics(self) -> dict:
+        return {
+            **self.counters,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "average_queue_wait_seconds": round(self.total_wait_seconds / self.queued_requests, 4) if self.queued_requests else 0.0,
+            "tracked_clients": len(self._buckets),
+            "limits": {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "queue_timeout_seconds": self.queue_timeout,
+            },
+        }
+
+class AdmissionControlMiddleware:
+    """ASGI middleware applying an AdmissionController to HTTP requests"""
+    
+    def __init__(self, app, controller: AdmissionController, exempt_paths: Iterable[str] = (), trusted_proxy_hops: int = 0):
+        self.app = app
+        self.controller = controller
+        self.exempt_paths = frozenset(exempt_paths)
+        self.trusted_proxy_hops = trusted_proxy_hops
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        
+        retry_after = self.controller.check_rate(self.client_key(scope))
+        if retry_after is not None:
+            await self.reject(send, 429, "リクエストが多すぎます。しばらく待ってから再試行してください。", retry_after)
+            return
+        
+        reason = await self.controller.acquire()
+        if reason is not None:
+            logger.warning(f"混雑のためリクエストを拒否しました ({reason}): {scope['method']} {scope['path']}")
+            await self.reject(send, 503, "サーバーが混雑しています。しばらく待ってから再試行してください。", self.controller.queue_timeout)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+    
+    def client_key(self, scope) -> str:
+        """The socket peer, or behind trusted_proxy_hops proxies the address the outermost one saw.
+        
+        Each trusted proxy appends one X-Forwarded-For entry, so the client is the n-th entry from
+        the right; anything further left was sent by the client and is ignored.
+        """
+        if self.trusted_proxy_hops > 0:
+            forwarded = [hop.strip() for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+                         for hop in value.decode("latin-1").split(",") if hop.strip()]
+            if len(forwarded) >= self.trusted_proxy_hops:
+                return forwarded[-self.trusted_proxy_hops]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+    
+    @staticmethod
+    async def reject(send, status_code: int, detail: str, retry_after: float) -> None:
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+admission_controller = AdmissionController(
+    rate=float(os.environ.get('RATE_LIMIT_PER_SECOND', '20')),
+    burst=float(os.environ.get('RATE_LIMIT_BURST', '40')),
+    max_concurrent=int(os.environ.get('MAX_CONCURRENT_REQUESTS', '20')),
+    max_queue=int(os.environ.get('MAX_QUEUED_REQUESTS', '100')),
+    queue_timeout=float(os.environ.get('QUEUE_TIMEOUT_SECONDS', '5')),
+)
+
+# X-Forwarded-For はクライアントが自由に付けられるため、信頼できるプロキシの段数を設定した場合だけ使う
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+# ヘルスチェックと監視用エンドポイントは制限の対象外
+ADMISSION_EXEMPT_PATHS = ["/api/health", "/health", "/api/health/live", "/health/live", "/api/health/ready", "/health/ready", "/api/admin/metrics", "/admin/metrics"]
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -74,140 +699,306 @@ api_router = APIRouter(prefix="/api")
 # Japan Standard Time timezone
 JST = pytz.timezone('Asia/Tokyo')
 
+# ベンチ登録情報（benches コレクション）のインメモリキャッシュ
+DEFAULT_BENCHES = [
+    {"id": "front", "name": "手前", "room": None, "order": 0, "active": True},
+    {"id": "back", "name": "奥", "room": None, "order": 1, "active": True},
+]
+BENCH_REGISTRY_TTL_SECONDS = float(os.environ.get('BENCH_REGISTRY_TTL_SECONDS', '60'))
+
+class BenchRegistry:
+    """In-memory view of the benches collection.
+    
+    Request validation only reads this cache, so it never costs a query. The cache
+    is reloaded right after bench writes on this instance and otherwise at most
+    once per BENCH_REGISTRY_TTL_SECONDS to pick up changes made elsewhere.
+    """
+    
+    def __init__(self, defaults: List[dict]):
+        self._loaded_at: Optional[float] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._conflict_locks: Dict[str, asyncio.Lock] = {}
+        self._set(defaults)
+    
+    def _set(self, benches: List[dict]) -> None:
+        benches = sorted(benches, key=lambda b: (b.get("room") or "", b.get("order") or 0, b["id"]))
+        self._benches = {bench["id"]: bench for bench in benches}
+        self._active_ids = [bench["id"] for bench in benches if bench.get("active", True)]
+        self._active_set = frozenset(self._active_ids)
+        self._by_room: Dict[Optional[str], List[dict]] = {}
+        for bench in benches:
+            if bench.get("active", True):
+                self._by_room.setdefault(bench.get("room"), []).append(self.public(bench))
+    
+    @staticmethod
+    def public(bench: dict) -> dict:
+        return {"id": bench["id"], "name": bench["name"], "room": bench.get("room"), "active": bench.get("active", True)}
+    
+    def is_active(self, bench_id: str) -> bool:
+        return bench_id in self._active_set
+    
+    def is_known(self, bench_id: str) -> bool:
+        return bench_id in self._benches
+    
+    def active_ids(self) -> List[str]:
+        return self._active_ids
+    
+    def get(self, bench_id: str) -> Optional[dict]:
+        return self._benches.get(bench_id)
+    
+    def listing(self, room: Optional[str] = None) -> List[dict]:
+        if room is not None:
+            return self._by_room.get(room, [])
+        return [bench for benches in self._by_room.values() for bench in benches]
+    
+    def rooms(self) -> List[Optional[str]]:
+        return list(self._by_room.keys())
+    
+    def conflict_lock(self, bench_id: str) -> asyncio.Lock:
+        """Per-bench lock serializing conflict check and write on this instance (created on first use)"""
+        lock = self._conflict_locks.get(bench_id)
+        if lock is None:
+            lock = self._conflict_locks[bench_id] = asyncio.Lock()
+        return lock
+    
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= BENCH_REGISTRY_TTL_SECONDS
+    
+    async def refresh(self, force: bool = False) -> None:
+        if not force and not self.is_stale():
+            return
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if not force and not self.is_stale():
+                return
+            benches = await db.benches.find({}, {"_id": False}).to_list(None)
+            if not benches:
+                # 初回起動時は従来の2台を登録
+                try:
+                    await db.benches.insert_many([dict(bench) for bench in DEFAULT_BENCHES], ordered=False)
+                except BulkWriteError:
+                    pass  # 他のインスタンスが同時に登録済み
+                benches = await db.benches.find({}, {"_id": False}).to_list(None)
+            self._set(benches)
+            self._loaded_at = time.monotonic()
+            logger.info(f"ベンチ登録情報を読み込みました: {len(self._active_ids)}台")
+    
+    async def ensure_fresh(self) -> None:
+        """Reload when stale; a failed reload keeps serving the previous view"""
+        if self.is_stale():
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"ベンチ登録情報の読み込みに失敗しました: {str(e)}")
+
+bench_registry = BenchRegistry(DEFAULT_BENCHES)
+
+async def refresh_bench_registry():
+    """Route dependency: reload a stale registry before the request body is validated against it"""
+    await bench_registry.ensure_fresh()
+
+# 管理用エンドポイントの認証（ADMIN_TOKEN が未設定の場合は拒否する）
+# ローカル開発などで認証なしにするには ADMIN_AUTH_DISABLED=true を明示する
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+ADMIN_AUTH_DISABLED = os.environ.get('ADMIN_AUTH_DISABLED', 'false').lower() == 'true'
+
+async def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        if ADMIN_AUTH_DISABLED:
+            return
+        raise HTTPException(status_code=503, detail="管理者トークン（ADMIN_TOKEN）が設定されていないため、管理用エンドポイントは使用できません")
+    if not (x_admin_token and hmac.compare_digest(x_admin_token, ADMIN_TOKEN)):
+        raise HTTPException(status_code=403, detail="管理者トークンが必要です")
+
+# 一括削除で一度に扱う最大件数
+BULK_DELETE_MAX = 1000
+
+def normalize_user_key(user_name: str) -> str:
+    """Lookup key for a user name: NFKC-normalized (full/half width), whitespace-collapsed and case-folded"""
+    return " ".join(unicodedata.normalize("NFKC", user_name).split()).casefold()
+
+# 入力検証で使う正規表現（呼び出しごとにコンパイルしない）
+USER_NAME_FORBIDDEN_CHARS = re.compile(r'[<>"\'\&]')
+BENCH_ID_PATTERN = re.compile(r'[a-z0-9][a-z0-9_-]{0,31}')
+
+def normalize_jst_time(value: str) -> str:
+    """Validator for time fields: any accepted time format -> JST ISO string"""
+    try:
+        return parse_jst_time(value).isoformat()
+    except Exception as e:
+        raise ValueError(f'Invalid time format: {str(e)}')
+
+def normalize_date(value: str) -> str:
+    """Validator for date fields: any accepted date format -> YYYY-MM-DD"""
+    try:
+        return parser.parse(value).date().isoformat()
+    except Exception as e:
+        raise ValueError(f'Invalid date format: {str(e)}')
+
+def validate_user_name(value: str) -> str:
+    value = value.strip()
+    if not value:
+        raise ValueError('user_name is required')
+    # 長さ制限（1-50文字）
+    if len(value) > 50:
+        raise ValueError('利用者名は1文字以上50文字以下で入力してください')
+    # 危険な文字の除外
+    if USER_NAME_FORBIDDEN_CHARS.search(value):
+        raise ValueError('利用者名に使用できない文字が含まれています')
+    return value
+
+JstTime = Annotated[str, AfterValidator(normalize_jst_time)]  # 保存形式の JST ISO 文字列に正規化
+IsoDate = Annotated[str, AfterValidator(normalize_date)]      # YYYY-MM-DD に正規化
+UserName = Annotated[str, AfterValidator(validate_user_name)]
+
 # Define Models
 class ReservationCreate(BaseModel):
-    bench_id: str  # "front" or "back"
-    user_name: str
-    start_time: str  # ISO format string
-    end_time: str    # ISO format string
+    bench_id: str  # 登録済みのベンチID（benches コレクション）
+    user_name: UserName
+    user_key: Optional[str] = Field(default=None, validate_default=True)  # 利用者検索用の正規化キー（user_name から導出）
+    start_time: JstTime
+    end_time: JstTime
     
-    @validator('bench_id')
-    def validate_bench_id(cls, v):
-        if v not in ['front', 'back']:
-            raise ValueError('bench_id must be either "front" or "back"')
+    @field_validator('bench_id')
+    @classmethod
+    def validate_bench_id(cls, v: str) -> str:
+        if not bench_registry.is_active(v):
+            raise ValueError(f'bench_id "{v}" は登録されていません')
         return v
     
-    @validator('user_name')
-    def validate_user_name(cls, v):
-        if not v or not v.strip():
-            raise ValueError('user_name is required')
-        # 長さ制限（1-50文字）
-        v = v.strip()
-        if len(v) < 1 or len(v) > 50:
-            raise ValueError('利用者名は1文字以上50文字以下で入力してください')
-        # 危険な文字の除外
-        import re
-        if re.search(r'[<>"\'\&]', v):
-            raise ValueError('利用者名に使用できない文字が含まれています')
-        return v
-    
-    @validator('start_time', 'end_time')
-    def validate_time_format(cls, v):
-        try:
-            # Parse the time string and convert to JST
-            dt = parser.parse(v)
-            if dt.tzinfo is None:
-                # If no timezone info, assume JST
-                dt = JST.localize(dt)
-            return dt.astimezone(JST).isoformat()
-        except Exception as e:
-            raise ValueError(f'Invalid time format: {str(e)}')
+    @field_validator('user_key')
+    @classmethod
+    def derive_user_key(cls, v: Optional[str], info: ValidationInfo) -> Optional[str]:
+        # クライアントから送られた値は使わず、検証済みの user_name から導出する
+        user_name = info.data.get('user_name')
+        return normalize_user_key(user_name) if user_name else None
 
 class Reservation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     bench_id: str
     user_name: str
+    user_key: Optional[str] = None
     start_time: str
     end_time: str
     created_at: str = Field(default_factory=lambda: datetime.now(JST).isoformat())
-    
+    version: int = 1
+
+# 一覧の検証・シリアライズ用（モデルごとに1回だけ生成）
+RESERVATION_LIST_ADAPTER = TypeAdapter(List[Reservation])
+
+def dump_reservation_list(reservations: List[Reservation]) -> List[dict]:
+    """JSON-compatible dicts for a list of reservations in one pass"""
+    return RESERVATION_LIST_ADAPTER.dump_python(reservations, mode="json")
+
 class ReservationUpdate(BaseModel):
-    user_name: Optional[str] = None
-    start_time: Optional[str] = None
-    end_time: Optional[str] = None
+    user_name: Optional[UserName] = None
+    start_time: Optional[JstTime] = None
+    end_time: Optional[JstTime] = None
+
+class BenchCreate(BaseModel):
+    id: str
+    name: str
+    room: Optional[str] = None
+    order: int = 0
     
-    @validator('start_time', 'end_time')
-    def validate_time_format(cls, v):
-        if v is not None:
-            try:
-                dt = parser.parse(v)
-                if dt.tzinfo is None:
-                    dt = JST.localize(dt)
-                return dt.astimezone(JST).isoformat()
-            except Exception as e:
-                raise ValueError(f'Invalid time format: {str(e)}')
+    @field_validator('id')
+    @classmethod
+    def validate_id(cls, v: str) -> str:
+        if not BENCH_ID_PATTERN.fullmatch(v):
+            raise ValueError('ベンチIDは英小文字・数字・"-"・"_"の32文字以内で入力してください')
+        return v
+    
+    @field_validator('name')
+    @classmethod
+    def validate_name(cls, v: str) -> str:
+        v = v.strip()
+        if not 1 <= len(v) <= 50:
+            raise ValueError('ベンチ名は1文字以上50文字以下で入力してください')
+        return v
+
+class BenchUpdate(BaseModel):
+    name: Optional[str] = None
+    room: Optional[str] = None
+    order: Optional[int] = None
+    active: Optional[bool] = None
+
+class BulkDeleteRequest(BaseModel):
+    ids: Optional[List[str]] = None
+    bench_id: Optional[str] = None
+    date_from: Optional[IsoDate] = None  # YYYY-MM-DD（この日を含む）
+    date_to: Optional[IsoDate] = None    # YYYY-MM-DD（この日を含む）
+    
+    @field_validator('ids')
+    @classmethod
+    def validate_ids(cls, v: Optional[List[str]]) -> Optional[List[str]]:
+        if v is not None and not 1 <= len(v) <= BULK_DELETE_MAX:
+            raise ValueError(f'ids は1件以上{BULK_DELETE_MAX}件以下で指定してください')
         return v
 
 # Utility functions for time handling
 def parse_jst_time(time_str: str) -> datetime:
     """Parse time string and convert to JST datetime object"""
-    dt = parser.parse(time_str)
+    try:
+        # ISO 形式（保存形式・toISOString()）は標準ライブラリで解析し、それ以外の形式は dateutil に任せる
+        dt = datetime.fromisoformat(time_str)
+    except ValueError:
+        dt = parser.parse(time_str)
     if dt.tzinfo is None:
         dt = JST.localize(dt)
     return dt.astimezone(JST)
 
-def check_time_overlap(start1: str, end1: str, start2: str, end2: str) -> bool:
-    """Check if two time ranges overlap"""
-    dt_start1 = parse_jst_time(start1)
-    dt_end1 = parse_jst_time(end1)
-    dt_start2 = parse_jst_time(start2)
-    dt_end2 = parse_jst_time(end2)
-    
-    # Two ranges overlap if one starts before the other ends
-    return dt_start1 < dt_end2 and dt_start2 < dt_end1
-
-async def check_double_booking(bench_id: str, start_time: str, end_time: str, exclude_id: str = None) -> bool:
-    """Check if a reservation would conflict with existing reservations"""
-    # Build query to find overlapping reservations
-    query = {"bench_id": bench_id}
-    if exclude_id:
-        query["id"] = {"$ne": exclude_id}
+def build_reservation_list(reservations: List[dict]) -> List[Reservation]:
+    """DBから取得した予約を検証し、開始時刻順のレスポンスモデルに変換"""
+    # 無効なデータをフィルタリング
+    valid_reservations = []
+    for reservation in reservations:
+        if all(key in reservation for key in ['id', 'bench_id', 'user_name', 'start_time', 'end_time']):
+            valid_reservations.append(reservation)
+        else:
+            logger.warning(f"無効な予約データを検出: {reservation}")
     
-    existing_reservations = await db.reservations.find(query).to_list(1000)
+    # 開始時刻でソート
+    valid_reservations.sort(key=lambda x: x['start_time'])
+    logger.info(f"有効な予約数: {len(valid_reservations)}")
     
-    for reservation in existing_reservations:
-        if check_time_overlap(start_time, end_time, reservation['start_time'], reservation['end_time']):
-            return True
+    return RESERVATION_LIST_ADAPTER.validate_python(valid_reservations)
+
+def jst_date_range_query(date_from: str, date_to: str) -> dict:
+    """start_time filter covering JST dates date_from..date_to (both inclusive, YYYY-MM-DD)"""
+    start = JST.localize(datetime.combine(parser.parse(date_from).date(), datetime.min.time()))
+    end = JST.localize(datetime.combine(parser.parse(date_to).date() + timedelta(days=1), datetime.min.time()))
+    return {"$gte": start.isoformat(), "$lt": end.isoformat()}
+
+def overlap_query(start_time: str, end_time: str) -> dict:
+    """Mongo filter for reservations overlapping the given range.
     
-    return False
+    Times are stored as normalized JST ISO strings, so string comparison matches time order.
+    """
+    return {"start_time": {"$lt": end_time}, "end_time": {"$gt": start_time}}
 
-# API Routes
-@api_router.get("/")
-async def root():
-    return {"message": "ベンチ予約システム API", "current_time_jst": datetime.now(JST).isoformat()}
+def version_condition(version: int):
+    """Match a reservation version; documents created before versioning count as version 1"""
+    return {"$in": [version, None]} if version == 1 else version
 
-@api_router.get("/health")
-async def health_check():
-    """System health check endpoint"""
+def reservation_etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Parse an If-Match header into the expected reservation version ('*' matches any)"""
+    if if_match is None or if_match.strip() == '*':
+        return None
+    value = if_match.strip()
+    if value.startswith('W/'):
+        value = value[2:]
     try:
-        # MongoDB接続テスト
-        start_time = datetime.now()
-        await asyncio.wait_for(
-            db.reservations.find_one(),
-            timeout=5.0
-        )
-        response_time = (datetime.now() - start_time).total_seconds()
-        
-        return {
-            "status": "healthy",
-            "timestamp": datetime.now(JST).isoformat(),
-            "database": "connected",
-            "database_response_time": f"{response_time:.3f}s"
-        }
-    except asyncio.TimeoutError:
-        logger.error("ヘルスチェック: データベース接続タイムアウト")
-        raise HTTPException(status_code=503, detail="データベース接続タイムアウト")
-    except Exception as e:
-        logger.error(f"ヘルスチェック: {str(e)}")
-        raise HTTPException(status_code=503, detail=f"システムエラー: {str(e)}")
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Matchヘッダーの形式が正しくありません")
 
-@api_router.post("/reservations", response_model=Reservation)
-async def create_reservation(reservation_data: ReservationCreate):
-    """Create a new reservation"""
+def validate_booking_window(start_dt: datetime, end_dt: datetime) -> None:
+    """Booking rules shared by reservation creation and free-slot suggestions"""
     # Validate that end time is after start time
-    start_dt = parse_jst_time(reservation_data.start_time)
-    end_dt = parse_jst_time(reservation_data.end_time)
-    
     if start_dt >= end_dt:
         raise HTTPException(status_code=400, detail="終了時刻は開始時刻より後である必要があります")
     
@@ -218,229 +1009,2162 @@ async def create_reservation(reservation_data: ReservationCreate):
     # Validate 30-minute increments
     if start_dt.minute not in [0, 30] or end_dt.minute not in [0, 30]:
         raise HTTPException(status_code=400, detail="時刻は30分刻みで入力してください (例: 07:00, 07:30, 08:00)")
+
+async def check_double_booking(bench_id: str, start_time: str, end_time: str, exclude_id: str = None) -> bool:
+    """Check if a reservation would conflict with existing reservations"""
+    # (bench_id, start_time) インデックスを使って重なる予約を1件だけ探す
+    query = {"bench_id": bench_id, **overlap_query(start_time, end_time)}
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
     
-    # Check for double booking
-    if await check_double_booking(reservation_data.bench_id, reservation_data.start_time, reservation_data.end_time):
-        raise HTTPException(status_code=409, detail="この時間帯は既に予約されています")
+    return await db.reservations.find_one(query, {"_id": False, "id": True}) is not None
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight execution.
     
-    # Create reservation
-    reservation = Reservation(**reservation_data.dict())
+    The call runs in its own task, so a caller disconnecting does not cancel the
+    work other callers are waiting on. Results are not cached after completion.
+    """
     
-    # Insert into database
-    await db.reservations.insert_one(reservation.dict())
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.shared = 0
     
-    return reservation
-
-@api_router.get("/reservations", response_model=List[Reservation])
-async def get_reservations(date: Optional[str] = None, bench_id: Optional[str] = None):
-    """Get reservations with comprehensive error handling and optimization"""
-    logger.info(f"=== 予約取得リクエスト開始 ===")
-    logger.info(f"日付: {date}, ベンチID: {bench_id}")
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+            self.executions += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
     
-    # データベース接続確認
-    if not await ensure_database_connection():
-        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 待機者が全員キャンセルされた場合の "exception was never retrieved" を防ぐ
+            task.exception()
     
-    try:
-        query = {}
-        
-        # ベンチIDフィルター
-        if bench_id:
-            if bench_id not in ['front', 'back']:
-                raise HTTPException(status_code=400, detail="無効なベンチIDです")
-            query["bench_id"] = bench_id
-        
-        # 日付フィルター（最適化）
-        if date:
-            try:
-                date_obj = parser.parse(date).date()
-                # 過去30日より古いデータは取得しない（パフォーマンス向上）
-                min_date = datetime.now().date() - timedelta(days=30)
-                if date_obj < min_date:
-                    logger.info(f"古すぎる日付のリクエスト: {date}")
-                    return []  # 空のリストを返す
-                
-                start_of_day = JST.localize(datetime.combine(date_obj, datetime.min.time()))
-                end_of_day = JST.localize(datetime.combine(date_obj, datetime.max.time()))
-                
-                query["start_time"] = {
-                    "$gte": start_of_day.isoformat(),
-                    "$lt": end_of_day.isoformat()
-                }
-                logger.info(f"日付フィルター: {start_of_day.isoformat()} - {end_of_day.isoformat()}")
-                
-            except Exception as date_error:
-                logger.error(f"日付解析エラー: {str(date_error)}")
-                raise HTTPException(status_code=400, detail="無効な日付形式です")
-        
-        logger.info(f"MongoDB クエリ: {query}")
-        
-        # データベースクエリの実行（複数段階のタイムアウト）
-        reservations = []
-        for attempt in range(3):  # 最大3回試行
-            try:
-                logger.info(f"データベースクエリ実行（試行 {attempt + 1}/3）")
-                reservations = await asyncio.wait_for(
-                    db.reservations.find(query).to_list(500),  # 制限を500に削減
-                    timeout=5.0 + (attempt * 2)  # 段階的にタイムアウトを延長
-                )
-                logger.info(f"取得された予約数: {len(reservations)}")
-                break  # 成功したらループを抜ける
-                
-            except asyncio.TimeoutError:
-                logger.warning(f"データベースクエリタイムアウト（試行 {attempt + 1}）")
-                if attempt == 2:  # 最後の試行
-                    # 接続状態を不健全にマーク
-                    connection_status["healthy"] = False
-                    raise HTTPException(
-                        status_code=504, 
-                        detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。"
-                    )
-                await asyncio.sleep(1)  # 1秒待機してリトライ
-                
-            except Exception as db_error:
-                logger.error(f"データベースエラー（試行 {attempt + 1}）: {str(db_error)}")
-                if attempt == 2:  # 最後の試行
-                    connection_status["healthy"] = False
-                    raise HTTPException(
-                        status_code=500, 
-                        detail="データベースエラーが発生しました。システム管理者にお問い合わせください。"
-                    )
-                await asyncio.sleep(1)
-        
-        # データ検証とソート
-        try:
-            # 無効なデータをフィルタリング
-            valid_reservations = []
-            for reservation in reservations:
-                if all(key in reservation for key in ['id', 'bench_id', 'user_name', 'start_time', 'end_time']):
-                    valid_reservations.append(reservation)
-                else:
-                    logger.warning(f"無効な予約データを検出: {reservation}")
-            
-            # 開始時刻でソート
-            valid_reservations.sort(key=lambda x: x['start_time'])
-            logger.info(f"有効な予約数: {len(valid_reservations)}")
-            
-            return [Reservation(**reservation) for reservation in valid_reservations]
-            
-        except Exception as process_error:
-            logger.error(f"データ処理エラー: {str(process_error)}")
-            raise HTTPException(status_code=500, detail="予約データの処理中にエラーが発生しました")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"=== 予約取得処理中に予期しないエラー発生 ===")
-        logger.error(f"エラー内容: {str(e)}")
-        logger.error(f"エラータイプ: {type(e)}")
-        connection_status["healthy"] = False
-        raise HTTPException(
-            status_code=500, 
-            detail="予約取得処理中に予期しないエラーが発生しました。しばらく待ってから再試行してください。"
-        )
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "executions": self.executions, "shared": self.shared}
 
-@api_router.get("/reservations/{reservation_id}", response_model=Reservation)
-async def get_reservation(reservation_id: str):
-    """Get a specific reservation"""
-    reservation = await db.reservations.find_one({"id": reservation_id})
-    if not reservation:
-        raise HTTPException(status_code=404, detail="予約が見つかりません")
-    
-    return Reservation(**reservation)
+# 予約一覧の読み込みを同時リクエスト間で共有
+reservation_reads = SingleFlight()
 
-@api_router.put("/reservations/{reservation_id}", response_model=Reservation)
-async def update_reservation(reservation_id: str, update_data: ReservationUpdate):
-    """Update a reservation"""
-    # Get existing reservation
-    existing = await db.reservations.find_one({"id": reservation_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="予約が見つかりません")
+# 読み込みキャッシュ（L1: プロセス内 LRU、L2: REDIS_URL を設定した場合の Redis 互換ストア）
+# キーには元データの変更カウンター（日付ごと・全体）を含め、書き込み時はカウンターを進めるだけで無効化する
+# L2 を使う場合はカウンターも Redis に置くため、他のインスタンスの書き込みも次の読み込みから反映される
+# L2 がない（または応答しない）場合は、書き込みのたびに進む変更履歴の連番（counters）もキーに含め、
+# 他のワーカー・インスタンスの書き込みを次の読み込みから反映する（読み込みごとに _id 指定の find_one が1回増える）
+READ_CACHE_TTL_SECONDS = float(os.environ.get('READ_CACHE_TTL_SECONDS', '30'))
+READ_CACHE_MAX_ENTRIES = int(os.environ.get('READ_CACHE_MAX_ENTRIES', '1024'))
+REDIS_URL = os.environ.get('REDIS_URL')
+
+class TwoTierCache:
+    """Version-stamped read cache: an in-process LRU (L1) in front of an optional Redis-protocol store (L2).
     
-    # Prepare update data
-    update_dict = {}
-    for field, value in update_data.dict(exclude_unset=True).items():
-        if value is not None:
-            update_dict[field] = value
+    Entries are keyed by the current versions of the scopes they were built from, so bumping a
+    scope makes every dependent entry unreachable; stale entries simply expire. Concurrent misses
+    for the same key share one load. L2 failures are logged and fall back to L1 and the database.
     
-    if not update_dict:
-        raise HTTPException(status_code=400, detail="更新するデータがありません")
+    Without L2, bumps only reach this process; shared_version (a counter every writer advances,
+    read from the database) is then added to the key so writes elsewhere invalidate L1 too.
+    """
     
-    # If updating times, validate them
-    start_time = update_dict.get('start_time', existing['start_time'])
-    end_time = update_dict.get('end_time', existing['end_time'])
+    def __init__(self, redis=None, max_entries: int = 1024, ttl_seconds: float = 30.0, prefix: str = "bench-cache:",
+                 shared_version: Optional[Callable[[], Awaitable[int]]] = None):
+        self.redis = redis
+        self.shared_version = shared_version
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.local_versions: Dict[str, int] = {}
+        self.loads = SingleFlight()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.l2_errors = 0
     
-    start_dt = parse_jst_time(start_time)
-    end_dt = parse_jst_time(end_time)
+    def _l2_failed(self, operation: str, error: Exception) -> None:
+        self.l2_errors += 1
+        logger.warning(f"L2キャッシュの{operation}に失敗しました: {str(error)}")
     
-    if start_dt >= end_dt:
-        raise HTTPException(status_code=400, detail="終了時刻は開始時刻より後である必要があります")
+    async def versions(self, scopes: List[str]) -> Tuple[str, ...]:
+        if self.redis is not None:
+            try:
+                values = await self.redis.mget([f"{self.prefix}version:{scope}" for scope in scopes])
+                return ("r", *(str(int(value or 0)) for value in values))
+            except Exception as e:
+                self._l2_failed("バージョン取得", e)
+        # ローカルのカウンターで作ったキーは Redis のカウンターで作ったキーと衝突しないよう区別する
+        local = tuple(str(self.local_versions.get(scope, 0)) for scope in scopes)
+        if self.shared_version is not None:
+            return ("d", str(await self.shared_version()), *local)
+        return ("l", *local)
     
-    # Check for double booking (exclude current reservation)
-    if await check_double_booking(existing['bench_id'], start_time, end_time, reservation_id):
-        raise HTTPException(status_code=409, detail="この時間帯は既に予約されています")
+    async def bump(self, scopes: Iterable[str]) -> None:
+        scopes = list(scopes)
+        for scope in scopes:
+            self.local_versions[scope] = self.local_versions.get(scope, 0) + 1
+        if self.redis is not None and scopes:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for scope in scopes:
+                        pipe.incr(f"{self.prefix}version:{scope}")
+                    await pipe.execute()
+            except Exception as e:
+                self._l2_failed("バージョン更新", e)
     
-    # Update reservation
-    await db.reservations.update_one(
-        {"id": reservation_id},
-        {"$set": update_dict}
-    )
+    async def get_or_load(self, key: str, scopes: List[str], loader: Callable[[], Awaitable[Any]],
+                          encode: Optional[Callable[[Any], bytes]] = None,
+                          decode: Optional[Callable[[bytes], Any]] = None) -> Tuple[Any, str]:
+        """The cached value for key at the scopes' current versions, and where it came from ("l1", "l2" or "load").
+        
+        Values are shared between callers and must not be mutated. L2 is only used when encode and decode are given.
+        """
+        stamped_key = f"{key}@{'.'.join(await self.versions(scopes))}"
+        entry = self.entries.get(stamped_key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.entries.move_to_end(stamped_key)
+            self.l1_hits += 1
+            return entry[1], "l1"
+        return await self.loads.do(stamped_key, lambda: self._fill(stamped_key, loader, encode, decode))
+    
+    async def _fill(self, stamped_key: str, loader, encode, decode) -> Tuple[Any, str]:
+        use_l2 = self.redis is not None and encode is not None and decode is not None
+        if use_l2:
+            try:
+                raw = await self.redis.get(self.prefix + stamped_key)
+            except Exception as e:
+                self._l2_failed("読み込み", e)
+                raw = None
+            if raw is not None:
+                value = decode(raw)
+                self._store(stamped_key, value)
+                self.l2_hits += 1
+                return value, "l2"
+        
+        value = await loader()
+        self.misses += 1
+        self._store(stamped_key, value)
+        if use_l2:
+            try:
+                await self.redis.set(self.prefix + stamped_key, encode(value), ex=max(1, math.ceil(self.ttl_seconds)))
+            except Exception as e:
+                self._l2_failed("書き込み", e)
+        return value, "load"
+    
+    def _store(self, stamped_key: str, value: Any) -> None:
+        self.entries[stamped_key] = (time.monotonic() + self.ttl_seconds, value)
+        self.entries.move_to_end(stamped_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    async def close(self) -> None:
+        if self.redis is not None:
+            close = getattr(self.redis, "aclose", None) or self.redis.close
+            await close()
+    
+    def stats(self) -> dict:
+        return {
+            "l1_entries": len(self.entries),
+            "l1_hits": self.l1_hits,
+            "l2": "redis" if self.redis is not None else ("unavailable" if REDIS_URL else "disabled"),
+            "l2_hits": self.l2_hits,
+            "l2_errors": self.l2_errors,
+            "misses": self.misses,
+            "loads": self.loads.stats()
+        }
+
+def create_read_cache() -> TwoTierCache:
+    redis = None
+    if REDIS_URL and redis_asyncio is not None:
+        # Redis が遅い・止まっている場合は短時間で諦めて DB から読む
+        redis = redis_asyncio.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    # read_cache_version はこの後で定義されるため、呼び出し時に参照する
+    return TwoTierCache(redis, max_entries=READ_CACHE_MAX_ENTRIES, ttl_seconds=READ_CACHE_TTL_SECONDS,
+                        shared_version=lambda: read_cache_version())
+
+read_cache = create_read_cache()
+
+def json_to_bytes(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def day_scopes(days: Iterable[str]) -> List[str]:
+    """Cache scopes for data read from the given days (cleanup bumps "epoch" to invalidate every day)"""
+    return ["epoch", *(f"day:{day}" for day in days)]
+
+# 日付ごとの変更カウンター（書き込みのたびに該当日と "any" を進め、キャッシュを無効化）
+def reservation_day(time_str: str) -> str:
+    """JST date (YYYY-MM-DD) a reservation time belongs to"""
+    return parse_jst_time(time_str).date().isoformat()
+
+async def mark_days_changed(days: Iterable[str]) -> None:
+    await read_cache.bump(["any", *(f"day:{day}" for day in days)])
+
+async def mark_all_days_changed() -> None:
+    await read_cache.bump(["epoch", "any"])
+
+async def days_version(days: Iterable[str]) -> Tuple[str, ...]:
+    return await read_cache.versions(day_scopes(days))
+
+# レスポンス形式のネゴシエーション
+# Accept で JSON / MessagePack、Accept-Encoding で br / gzip を選び、一覧系は layout=columns で列指向にできる
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+RESPONSE_LAYOUTS = ("rows", "columns")
+# これより小さい本文は圧縮しても効果が薄い
+COMPRESSION_MIN_BYTES = 1024
+
+def parse_accept_header(value: Optional[str]) -> List[Tuple[str, float]]:
+    """Parse an Accept / Accept-Encoding header into (token, q) pairs, highest q first"""
+    items = []
+    for index, part in enumerate((value or "").split(",")):
+        token, *params = [piece.strip() for piece in part.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, raw = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(raw)
+                except ValueError:
+                    q = 0.0
+        items.append((token.lower(), q, index))
+    items.sort(key=lambda item: (-item[1], item[2]))
+    return [(token, q) for token, q, _ in items]
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """Pick the response media type; None when nothing acceptable is available"""
+    if not accept:
+        return "application/json"
+    available = ["application/json", *(MSGPACK_MEDIA_TYPES if msgpack is not None else ())]
+    for token, q in parse_accept_header(accept):
+        if q <= 0:
+            continue
+        if token in available:
+            return token
+        if token in ("*/*", "application/*"):
+            return "application/json"
+    return None
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick br or gzip from Accept-Encoding (br wins ties); None means identity"""
+    accepted = dict(parse_accept_header(accept_encoding))
+    supported = (["br"] if brotli is not None else []) + ["gzip"]
+    candidates = [encoding for encoding in supported if accepted.get(encoding, accepted.get("*", 0)) > 0]
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get("*", 0)), default=None)
+
+def validate_layout(layout: str) -> None:
+    if layout not in RESPONSE_LAYOUTS:
+        raise HTTPException(status_code=400, detail="layout には rows または columns を指定してください")
+
+def reservations_to_columns(rows: List[dict]) -> dict:
+    """Columnar layout: one array per field instead of one object per reservation"""
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+    return {"count": len(rows), "columns": {field: [row.get(field) for row in rows] for field in fields}}
+
+class EncodedPayload:
+    """A JSON-compatible response body shared between readers and caches.
+    
+    Each (format, layout, content encoding) combination is serialized at most once,
+    so coalesced and cached readers asking for the same representation share the bytes.
+    """
+    
+    def __init__(self, data: Any, to_columns: Optional[Callable[[Any], Any]] = None):
+        self.data = data
+        self.to_columns = to_columns
+        self._encoded: Dict[Tuple[str, str, Optional[str]], bytes] = {}
+    
+    def encode(self, body_format: str, layout: str, encoding: Optional[str] = None) -> bytes:
+        key = (body_format, layout, encoding)
+        body = self._encoded.get(key)
+        if body is not None:
+            return body
+        if encoding == "br":
+            body = brotli.compress(self.encode(body_format, layout), quality=5)
+        elif encoding == "gzip":
+            body = gzip.compress(self.encode(body_format, layout), compresslevel=6)
+        else:
+            data = self.to_columns(self.data) if layout == "columns" and self.to_columns else self.data
+            if body_format == "msgpack":
+                body = msgpack.packb(data, use_bin_type=True)
+            else:
+                body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        self._encoded[key] = body
+        return body
+    
+    @classmethod
+    def from_json(cls, body: bytes, to_columns: Optional[Callable[[Any], Any]] = None) -> "EncodedPayload":
+        """Rebuild a payload from its JSON rows encoding, reusing those bytes for JSON responses"""
+        payload = cls(json.loads(body), to_columns)
+        payload._encoded[("json", "rows", None)] = body
+        return payload
+
+def payload_to_bytes(payload: EncodedPayload) -> bytes:
+    return payload.encode("json", "rows")
+
+def reservations_payload_from_bytes(body: bytes) -> EncodedPayload:
+    return EncodedPayload.from_json(body, reservations_to_columns)
+
+# X-Cache ヘッダー（読み込みキャッシュのどこから返したか）
+CACHE_SOURCE_HEADERS = {"l1": "HIT-L1", "l2": "HIT-L2", "load": "MISS"}
+
+def negotiated_response(request: Request, payload: EncodedPayload, layout: str = "rows",
+                        headers: Optional[Dict[str, str]] = None) -> Response:
+    """Render a payload in the representation the client asked for"""
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(status_code=406, detail="対応していないレスポンス形式です（application/json または application/msgpack を指定してください）")
+    body_format = "msgpack" if media_type in MSGPACK_MEDIA_TYPES else "json"
+    body = payload.encode(body_format, layout)
+    response_headers = {"Vary": "Accept, Accept-Encoding", **(headers or {})}
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            body = payload.encode(body_format, layout, encoding)
+            response_headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=response_headers)
+
+# 日付ごとのスナップショット（day_snapshots）
+# 1日分の予約を開始時刻順・レスポンスの形で1ドキュメントに保持し、日表示を _id による find_one 1回で返す
+# 書き込み時は予約の変更と該当日のスナップショットの更新を1つのトランザクションで行う（レプリカセットの場合）
+day_snapshot_status = {"transactions": False}
+
+async def detect_transaction_support() -> bool:
+    """Transactions need a replica set member or mongos"""
+    hello = await client.admin.command("hello")
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+def build_day_snapshot(day: str, reservations: List[dict], seq: int) -> dict:
+    return {
+        "_id": day,
+        "seq": seq,
+        "reservations": dump_reservation_list(build_reservation_list(reservations)),
+        "updated_at": datetime.now(JST).isoformat()
+    }
+
+async def refresh_day_snapshots(days: Iterable[str], session=None) -> None:
+    """Rebuild the given days' snapshots from the reservations collection.
+    
+    Each refresh bumps the day's seq before reading and only writes if the seq is unchanged,
+    so without a transaction an older reader cannot overwrite a newer list: the last writer
+    to bump the seq reads every write made before it.
+    """
+    for day in sorted(set(days)):
+        marker = await db.day_snapshots.find_one_and_update(
+            {"_id": day}, {"$inc": {"seq": 1}},
+            projection={"seq": True}, upsert=True, return_document=ReturnDocument.AFTER, session=session
+        )
+        reservations = await db.reservations.find(
+            {"start_time": jst_date_range_query(day, day)}, {"_id": False}, session=session
+        ).to_list(None)
+        await db.day_snapshots.replace_one(
+            {"_id": day, "seq": marker["seq"]}, build_day_snapshot(day, reservations, marker["seq"]), session=session
+        )
+
+async def commit_reservation_write(write: Callable[[Any], Awaitable[Tuple[Any, Iterable[str], List[dict]]]]) -> Any:
+    """Run write(session) -> (result, changed_days, events), append the events and refresh the changed days' snapshots.
+    
+    On replica sets all of it runs in one transaction (retried on transient errors). On a standalone
+    server the write is already committed when the follow-up steps run, so their failures are logged
+    instead of failing the request (a retry would otherwise conflict with its own write); a failed
+    refresh drops the snapshots so reads rebuild them.
+    """
+    if day_snapshot_status["transactions"]:
+        async def in_transaction(session):
+            result, days, events = await write(session)
+            await append_reservation_events(events, session=session)
+            days = set(days)
+            await refresh_day_snapshots(days, session)
+            return result, days
+        
+        async with await client.start_session() as session:
+            result, days = await session.with_transaction(in_transaction)
+    else:
+        result, days, events = await write(None)
+        days = set(days)
+        try:
+            await append_reservation_events(events)
+        except Exception as e:
+            # 差分同期のクライアントにはこの変更が届かない（一覧・スナップショットには反映される）
+            logger.error(f"変更履歴の追記に失敗しました ({len(events)}件、書き込みは完了済み): {str(e)}")
+        try:
+            await refresh_day_snapshots(days)
+        except Exception as e:
+            logger.error(f"スナップショットの更新に失敗しました ({sorted(days)}): {str(e)}")
+            await db.day_snapshots.delete_many({"_id": {"$in": sorted(days)}})
+    
+    await mark_days_changed(days)
+    return result
+
+def database_unavailable(error: Exception) -> HTTPException:
+    """Mark the connection unhealthy and map a driver error to 504 (timeout) or 503 (unavailable)"""
+    connection_status["healthy"] = False
+    if isinstance(error, (asyncio.TimeoutError, NetworkTimeout, ExecutionTimeout)):
+        return HTTPException(status_code=504, detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。")
+    return HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+
+async def fetch_day_payload(day: str, bench_id: Optional[str] = None) -> EncodedPayload:
+    """One day's reservations from its snapshot, building the snapshot on first read"""
+    try:
+        snapshot = await asyncio.wait_for(db.day_snapshots.find_one({"_id": day}), timeout=5.0)
+        if snapshot is None or "reservations" not in snapshot:
+            # 未作成（または更新中）の日は予約コレクションから組み立てる
+            reservations = await asyncio.wait_for(
+                db.reservations.find({"start_time": jst_date_range_query(day, day)}, {"_id": False}).to_list(None),
+                timeout=10.0
+            )
+    except (asyncio.TimeoutError, PyMongoError) as e:
+        logger.error(f"日別スナップショットの取得に失敗しました（{day}）: {str(e)}")
+        raise database_unavailable(e)
+    
+    if snapshot is None or "reservations" not in snapshot:
+        built = build_day_snapshot(day, reservations, 0)
+        if snapshot is None:
+            try:
+                # 書き込み側の更新を上書きしないよう、存在しない場合のみ作成
+                await db.day_snapshots.insert_one(built)
+            except DuplicateKeyError:
+                pass
+            except PyMongoError as e:
+                logger.error(f"日別スナップショットの作成に失敗しました（{day}）: {str(e)}")
+                raise database_unavailable(e)
+        snapshot = built
+    
+    rows = snapshot["reservations"]
+    if bench_id:
+        rows = [row for row in rows if row["bench_id"] == bench_id]
+    return EncodedPayload(rows, reservations_to_columns)
+
+# 変更履歴（reservation_events）と差分同期（GET /changes）
+# 書き込みのたびに連番（seq）付きのイベントを同じトランザクションで追記し、クライアントは前回の seq 以降だけを取得する
+CHANGES_RETENTION_DAYS = int(os.environ.get('CHANGES_RETENTION_DAYS', '7'))
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 1000
+# 1回の差分取得で seq の連続性を確認する最大件数
+CHANGES_SCAN_LIMIT = 5000
+# これより古い seq の欠番は失敗した書き込み（トランザクションなし）とみなして読み飛ばす
+CHANGES_GAP_GRACE_SECONDS = 10.0
+
+def upsert_event(reservation: dict) -> dict:
+    return {
+        "op": "upsert",
+        "id": reservation["id"],
+        "day": reservation_day(reservation["start_time"]),
+        "bench_id": reservation.get("bench_id"),
+        "reservation": {key: value for key, value in reservation.items() if key != "_id"}
+    }
+
+def delete_event(reservation: dict) -> dict:
+    """Tombstone for a deleted reservation (or for the day it moved away from)"""
+    return {
+        "op": "delete",
+        "id": reservation["id"],
+        "day": reservation_day(reservation["start_time"]),
+        "bench_id": reservation.get("bench_id")
+    }
+
+async def append_reservation_events(events: List[dict], session=None) -> None:
+    """Append events under consecutive seq numbers, inside the write's transaction when it has one"""
+    if not events:
+        return
+    counter = await db.counters.find_one_and_update(
+        {"_id": "reservation_events"},
+        {"$inc": {"seq": len(events)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    first_seq = counter["seq"] - len(events) + 1
+    now = datetime.now(timezone.utc)
+    await db.reservation_events.insert_many(
+        [{**event, "seq": first_seq + offset, "at": now} for offset, event in enumerate(events)],
+        session=session
+    )
+
+async def current_event_seq() -> int:
+    counter = await db.counters.find_one({"_id": "reservation_events"})
+    return counter["seq"] if counter else 0
+
+async def read_cache_version() -> int:
+    """Event seq for read cache keys when there is no L2 (driver errors become 503/504)"""
+    try:
+        return await asyncio.wait_for(current_event_seq(), timeout=5.0)
+    except (asyncio.TimeoutError, PyMongoError) as e:
+        logger.error(f"読み込みキャッシュのバージョン取得に失敗しました: {str(e)}")
+        raise database_unavailable(e)
+
+def visible_event_watermark(since: int, events: List[dict]) -> int:
+    """Highest seq up to which every event after since is visible.
+    
+    A writer may commit seq n+1 before another commits seq n; stopping at such a gap keeps a
+    client from moving its cursor past an event it has not seen yet.
+    """
+    watermark = since
+    grace_cutoff = datetime.now(timezone.utc) - timedelta(seconds=CHANGES_GAP_GRACE_SECONDS)
+    for event in events:
+        if event["seq"] != watermark + 1:
+            at = event["at"] if event["at"].tzinfo else event["at"].replace(tzinfo=timezone.utc)
+            if at > grace_cutoff:
+                break
+        watermark = event["seq"]
+    return watermark
+
+def compact_changes(events: List[dict]) -> List[dict]:
+    """Keep only the latest change per reservation (and every purge), in seq order"""
+    latest: Dict[Any, dict] = {}
+    for event in events:
+        key = (event["op"], event["seq"]) if event["op"] == "purge" else ("reservation", event["id"], event["day"])
+        latest.pop(key, None)
+        latest[key] = event
+    return sorted(latest.values(), key=lambda event: event["seq"])
+
+@api_router.get("/changes")
+async def get_changes(request: Request, since: Optional[int] = None, date: Optional[str] = None,
+                      limit: int = CHANGES_DEFAULT_LIMIT):
+    """Reservation changes after seq `since` (optionally for one date), with tombstones for deletions"""
+    if not 1 <= limit <= CHANGES_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit は1以上{CHANGES_MAX_LIMIT}以下で指定してください")
+    day = None
+    if date:
+        try:
+            day = parser.parse(date).date().isoformat()
+        except Exception:
+            raise HTTPException(status_code=400, detail="無効な日付形式です")
+    
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    
+    current_seq = await current_event_seq()
+    body = {"since": since, "next_since": current_seq, "reset": False, "has_more": False, "changes": []}
+    if since is None or since < 0 or since > current_seq:
+        # 初回（または別のデータベースの seq）: 現在の seq を返し、一覧の全件取得からやり直してもらう
+        body["reset"] = True
+        return negotiated_response(request, EncodedPayload(body))
+    if since == current_seq:
+        return negotiated_response(request, EncodedPayload(body))
+    
+    oldest = await db.reservation_events.find_one({}, {"_id": False, "seq": True}, sort=[("seq", 1)])
+    if oldest is None or oldest["seq"] > since + 1:
+        # 保持期間を過ぎて削除されたイベントがある
+        body["reset"] = True
+        return negotiated_response(request, EncodedPayload(body))
+    
+    try:
+        scanned = await asyncio.wait_for(
+            db.reservation_events.find({"seq": {"$gt": since}}, {"_id": False, "seq": True, "at": True})
+            .sort("seq", 1).limit(CHANGES_SCAN_LIMIT).to_list(None),
+            timeout=5.0
+        )
+        watermark = visible_event_watermark(since, scanned)
+        query: Dict[str, Any] = {"seq": {"$gt": since, "$lte": watermark}}
+        if day:
+            query["$or"] = [{"day": day}, {"op": "purge", "before_day": {"$gt": day}}]
+        events = await asyncio.wait_for(
+            db.reservation_events.find(query, {"_id": False, "at": False}).sort("seq", 1).limit(limit + 1).to_list(None),
+            timeout=5.0
+        )
+    except asyncio.TimeoutError:
+        connection_status["healthy"] = False
+        raise HTTPException(status_code=504, detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。")
+    
+    if len(events) > limit:
+        events = events[:limit]
+        body["next_since"] = events[-1]["seq"]
+        body["has_more"] = True
+    else:
+        body["next_since"] = watermark
+        body["has_more"] = watermark < current_seq and len(scanned) == CHANGES_SCAN_LIMIT
+    body["changes"] = compact_changes(events)
+    return negotiated_response(request, EncodedPayload(body))
+
+class BookingConflict(HTTPException):
+    """409 for an already booked range, carrying nearby free intervals the client can offer instead"""
+    
+    def __init__(self, suggestions: dict):
+        super().__init__(status_code=409, detail="この時間帯は既に予約されています")
+        self.suggestions = suggestions
+
+def http_error_body(error: HTTPException) -> dict:
+    body = {"detail": error.detail}
+    if isinstance(error, BookingConflict):
+        body["suggestions"] = error.suggestions
+    return body
+
+@app.exception_handler(BookingConflict)
+async def booking_conflict_handler(request: Request, error: BookingConflict):
+    return JSONResponse(status_code=error.status_code, content=http_error_body(error))
+
+# Idempotency-Key 対応（書き込みリクエストの再送による二重実行を防止）
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_STORE_ATTEMPTS = 3
+
+def idempotency_request_hash(payload) -> str:
+    """Hash the request payload so a reused key with a different body can be detected"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+async def begin_idempotent_request(record_id: str, request_hash: str) -> Optional[JSONResponse]:
+    """Claim an idempotency key. Returns the stored response when the request is a replay."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": record_id,
+            "request_hash": request_hash,
+            "state": "pending",
+            "created_at": now
+        })
+        return None
+    except DuplicateKeyError:
+        existing = await db.idempotency_keys.find_one({"_id": record_id})
+    
+    # TTLモニターの削除前に期限切れとなった記録は新規リクエストとして扱う
+    if existing is None or existing["created_at"].replace(tzinfo=timezone.utc) < now - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
+        await db.idempotency_keys.replace_one(
+            {"_id": record_id},
+            {"request_hash": request_hash, "state": "pending", "created_at": now},
+            upsert=True
+        )
+        return None
+    
+    if existing["request_hash"] != request_hash:
+        raise HTTPException(status_code=422, detail="同じIdempotency-Keyが異なるリクエスト内容で使用されています")
+    
+    if existing["state"] != "completed":
+        raise HTTPException(
+            status_code=409,
+            detail="同じIdempotency-Keyのリクエストを処理中です",
+            headers={"Retry-After": "1"}
+        )
+    
+    logger.info(f"Idempotency-Key による再送を検出、保存済みの結果を返却: {record_id}")
+    return JSONResponse(
+        status_code=existing["status_code"],
+        content=existing["body"],
+        headers={**existing.get("headers", {}), "Idempotent-Replayed": "true"}
+    )
+
+async def complete_idempotent_request(record_id: str, status_code: int, body, headers: Dict[str, str]) -> None:
+    await db.idempotency_keys.update_one(
+        {"_id": record_id},
+        {"$set": {"state": "completed", "status_code": status_code, "body": jsonable_encoder(body), "headers": headers}}
+    )
+
+async def release_idempotent_request(record_id: str) -> None:
+    try:
+        await db.idempotency_keys.delete_one({"_id": record_id, "state": "pending"})
+    except Exception as e:
+        logger.error(f"Idempotency-Key の解放に失敗: {record_id}: {str(e)}")
+
+async def store_idempotent_result(record_id: str, status_code: int, body, headers: Optional[Dict[str, str]] = None) -> None:
+    """Save the result for replays, retrying briefly.
+    
+    If it still cannot be saved the pending key is released, so retries re-run the
+    request instead of getting 409 until the key expires.
+    """
+    for attempt in range(IDEMPOTENCY_STORE_ATTEMPTS):
+        try:
+            await complete_idempotent_request(record_id, status_code, body, headers or {})
+            return
+        except Exception as e:
+            logger.warning(f"Idempotency-Key の結果の保存に失敗（試行 {attempt + 1}/{IDEMPOTENCY_STORE_ATTEMPTS}）: {record_id}: {str(e)}")
+            if attempt + 1 < IDEMPOTENCY_STORE_ATTEMPTS:
+                await asyncio.sleep(0.2 * (attempt + 1))
+    await release_idempotent_request(record_id)
+
+async def run_idempotent(idempotency_key: Optional[str], scope: str, payload, handler,
+                         response_headers: Optional[Callable[[Any], Dict[str, str]]] = None):
+    """Run a write handler at most once per Idempotency-Key.
+    
+    Successful and client-error (4xx) results are stored and replayed for retries
+    with the same key, with the headers response_headers(result) gives for the first
+    response (e.g. ETag). Server errors release the key so the request can be retried.
+    """
+    if not idempotency_key:
+        return await handler()
+    
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Keyが長すぎます")
+    
+    record_id = f"{scope}:{idempotency_key}"
+    replay = await begin_idempotent_request(record_id, idempotency_request_hash(payload))
+    if replay is not None:
+        return replay
+    
+    try:
+        result = await handler()
+    except HTTPException as e:
+        if 400 <= e.status_code < 500:
+            await store_idempotent_result(record_id, e.status_code, http_error_body(e), e.headers)
+        else:
+            await release_idempotent_request(record_id)
+        raise
+    except Exception:
+        await release_idempotent_request(record_id)
+        raise
+    
+    await store_idempotent_result(record_id, 200, result, response_headers(result) if response_headers else None)
+    return result
+
+async def ensure_indexes():
+    """アプリケーションが使用するインデックスを作成"""
+    index_specs = [
+        (db.idempotency_keys, [("created_at", 1)], {"expireAfterSeconds": IDEMPOTENCY_TTL_SECONDS}),
+        (db.reservations, [("id", 1)], {"unique": True}),
+        (db.reservations, [("bench_id", 1), ("start_time", 1)], {}),
+        # 重複チェックは end_time の下限で絞る方が、過去の予約をすべて読まずに済む
+        (db.reservations, [("bench_id", 1), ("end_time", 1)], {}),
+        (db.reservations, [("start_time", 1)], {}),
+        (db.reservations, [("user_key", 1), ("start_time", 1), ("id", 1)], {}),
+        (db.reservation_events, [("seq", 1)], {"unique": True}),
+        (db.reservation_events, [("day", 1), ("seq", 1)], {}),
+        (db.reservation_events, [("at", 1)], {"expireAfterSeconds": CHANGES_RETENTION_DAYS * 24 * 60 * 60}),
+        (db.benches, [("id", 1)], {"unique": True}),
+    ]
+    for collection, keys, options in index_specs:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            logger.error(f"インデックス作成に失敗しました ({collection.name} {keys}): {str(e)}")
+
+# 完了した移行は migrations コレクションに記録し、起動のたびに全件を走査しない
+RESERVATION_MIGRATION_ID = "reservation_documents_v1"
+
+async def migrate_reservation_documents(force: bool = False):
+    """バージョン管理導入前の予約に version を、利用者検索導入前の予約に user_key を付与"""
+    if not force and await db.migrations.find_one({"_id": RESERVATION_MIGRATION_ID}):
+        return
+    
+    result = await db.reservations.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+    if result.modified_count:
+        logger.info(f"version を付与した予約数: {result.modified_count}")
+    
+    # user_key は Python 側で正規化するため、1000件ずつまとめて書き込む
+    updates, backfilled = [], 0
+    async for reservation in db.reservations.find({"user_key": {"$exists": False}}, {"_id": True, "user_name": True}):
+        updates.append(UpdateOne(
+            {"_id": reservation["_id"]},
+            {"$set": {"user_key": normalize_user_key(reservation.get("user_name") or "")}}
+        ))
+        if len(updates) >= 1000:
+            backfilled += (await db.reservations.bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        backfilled += (await db.reservations.bulk_write(updates, ordered=False)).modified_count
+    if backfilled:
+        logger.info(f"user_key を付与した予約数: {backfilled}")
+    await db.migrations.update_one(
+        {"_id": RESERVATION_MIGRATION_ID}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+# API Routes
+@api_router.get("/")
+async def root():
+    return {"message": "ベンチ予約システム API", "current_time_jst": datetime.now(JST).isoformat()}
+
+@api_router.get("/health")
+async def health_check():
+    """System health check endpoint"""
+    try:
+        # MongoDB接続テスト
+        start_time = datetime.now()
+        await asyncio.wait_for(
+            db.reservations.find_one(),
+            timeout=5.0
+        )
+        response_time = (datetime.now() - start_time).total_seconds()
+        
+        return {
+            "status": "healthy",
+            "timestamp": datetime.now(JST).isoformat(),
+            "database": "connected",
+            "database_response_time": f"{response_time:.3f}s"
+        }
+    except asyncio.TimeoutError:
+        logger.error("ヘルスチェック: データベース接続タイムアウト")
+        raise HTTPException(status_code=503, detail="データベース接続タイムアウト")
+    except Exception as e:
+        logger.error(f"ヘルスチェック: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"システムエラー: {str(e)}")
+
+@api_router.post("/reservations", response_model=Reservation, dependencies=[Depends(refresh_bench_registry)])
+async def create_reservation(reservation_data: ReservationCreate, idempotency_key: Optional[str] = Header(None)):
+    """Create a new reservation"""
+    return await run_idempotent(
+        idempotency_key, "POST /reservations", reservation_data.model_dump(),
+        lambda: insert_reservation(reservation_data)
+    )
+
+async def insert_reservation(reservation_data: ReservationCreate) -> Reservation:
+    """Validate and insert a new reservation"""
+    validate_booking_window(parse_jst_time(reservation_data.start_time), parse_jst_time(reservation_data.end_time))
+    
+    # 同一インスタンス内では重複確認から登録までをベンチ単位で直列化
+    async with bench_registry.conflict_lock(reservation_data.bench_id):
+        # Check for double booking
+        conflict = await check_double_booking(reservation_data.bench_id, reservation_data.start_time, reservation_data.end_time)
+        if not conflict:
+            # Create reservation
+            reservation = Reservation(**reservation_data.model_dump())
+            
+            # Insert into database together with the day's snapshot
+            async def write(session):
+                document = reservation.model_dump()
+                await db.reservations.insert_one(document, session=session)
+                return reservation, [reservation_day(reservation.start_time)], [upsert_event(document)]
+            await commit_reservation_write(write)
+    
+    if conflict:
+        # 近くの空き時間をロックの外で調べて409に含める
+        raise BookingConflict(await conflict_suggestions(reservation_data))
+    
+    return reservation
+
+async def fetch_reservations_payload(query: dict) -> EncodedPayload:
+    """Run the reservation query with retries and return the validated, sorted list"""
+    # データベースクエリの実行（複数段階のタイムアウト）
+    reservations = []
+    for attempt in range(3):  # 最大3回試行
+        try:
+            logger.info(f"データベースクエリ実行（試行 {attempt + 1}/3）")
+            reservations = await asyncio.wait_for(
+                db.reservations.find(query).to_list(500),  # 制限を500に削減
+                timeout=5.0 + (attempt * 2)  # 段階的にタイムアウトを延長
+            )
+            logger.info(f"取得された予約数: {len(reservations)}")
+            break  # 成功したらループを抜ける
+            
+        except asyncio.TimeoutError:
+            # 応答待ちの最も古い操作（タイムアウトしたクエリ自体か、接続を塞いでいる操作）
+            longest = slow_op_recorder.longest_running()
+            logger.warning(f"データベースクエリタイムアウト（試行 {attempt + 1}）" + (f": 実行中 {longest[1]}ms {longest[0]}" if longest else ""))
+            if attempt == 2:  # 最後の試行
+                # 接続状態を不健全にマーク
+                connection_status["healthy"] = False
+                raise HTTPException(
+                    status_code=504, 
+                    detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。"
+                )
+            await asyncio.sleep(1)  # 1秒待機してリトライ
+            
+        except Exception as db_error:
+            logger.error(f"データベースエラー（試行 {attempt + 1}）: {str(db_error)}")
+            if attempt == 2:  # 最後の試行
+                connection_status["healthy"] = False
+                raise HTTPException(
+                    status_code=500, 
+                    detail="データベースエラーが発生しました。システム管理者にお問い合わせください。"
+                )
+            await asyncio.sleep(1)
+    
+    # データ検証とソート
+    try:
+        return EncodedPayload(dump_reservation_list(build_reservation_list(reservations)), reservations_to_columns)
+        
+    except Exception as process_error:
+        logger.error(f"データ処理エラー: {str(process_error)}")
+        raise HTTPException(status_code=500, detail="予約データの処理中にエラーが発生しました")
+
+async def load_day_payload(day: str, bench_id: Optional[str] = None) -> Tuple[EncodedPayload, str]:
+    """One day's reservations through read_cache (the same entry for the date route and cache warming)"""
+    return await read_cache.get_or_load(
+        f"day:{day}:{bench_id or '*'}", day_scopes([day]), lambda: fetch_day_payload(day, bench_id),
+        encode=payload_to_bytes, decode=reservations_payload_from_bytes
+    )
+
+@api_router.get("/reservations", response_model=List[Reservation])
+async def get_reservations(request: Request, date: Optional[str] = None, bench_id: Optional[str] = None, layout: str = "rows"):
+    """Get reservations with comprehensive error handling and optimization"""
+    logger.info(f"=== 予約取得リクエスト開始 ===")
+    logger.info(f"日付: {date}, ベンチID: {bench_id}")
+    validate_layout(layout)
+    
+    # データベース接続確認
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    
+    try:
+        query = {}
+        
+        # ベンチIDフィルター
+        if bench_id:
+            await bench_registry.ensure_fresh()
+            if not bench_registry.is_known(bench_id):
+                raise HTTPException(status_code=400, detail="無効なベンチIDです")
+            query["bench_id"] = bench_id
+        
+        # 日付フィルター（その日のスナップショット1件で返す）
+        if date:
+            try:
+                date_obj = parser.parse(date).date()
+            except Exception as date_error:
+                logger.error(f"日付解析エラー: {str(date_error)}")
+                raise HTTPException(status_code=400, detail="無効な日付形式です")
+            
+            # 過去30日より古いデータは取得しない（パフォーマンス向上）
+            min_date = datetime.now().date() - timedelta(days=30)
+            if date_obj < min_date and reservation_archive.enabled:
+                # アーカイブ（その日のパーティションの1日分だけ）と、まだ残っている予約を合わせて返す
+                day = date_obj.isoformat()
+                payload, source = await read_cache.get_or_load(
+                    f"archive:{day}:{bench_id or '*'}", day_scopes([day]), lambda: fetch_archived_day_payload(day, bench_id),
+                    encode=payload_to_bytes, decode=reservations_payload_from_bytes
+                )
+                return negotiated_response(request, payload, layout, headers={"X-Cache": CACHE_SOURCE_HEADERS[source]})
+            if date_obj < min_date:
+                logger.info(f"古すぎる日付のリクエスト: {date}")
+                return negotiated_response(request, EncodedPayload([], reservations_to_columns), layout)  # 空のリストを返す
+            
+            day = date_obj.isoformat()
+            logger.info(f"日付フィルター: {day}")
+            payload, source = await load_day_payload(day, bench_id)
+            return negotiated_response(request, payload, layout, headers={"X-Cache": CACHE_SOURCE_HEADERS[source]})
+        
+        logger.info(f"MongoDB クエリ: {query}")
+        
+        # 同じ条件の読み込みは予約が変更されるまでキャッシュし、同時のミスは1回のDBクエリを共有
+        payload, source = await read_cache.get_or_load(
+            f"list:{json.dumps(query, sort_keys=True)}", ["any"], lambda: fetch_reservations_payload(query),
+            encode=payload_to_bytes, decode=reservations_payload_from_bytes
+        )
+        return negotiated_response(request, payload, layout, headers={"X-Cache": CACHE_SOURCE_HEADERS[source]})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"=== 予約取得処理中に予期しないエラー発生 ===")
+        logger.error(f"エラー内容: {str(e)}")
+        logger.error(f"エラータイプ: {type(e)}")
+        connection_status["healthy"] = False
+        raise HTTPException(
+            status_code=500, 
+            detail="予約取得処理中に予期しないエラーが発生しました。しばらく待ってから再試行してください。"
+        )
+
+# 週表示キャッシュ: 週の開始日 -> (取得時の日付バージョン, 保存時刻, レスポンス本文)
+WEEK_CACHE_TTL_SECONDS = float(os.environ.get('WEEK_CACHE_TTL_SECONDS', '60'))
+WEEK_CACHE_MAX_ENTRIES = 64
+week_cache: Dict[str, Tuple[Tuple[int, ...], float, EncodedPayload]] = {}
+
+def week_to_columns(week: dict) -> dict:
+    """Columnar layout for the week view: each bench's reservations become one array per field"""
+    return {**week, "days": [
+        {**day, "benches": {bench_id: reservations_to_columns(rows) for bench_id, rows in day["benches"].items()}}
+        for day in week["days"]
+    ]}
+
+async def fetch_week_payload(days: List[str]) -> EncodedPayload:
+    """Build the week view with one $match/$group aggregation"""
+    pipeline = [
+        {"$match": {"start_time": jst_date_range_query(days[0], days[-1])}},
+        {"$project": {"_id": 0}},
+        {"$group": {
+            "_id": {"date": {"$substrCP": ["$start_time", 0, 10]}, "bench_id": "$bench_id"},
+            "reservations": {"$push": "$$ROOT"}
+        }}
+    ]
+    try:
+        groups = await asyncio.wait_for(db.reservations.aggregate(pipeline).to_list(None), timeout=10.0)
+    except asyncio.TimeoutError:
+        connection_status["healthy"] = False
+        raise HTTPException(status_code=504, detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。")
+    
+    grouped = {(group["_id"]["date"], group["_id"]["bench_id"]): group["reservations"] for group in groups}
+    bench_ids = list(bench_registry.active_ids())
+    # 無効化済みのベンチでも予約が残っていれば表示する
+    bench_ids += sorted({bench_id for _, bench_id in grouped if bench_id not in bench_ids})
+    # 1日あたりの予約可能時間（7:00-22:00）
+    capacity_minutes = 15 * 60 * len(bench_ids)
+    
+    week = []
+    for day in days:
+        benches = {bench_id: dump_reservation_list(build_reservation_list(grouped.get((day, bench_id), [])))
+                   for bench_id in bench_ids}
+        occupied_minutes = sum(
+            int((parse_jst_time(r["end_time"]) - parse_jst_time(r["start_time"])).total_seconds() // 60)
+            for reservations in benches.values() for r in reservations
+        )
+        week.append({
+            "date": day,
+            "benches": benches,
+            "reservation_count": sum(len(reservations) for reservations in benches.values()),
+            "occupied_minutes": occupied_minutes,
+            "occupancy_rate": round(occupied_minutes / capacity_minutes, 4) if capacity_minutes else 0.0
+        })
+    
+    return EncodedPayload({
+        "start": days[0],
+        "end": days[-1],
+        "days": week
+    }, week_to_columns)
+
+async def load_week_payload(days: List[str]) -> Tuple[EncodedPayload, bool]:
+    """The week view from week_cache, rebuilt when a day in it changed or the entry expired; True on a hit"""
+    # 週内のいずれかの日が変更されていればキャッシュは無効
+    version = await days_version(days)
+    cached = week_cache.get(days[0])
+    if cached and cached[0] == version and time.monotonic() - cached[1] < WEEK_CACHE_TTL_SECONDS:
+        return cached[2], True
+    
+    payload = await reservation_reads.do(("week", days[0], version), lambda: fetch_week_payload(days))
+    if len(week_cache) >= WEEK_CACHE_MAX_ENTRIES and days[0] not in week_cache:
+        week_cache.pop(next(iter(week_cache)))
+    week_cache[days[0]] = (version, time.monotonic(), payload)
+    return payload, False
+
+@api_router.get("/reservations/week")
+async def get_week_reservations(request: Request, start: Optional[str] = None, layout: str = "rows"):
+    """Reservations for 7 days from start, grouped by day and bench, with per-day occupancy"""
+    try:
+        if start:
+            week_start = parser.parse(start).date()
+        else:
+            # 指定がなければ今週の月曜日から
+            today = datetime.now(JST).date()
+            week_start = today - timedelta(days=today.weekday())
+    except Exception:
+        raise HTTPException(status_code=400, detail="無効な日付形式です")
+    validate_layout(layout)
+    days = [(week_start + timedelta(days=offset)).isoformat() for offset in range(7)]
+    
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    
+    payload, hit = await load_week_payload(days)
+    return negotiated_response(request, payload, layout, headers={"X-Cache": "HIT" if hit else "MISS"})
+
+@api_router.get("/reservations/{reservation_id}", response_model=Reservation)
+async def get_reservation(reservation_id: str, response: Response):
+    """Get a specific reservation"""
+    reservation = await db.reservations.find_one({"id": reservation_id})
+    if not reservation:
+        raise HTTPException(status_code=404, detail="予約が見つかりません")
+    
+    result = Reservation(**reservation)
+    response.headers["ETag"] = reservation_etag(result.version)
+    return result
+
+@api_router.put("/reservations/{reservation_id}", response_model=Reservation)
+async def update_reservation(
+    reservation_id: str,
+    update_data: ReservationUpdate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    if_match: Optional[str] = Header(None)
+):
+    """Update a reservation"""
+    expected_version = parse_if_match(if_match)
+    result = await run_idempotent(
+        idempotency_key, f"PUT /reservations/{reservation_id}",
+        {**update_data.model_dump(exclude_unset=True), "if_match": expected_version},
+        lambda: apply_reservation_update(reservation_id, update_data, expected_version),
+        response_headers=lambda updated: {"ETag": reservation_etag(updated.version)}
+    )
+    if isinstance(result, Reservation):
+        response.headers["ETag"] = reservation_etag(result.version)
+    return result
+
+async def apply_reservation_update(reservation_id: str, update_data: ReservationUpdate, expected_version: Optional[int] = None) -> Reservation:
+    """Validate and apply an update with one version-guarded write.
+    
+    Moving a reservation takes three round trips: a read for its bench and current times
+    (the request carries neither the bench nor always both ends), the indexed conflict probe
+    and the write. The probe and write run under the bench's lock, which needs the bench id
+    before probing. Other updates skip the read and probe.
+    """
+    # Prepare update data
+    update_dict = {}
+    for field, value in update_data.model_dump(exclude_unset=True).items():
+        if value is not None:
+            update_dict[field] = value
+    
+    if not update_dict:
+        raise HTTPException(status_code=400, detail="更新するデータがありません")
+    if 'user_name' in update_dict:
+        update_dict['user_key'] = normalize_user_key(update_dict['user_name'])
+    
+    existing = None
+    version_guard = expected_version
+    if 'start_time' in update_dict or 'end_time' in update_dict:
+        existing = await db.reservations.find_one({"id": reservation_id}, {"_id": False})
+        if not existing:
+            raise HTTPException(status_code=404, detail="予約が見つかりません")
+        if expected_version is not None and existing.get('version', 1) != expected_version:
+            raise HTTPException(status_code=412, detail="予約が他の操作によって更新されています。再読み込みしてください")
+        
+        start_time = update_dict.get('start_time', existing['start_time'])
+        end_time = update_dict.get('end_time', existing['end_time'])
+        # 作成と同じ予約ルール（7:00-22:00・30分刻み）
+        validate_booking_window(parse_jst_time(start_time), parse_jst_time(end_time))
+        
+        # 重複確認の後に別の更新が入っていないことを書き込み条件で保証
+        version_guard = existing.get('version', 1)
+    
+    query = {"id": reservation_id}
+    if version_guard is not None:
+        query["version"] = version_condition(version_guard)
+        update_ops = {"$set": {**update_dict, "version": version_guard + 1}}
+    else:
+        update_ops = {"$set": update_dict, "$inc": {"version": 1}}
+    
+    async def write(session):
+        updated = await db.reservations.find_one_and_update(
+            query,
+            update_ops,
+            projection={"_id": False},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if updated is None:
+            return None, [], []
+        events = [upsert_event(updated)]
+        changed_days = {reservation_day(updated['start_time'])}
+        if existing is not None:
+            changed_days.add(reservation_day(existing['start_time']))
+            if reservation_day(existing['start_time']) != events[0]["day"]:
+                # 別の日に移動した場合は、元の日の一覧からも消えるよう削除を記録
+                events.insert(0, delete_event(existing))
+        return updated, changed_days, events
+    
+    if existing is not None:
+        # 作成と同じく、重複確認から書き込みまでをベンチ単位で直列化する
+        # （(bench_id, end_time) インデックスで重なる予約を1件だけ探す）
+        async with bench_registry.conflict_lock(existing['bench_id']):
+            if await check_double_booking(existing['bench_id'], start_time, end_time, reservation_id):
+                raise HTTPException(status_code=409, detail="この時間帯は既に予約されています")
+            updated_reservation = await commit_reservation_write(write)
+    else:
+        updated_reservation = await commit_reservation_write(write)
+    
+    if updated_reservation is None:
+        if not await db.reservations.find_one({"id": reservation_id}, {"_id": False, "id": True}):
+            raise HTTPException(status_code=404, detail="予約が見つかりません")
+        if expected_version is not None:
+            raise HTTPException(status_code=412, detail="予約が他の操作によって更新されています。再読み込みしてください")
+        raise HTTPException(status_code=409, detail="予約が同時に更新されました。再読み込みしてから再試行してください")
     
-    # Return updated reservation
-    updated_reservation = await db.reservations.find_one({"id": reservation_id})
     return Reservation(**updated_reservation)
 
-@api_router.delete("/reservations/{reservation_id}")
-async def delete_reservation(reservation_id: str):
-    """Delete a reservation"""
-    logger.info(f"=== 削除リクエスト受信 ===")
-    logger.info(f"reservation_id: {reservation_id}")
-    logger.info(f"リクエストタイプ: DELETE")
+@api_router.delete("/reservations/{reservation_id}")
+async def delete_reservation(reservation_id: str, idempotency_key: Optional[str] = Header(None)):
+    """Delete a reservation"""
+    return await run_idempotent(
+        idempotency_key, f"DELETE /reservations/{reservation_id}", {},
+        lambda: remove_reservation(reservation_id)
+    )
+
+async def remove_reservation(reservation_id: str) -> dict:
+    """Delete a reservation by id in a single round trip"""
+    logger.info(f"削除リクエスト受信: id={reservation_id}")
+    
+    try:
+        async def write(session):
+            deleted = await db.reservations.find_one_and_delete(
+                {"id": reservation_id},
+                projection={"_id": False, "id": True, "bench_id": True, "start_time": True, "end_time": True},
+                session=session
+            )
+            if deleted is None or not deleted.get('start_time'):
+                return deleted, [], []
+            return deleted, [reservation_day(deleted['start_time'])], [delete_event(deleted)]
+        
+        deleted = await commit_reservation_write(write)
+        
+        if deleted is None:
+            logger.warning(f"削除対象の予約が見つかりません: id={reservation_id}")
+            raise HTTPException(status_code=404, detail="予約が見つかりません")
+        
+        logger.info(f"予約削除成功: id={reservation_id}, bench_id={deleted.get('bench_id')}, "
+                    f"{deleted.get('start_time')} - {deleted.get('end_time')}")
+        
+        return {
+            "message": "予約が削除されました", 
+            "deleted_id": reservation_id,
+            "success": True
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"=== 削除処理中にエラー発生 ===")
+        logger.error(f"エラー内容: {str(e)}")
+        logger.error(f"エラータイプ: {type(e)}")
+        raise HTTPException(status_code=500, detail=f"削除処理中にエラーが発生しました: {str(e)}")
+
+@api_router.delete("/reservations")
+async def delete_reservations(request: BulkDeleteRequest, idempotency_key: Optional[str] = Header(None)):
+    """Delete several reservations by id list and/or bench and date range with one delete_many"""
+    return await run_idempotent(
+        idempotency_key, "DELETE /reservations", request.model_dump(),
+        lambda: remove_reservations(request)
+    )
+
+async def remove_reservations(request: BulkDeleteRequest) -> dict:
+    query = {}
+    if request.ids is not None:
+        query["id"] = {"$in": request.ids}
+    elif not (request.date_from and request.date_to):
+        # 条件なしの全件削除を防ぐため、ID指定がない場合は期間の指定を必須とする
+        raise HTTPException(status_code=400, detail="削除する予約のIDまたは期間（date_from, date_to）を指定してください")
+    
+    if request.bench_id is not None:
+        if not bench_registry.is_known(request.bench_id):
+            raise HTTPException(status_code=400, detail="無効なベンチIDです")
+        query["bench_id"] = request.bench_id
+    
+    if request.date_from or request.date_to:
+        date_from = request.date_from or request.date_to
+        date_to = request.date_to or request.date_from
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="date_from は date_to 以前の日付を指定してください")
+        query["start_time"] = jst_date_range_query(date_from, date_to)
+    
+    logger.info(f"一括削除リクエスト: {query}")
+    
+    try:
+        targets = await db.reservations.find(query, {"_id": False, "id": True, "bench_id": True, "start_time": True}).to_list(BULK_DELETE_MAX + 1)
+        if len(targets) > BULK_DELETE_MAX:
+            raise HTTPException(status_code=400, detail=f"一度に削除できる予約は{BULK_DELETE_MAX}件までです")
+        
+        target_ids = [target["id"] for target in targets]
+        deleted_count = 0
+        if target_ids:
+            async def write(session):
+                result = await db.reservations.delete_many({"id": {"$in": target_ids}}, session=session)
+                dated = [target for target in targets if target.get('start_time')]
+                return result.deleted_count, {reservation_day(target['start_time']) for target in dated}, [delete_event(target) for target in dated]
+            deleted_count = await commit_reservation_write(write)
+        
+        logger.info(f"一括削除完了: 対象{len(target_ids)}件, 削除{deleted_count}件")
+        
+        found = set(target_ids)
+        requested_ids = request.ids if request.ids is not None else target_ids
+        return {
+            "message": f"{deleted_count}件の予約が削除されました",
+            "deleted_count": deleted_count,
+            "results": [
+                {"id": reservation_id, "status": "deleted" if reservation_id in found else "not_found"}
+                for reservation_id in requested_ids
+            ],
+            "success": True
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"一括削除処理中にエラー発生: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"一括削除処理中にエラーが発生しました: {str(e)}")
+
+# 利用者ごとの予約一覧と利用者名の前方一致検索（user_key, start_time のインデックスを使用）
+USER_RESERVATIONS_DEFAULT_LIMIT = 20
+USER_RESERVATIONS_MAX_LIMIT = 100
+USER_SEARCH_MAX_LIMIT = 20
+
+@api_router.get("/users/{user_name}/reservations")
+async def get_user_reservations(
+    user_name: str,
+    scope: str = "upcoming",
+    limit: int = USER_RESERVATIONS_DEFAULT_LIMIT,
+    offset: int = 0
+):
+    """A user's reservations: upcoming (not yet ended, soonest first), past (latest first) or all"""
+    user_key = normalize_user_key(user_name)
+    if not user_key:
+        raise HTTPException(status_code=400, detail="利用者名を指定してください")
+    if scope not in ("upcoming", "past", "all"):
+        raise HTTPException(status_code=400, detail="scope には upcoming、past、all のいずれかを指定してください")
+    if not 1 <= limit <= USER_RESERVATIONS_MAX_LIMIT or offset < 0:
+        raise HTTPException(status_code=400, detail=f"limit は1以上{USER_RESERVATIONS_MAX_LIMIT}以下、offset は0以上で指定してください")
+    
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    
+    query = {"user_key": user_key}
+    now = datetime.now(JST).isoformat()
+    if scope == "upcoming":
+        query["end_time"] = {"$gt": now}  # 利用中の予約も含む
+    elif scope == "past":
+        query["end_time"] = {"$lte": now}
+    direction = -1 if scope == "past" else 1
+    
+    try:
+        # 1件多く取得して次のページの有無を判定
+        reservations = await asyncio.wait_for(
+            db.reservations.find(query, {"_id": False})
+            .sort([("start_time", direction), ("id", direction)])
+            .skip(offset)
+            .limit(limit + 1)
+            .to_list(limit + 1),
+            timeout=10.0
+        )
+    except asyncio.TimeoutError:
+        connection_status["healthy"] = False
+        raise HTTPException(status_code=504, detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。")
+    
+    has_more = len(reservations) > limit
+    return {
+        "user_name": user_name.strip(),
+        "scope": scope,
+        "reservations": dump_reservation_list(RESERVATION_LIST_ADAPTER.validate_python(reservations[:limit])),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if has_more else None
+    }
+
+@api_router.get("/users")
+async def search_users(prefix: str = "", limit: int = 10):
+    """Distinct user names starting with prefix (case- and width-insensitive), most frequent first"""
+    prefix_key = normalize_user_key(prefix)
+    if not prefix_key:
+        return {"users": []}
+    limit = max(1, min(limit, USER_SEARCH_MAX_LIMIT))
+    
+    pipeline = [
+        # アンカー付きの前方一致は user_key インデックスの範囲検索になる
+        {"$match": {"user_key": {"$regex": f"^{re.escape(prefix_key)}"}}},
+        # インデックスの逆順走査で並べ替える（user_key の順序はグループ化後に並べ直すので問わない）
+        {"$sort": {"user_key": -1, "start_time": -1}},
+        {"$group": {
+            "_id": "$user_key",
+            "user_name": {"$first": "$user_name"},
+            "reservation_count": {"$sum": 1},
+            "last_reserved": {"$first": "$start_time"}
+        }},
+        {"$sort": {"reservation_count": -1, "_id": 1}},
+        {"$limit": limit}
+    ]
+    try:
+        users = await asyncio.wait_for(db.reservations.aggregate(pipeline).to_list(limit), timeout=5.0)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。")
+    return {"users": [
+        {"user_name": user["user_name"], "reservation_count": user["reservation_count"], "last_reserved": user["last_reserved"]}
+        for user in users
+    ]}
+
+@api_router.get("/benches")
+async def get_benches(room: Optional[str] = None):
+    """Get available benches (optionally for one room)"""
+    await bench_registry.ensure_fresh()
+    return {
+        "benches": bench_registry.listing(room),
+        "rooms": bench_registry.rooms()
+    }
+
+@api_router.post("/benches", dependencies=[Depends(verify_admin_token)])
+async def create_bench(bench_data: BenchCreate):
+    """Register a new bench"""
+    bench = {**bench_data.model_dump(), "active": True}
+    try:
+        await db.benches.insert_one(dict(bench))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="このベンチIDは既に登録されています")
+    await bench_registry.refresh(force=True)
+    return BenchRegistry.public(bench)
+
+@api_router.put("/benches/{bench_id}", dependencies=[Depends(verify_admin_token)])
+async def update_bench(bench_id: str, update_data: BenchUpdate):
+    """Rename, move or (de)activate a bench. Benches are deactivated rather than deleted
+    so existing reservations keep a valid bench_id."""
+    update_dict = update_data.model_dump(exclude_unset=True)
+    if not update_dict:
+        raise HTTPException(status_code=400, detail="更新するデータがありません")
+    updated = await db.benches.find_one_and_update(
+        {"id": bench_id},
+        {"$set": update_dict},
+        projection={"_id": False},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is None:
+        raise HTTPException(status_code=404, detail="ベンチが見つかりません")
+    await bench_registry.refresh(force=True)
+    return BenchRegistry.public(updated)
+
+# 利用率分析: 予約を (ベンチ × 日 × 30分枠) の占有時間行列に集計する
+BUSINESS_START_HOUR = 7
+BUSINESS_END_HOUR = 22
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = (BUSINESS_END_HOUR - BUSINESS_START_HOUR) * 60 // SLOT_MINUTES
+ANALYTICS_DEFAULT_DAYS = 28
+ANALYTICS_MAX_DAYS = 366
+ANALYTICS_BATCH_SIZE = 5000
+WEEKDAY_LABELS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+def jst_day_and_minute(time_str: str) -> Tuple[str, int]:
+    """(YYYY-MM-DD, minutes since JST midnight), with a fast path for the stored JST ISO format"""
+    if len(time_str) >= 16 and time_str[10] == "T" and time_str.endswith("+09:00"):
+        return time_str[:10], int(time_str[11:13]) * 60 + int(time_str[14:16])
+    dt = parse_jst_time(time_str)
+    return dt.date().isoformat(), dt.hour * 60 + dt.minute
+
+def build_occupancy_matrix(intervals: np.ndarray, bench_count: int, day_count: int) -> np.ndarray:
+    """Occupied minutes per (bench, day, slot) from rows of (bench_index, day_index, start_minute, end_minute)"""
+    occupancy = np.zeros((bench_count, day_count, SLOTS_PER_DAY), dtype=np.float32)
+    if len(intervals) == 0:
+        return occupancy
+    slot_starts = BUSINESS_START_HOUR * 60 + SLOT_MINUTES * np.arange(SLOTS_PER_DAY)
+    # 各予約と各枠の重なり（分）を一度にブロードキャストで計算
+    overlap = np.minimum(intervals[:, 3:4], slot_starts + SLOT_MINUTES) - np.maximum(intervals[:, 2:3], slot_starts)
+    np.add.at(occupancy, (intervals[:, 0], intervals[:, 1]), np.clip(overlap, 0, None))
+    return np.minimum(occupancy, SLOT_MINUTES, out=occupancy)
+
+def idle_gap_minutes(occupancy: np.ndarray) -> np.ndarray:
+    """Lengths (minutes) of runs of completely free slots within each bench-day"""
+    free = (occupancy == 0).reshape(-1, SLOTS_PER_DAY)
+    padded = np.zeros((free.shape[0], SLOTS_PER_DAY + 2), dtype=np.int8)
+    padded[:, 1:-1] = free
+    edges = np.diff(padded, axis=1)
+    # 行優先で走査されるため、開始位置と終了位置は同じ順序で対応する
+    starts = np.nonzero(edges == 1)[1]
+    ends = np.nonzero(edges == -1)[1]
+    return (ends - starts) * SLOT_MINUTES
+
+def utilization_ratio(numerator, denominator) -> float:
+    return round(float(numerator) / float(denominator), 4) if denominator else 0.0
+
+def summarize_utilization(occupancy: np.ndarray, intervals: np.ndarray, bench_ids: List[str], days: List[str]) -> dict:
+    """Utilization rates, peak hours, weekday x hour heatmap and idle statistics from the occupancy matrix"""
+    bench_count, day_count = len(bench_ids), len(days)
+    slot_capacity = day_count * SLOTS_PER_DAY * SLOT_MINUTES
+    hours = list(range(BUSINESS_START_HOUR, BUSINESS_END_HOUR))
+    slots_per_hour = 60 // SLOT_MINUTES
+    
+    # (ベンチ, 日, 時) ごとの占有時間
+    hourly = occupancy.reshape(bench_count, day_count, len(hours), slots_per_hour).sum(axis=3)
+    by_hour = hourly.sum(axis=(0, 1))
+    hour_capacity = bench_count * day_count * 60
+    
+    weekdays = np.array([datetime.fromisoformat(day).weekday() for day in days], dtype=np.intp)
+    weekday_totals = np.zeros((7, len(hours)), dtype=np.float64)
+    np.add.at(weekday_totals, weekdays, hourly.sum(axis=0))
+    weekday_days = np.bincount(weekdays, minlength=7)
+    
+    reservation_counts = np.bincount(intervals[:, 0], minlength=bench_count) if len(intervals) else np.zeros(bench_count, dtype=np.intp)
+    booked_by_bench = occupancy.sum(axis=(1, 2))
+    gaps = idle_gap_minutes(occupancy)
+    
+    return {
+        "from": days[0],
+        "to": days[-1],
+        "days": day_count,
+        "slot_minutes": SLOT_MINUTES,
+        "business_hours": {"start": f"{BUSINESS_START_HOUR:02d}:00", "end": f"{BUSINESS_END_HOUR:02d}:00"},
+        "reservation_count": int(len(intervals)),
+        "booked_minutes": int(booked_by_bench.sum()),
+        "capacity_minutes": bench_count * slot_capacity,
+        "utilization": utilization_ratio(booked_by_bench.sum(), bench_count * slot_capacity),
+        "benches": [
+            {
+                "bench_id": bench_id,
+                "reservation_count": int(reservation_counts[index]),
+                "booked_minutes": int(booked_by_bench[index]),
+                "utilization": utilization_ratio(booked_by_bench[index], slot_capacity)
+            }
+            for index, bench_id in enumerate(bench_ids)
+        ],
+        "by_hour": [{"hour": hour, "utilization": utilization_ratio(by_hour[index], hour_capacity)} for index, hour in enumerate(hours)],
+        "peak_hours": [
+            {"hour": hours[index], "utilization": utilization_ratio(by_hour[index], hour_capacity)}
+            for index in np.argsort(-by_hour, kind="stable")[:3] if by_hour[index] > 0
+        ],
+        "heatmap": {
+            "weekdays": WEEKDAY_LABELS,
+            "hours": hours,
+            # 期間内に存在しない曜日は null
+            "utilization": [
+                [utilization_ratio(weekday_totals[weekday, index], weekday_days[weekday] * bench_count * 60) for index in range(len(hours))]
+                if weekday_days[weekday] else None
+                for weekday in range(7)
+            ]
+        },
+        "idle": {
+            "idle_minutes": int((occupancy == 0).sum()) * SLOT_MINUTES,
+            "idle_bench_days": int((occupancy.reshape(-1, SLOTS_PER_DAY).sum(axis=1) == 0).sum()),
+            "gap_count": int(len(gaps)),
+            "gap_minutes": {
+                "mean": round(float(gaps.mean()), 1) if len(gaps) else None,
+                "median": float(np.median(gaps)) if len(gaps) else None,
+                "p90": float(np.percentile(gaps, 90)) if len(gaps) else None,
+                "max": int(gaps.max()) if len(gaps) else None
+            }
+        }
+    }
+
+async def compute_utilization(days: List[str], bench_id: Optional[str] = None) -> dict:
+    """Stream the range's reservations from a cursor into the occupancy matrix and summarize it"""
+    query = {"start_time": jst_date_range_query(days[0], days[-1])}
+    if bench_id:
+        query["bench_id"] = bench_id
+    bench_ids = [bench_id] if bench_id else list(bench_registry.active_ids())
+    bench_index = {bench: index for index, bench in enumerate(bench_ids)}
+    day_index = {day: index for index, day in enumerate(days)}
+    
+    rows = []
+    cursor = db.reservations.find(
+        query, {"_id": False, "bench_id": True, "start_time": True, "end_time": True}
+    ).batch_size(ANALYTICS_BATCH_SIZE)
+    async for reservation in cursor:
+        try:
+            start_day, start_minute = jst_day_and_minute(reservation["start_time"])
+            end_day, end_minute = jst_day_and_minute(reservation["end_time"])
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"無効な予約データを検出: {reservation}")
+            continue
+        if start_day not in day_index:
+            continue
+        if end_day != start_day:
+            end_minute = 24 * 60  # 日をまたぐ予約はその日の終わりまで
+        index = bench_index.get(reservation.get("bench_id"))
+        if index is None:
+            # 無効化済みのベンチでも予約が残っていれば集計する
+            index = bench_index[reservation.get("bench_id")] = len(bench_ids)
+            bench_ids.append(reservation.get("bench_id"))
+        rows.append((index, day_index[start_day], start_minute, end_minute))
+    
+    intervals = np.array(rows, dtype=np.intp).reshape(-1, 4)
+    occupancy = build_occupancy_matrix(intervals, len(bench_ids), len(days))
+    return summarize_utilization(occupancy, intervals, bench_ids, days)
+
+@api_router.get("/analytics/utilization")
+async def get_utilization(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    bench_id: Optional[str] = None
+):
+    """Utilization per bench and hour, weekday x hour heatmap and idle-time statistics for a date range"""
+    try:
+        end = parser.parse(date_to).date() if date_to else datetime.now(JST).date()
+        start = parser.parse(date_from).date() if date_from else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無効な日付形式です")
+    if start > end:
+        raise HTTPException(status_code=400, detail="from は to 以前の日付を指定してください")
+    if (end - start).days + 1 > ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"集計期間は{ANALYTICS_MAX_DAYS}日以内で指定してください")
+    
+    await bench_registry.ensure_fresh()
+    if bench_id is not None and not bench_registry.is_known(bench_id):
+        raise HTTPException(status_code=400, detail="無効なベンチIDです")
+    
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
     
+    days = [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
     try:
-        # 削除前に予約が存在するか確認
-        existing = await db.reservations.find_one({"id": reservation_id})
-        logger.info(f"既存予約検索結果: {existing}")
-        
-        if not existing:
-            logger.warning(f"削除対象の予約が見つかりません: id={reservation_id}")
-            raise HTTPException(status_code=404, detail="予約が見つかりません")
-        
-        logger.info(f"削除対象予約詳細: {existing}")
-        
-        # 予約を削除
-        result = await db.reservations.delete_one({"id": reservation_id})
-        logger.info(f"削除実行結果: deleted_count={result.deleted_count}")
-        
-        if result.deleted_count == 0:
-            logger.error(f"削除操作に失敗しました: id={reservation_id}")
-            raise HTTPException(status_code=500, detail="削除操作に失敗しました")
-        
-        logger.info(f"=== 予約削除成功 ===")
-        logger.info(f"削除済みID: {reservation_id}")
-        
+        summary, _ = await read_cache.get_or_load(
+            f"utilization:{days[0]}:{days[-1]}:{bench_id or '*'}", day_scopes(days),
+            lambda: asyncio.wait_for(compute_utilization(days, bench_id), timeout=15.0),
+            encode=json_to_bytes, decode=json.loads
+        )
+        return summary
+    except asyncio.TimeoutError:
+        connection_status["healthy"] = False
+        raise HTTPException(status_code=504, detail="データベースの応答が遅くなっています。しばらく待ってから再試行してください。")
+
+# 空き時間の提案（重複時の409とGET /suggest）
+# その日の予約を開始時刻順に1回走査し、ベンチごとの空き時間から要求と同じ長さの候補を選ぶ
+SUGGESTION_DEFAULT_COUNT = 3
+SUGGESTION_MAX_COUNT = 10
+
+def free_slot_starts(bookings: List[Tuple[int, int]], duration: int) -> List[int]:
+    """Start minutes on the 30-minute grid (7:00-22:00) where duration fits between sorted (start, end) bookings"""
+    starts = []
+    cursor = BUSINESS_START_HOUR * 60
+    closing = BUSINESS_END_HOUR * 60
+    for booked_start, booked_end in [*bookings, (closing, closing)]:
+        gap_start = -(-cursor // SLOT_MINUTES) * SLOT_MINUTES  # 枠の境界に切り上げ
+        starts.extend(range(gap_start, min(booked_start, closing) - duration + 1, SLOT_MINUTES))
+        cursor = max(cursor, booked_end)
+    return starts
+
+def jst_minute_iso(day: str, minute: int) -> str:
+    return JST.localize(datetime.fromisoformat(day) + timedelta(minutes=minute)).isoformat()
+
+async def suggest_free_slots(bench_id: str, start_time: str, end_time: str, count: int = SUGGESTION_DEFAULT_COUNT) -> dict:
+    """Nearest free intervals of the requested length on the same bench and on the other active benches"""
+    day, start_minute = jst_day_and_minute(start_time)
+    duration = int((parse_jst_time(end_time) - parse_jst_time(start_time)).total_seconds() // 60)
+    
+    bookings, _ = await read_cache.get_or_load(
+        f"bookings:{day}", day_scopes([day]),
+        lambda: db.reservations.find(
+            {"start_time": jst_date_range_query(day, day)},
+            {"_id": False, "bench_id": True, "start_time": True, "end_time": True}
+        ).sort("start_time", 1).to_list(None),
+        encode=json_to_bytes, decode=json.loads
+    )
+    by_bench: Dict[str, List[Tuple[int, int]]] = {bench: [] for bench in bench_registry.active_ids()}
+    by_bench.setdefault(bench_id, [])
+    for booking in bookings:
+        intervals = by_bench.get(booking.get("bench_id"))
+        if intervals is None:
+            continue
+        booked_day, booked_start = jst_day_and_minute(booking["start_time"])
+        end_day, booked_end = jst_day_and_minute(booking["end_time"])
+        intervals.append((booked_start, booked_end if end_day == booked_day else 24 * 60))
+    
+    # 過去の時刻は提案しない
+    now = datetime.now(JST)
+    today = now.date().isoformat()
+    not_before = 0 if day > today else (now.hour * 60 + now.minute if day == today else 24 * 60)
+    
+    def candidates(bench: str) -> List[Tuple[Tuple[int, int], str, int]]:
+        # 要求時刻に近い順（同じ距離なら後の時刻を優先）
+        return [((abs(start - start_minute), -start), bench, start)
+                for start in free_slot_starts(by_bench[bench], duration) if start >= not_before]
+    
+    def describe(bench: str, start: int) -> dict:
         return {
-            "message": "予約が削除されました", 
-            "deleted_id": reservation_id,
-            "success": True
+            "bench_id": bench,
+            "bench_name": (bench_registry.get(bench) or {}).get("name", bench),
+            "start_time": jst_minute_iso(day, start),
+            "end_time": jst_minute_iso(day, start + duration)
         }
     
-    except HTTPException:
+    same_bench = sorted(candidates(bench_id))[:count]
+    other_benches = sorted(candidate for bench in by_bench if bench != bench_id for candidate in candidates(bench))[:count]
+    return {
+        "same_bench": [describe(bench, start) for _, bench, start in same_bench],
+        "other_benches": [describe(bench, start) for _, bench, start in other_benches]
+    }
+
+@api_router.get("/suggest")
+async def get_suggestions(bench_id: str, start_time: str, end_time: str, count: int = SUGGESTION_DEFAULT_COUNT):
+    """Free intervals of the requested length nearest to the requested time"""
+    await bench_registry.ensure_fresh()
+    if not bench_registry.is_known(bench_id):
+        raise HTTPException(status_code=400, detail="無効なベンチIDです")
+    if not 1 <= count <= SUGGESTION_MAX_COUNT:
+        raise HTTPException(status_code=400, detail=f"count は1以上{SUGGESTION_MAX_COUNT}以下で指定してください")
+    try:
+        start_dt = parse_jst_time(start_time)
+        end_dt = parse_jst_time(end_time)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無効な日付形式です")
+    validate_booking_window(start_dt, end_dt)
+    
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    
+    suggestions = await suggest_free_slots(bench_id, start_dt.isoformat(), end_dt.isoformat(), count)
+    return {
+        "requested": {"bench_id": bench_id, "start_time": start_dt.isoformat(), "end_time": end_dt.isoformat()},
+        "available": not await check_double_booking(bench_id, start_dt.isoformat(), end_dt.isoformat()),
+        **suggestions
+    }
+
+async def conflict_suggestions(reservation_data: ReservationCreate) -> dict:
+    try:
+        return await suggest_free_slots(reservation_data.bench_id, reservation_data.start_time, reservation_data.end_time)
+    except Exception as e:
+        # 提案の取得に失敗しても409自体は返す
+        logger.error(f"空き時間の提案に失敗しました: {str(e)}")
+        return {"same_bench": [], "other_benches": []}
+
+# CSV / iCalendar エクスポート（カーソルから逐次書き出し、全件をメモリに載せない）
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_ROWS = 500
+EXPORT_CSV_COLUMNS = ["id", "bench_id", "bench_name", "room", "user_name", "start_time", "end_time", "created_at", "version"]
+
+def export_query(date_from: Optional[str], date_to: Optional[str], bench_id: Optional[str], user_name: Optional[str]) -> dict:
+    """Mongo filter for the export endpoints (dates are inclusive JST days, either bound optional)"""
+    query = {}
+    try:
+        date_from = parser.parse(date_from).date().isoformat() if date_from else None
+        date_to = parser.parse(date_to).date().isoformat() if date_to else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="無効な日付形式です")
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="from は to 以前の日付を指定してください")
+    if date_from or date_to:
+        start_time = {}
+        if date_from:
+            start_time["$gte"] = jst_date_range_query(date_from, date_from)["$gte"]
+        if date_to:
+            start_time["$lt"] = jst_date_range_query(date_to, date_to)["$lt"]
+        query["start_time"] = start_time
+    if bench_id:
+        if not bench_registry.is_known(bench_id):
+            raise HTTPException(status_code=400, detail="無効なベンチIDです")
+        query["bench_id"] = bench_id
+    if user_name and normalize_user_key(user_name):
+        query["user_key"] = normalize_user_key(user_name)
+    return query
+
+async def iter_export_reservations(query: dict) -> AsyncIterator[dict]:
+    """Reservations matching the query in start_time order, fetched in cursor batches"""
+    cursor = db.reservations.find(query, {"_id": False}).sort("start_time", 1).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        async for reservation in cursor:
+            if all(key in reservation for key in ['id', 'bench_id', 'user_name', 'start_time', 'end_time']):
+                yield reservation
+            else:
+                logger.warning(f"無効な予約データを検出: {reservation}")
+    finally:
+        await cursor.close()
+
+def csv_safe(value) -> str:
+    """Neutralize values a spreadsheet would evaluate as a formula"""
+    value = "" if value is None else str(value)
+    return "'" + value if value[:1] in ("=", "+", "-", "@", "\t", "\r") else value
+
+async def export_csv_chunks(query: dict) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM 付きにして Excel でも UTF-8 として開けるようにする
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    # ヘッダーは最初の予約を待たずに送る
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    
+    pending = 0
+    try:
+        async for reservation in iter_export_reservations(query):
+            bench = bench_registry.get(reservation["bench_id"]) or {}
+            writer.writerow([csv_safe(value) for value in (
+                reservation["id"], reservation["bench_id"], bench.get("name"), bench.get("room"),
+                reservation["user_name"], reservation["start_time"], reservation["end_time"],
+                reservation.get("created_at"), reservation.get("version", 1)
+            )])
+            pending += 1
+            if pending >= EXPORT_CHUNK_ROWS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+    except Exception as e:
+        # ヘッダー送信後はステータスを変えられないため、例外を送出して応答を途中で切断する
+        # （正常に終わったように見える不完全なファイルを返さない）
+        logger.error(f"CSVエクスポート中にエラーが発生しました: {str(e)}")
         raise
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def ics_escape(value) -> str:
+    return (str(value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def ics_line(line: str) -> str:
+    """Fold a content line at 75 octets (RFC 5545 3.1) without splitting UTF-8 characters"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        # 折り返し行は先頭の空白1文字分を含めて75オクテット以内
+        if size + width > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+def ics_utc(time_str: str) -> str:
+    try:
+        dt = datetime.fromisoformat(time_str)
+        if dt.tzinfo is None:
+            dt = JST.localize(dt)
+    except ValueError:
+        dt = parse_jst_time(time_str)
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def reservation_vevent(reservation: dict, dtstamp: str) -> str:
+    bench = bench_registry.get(reservation["bench_id"]) or {}
+    summary = f"{bench.get('name') or reservation['bench_id']} {reservation['user_name']}"
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{reservation['id']}@clean-bench-reservation",
+        f"DTSTAMP:{dtstamp}",
+        f"DTSTART:{ics_utc(reservation['start_time'])}",
+        f"DTEND:{ics_utc(reservation['end_time'])}",
+        f"SUMMARY:{ics_escape(summary)}",
+        f"SEQUENCE:{max(0, reservation.get('version', 1) - 1)}",
+    ]
+    if reservation.get("created_at"):
+        lines.append(f"CREATED:{ics_utc(reservation['created_at'])}")
+    if bench.get("room"):
+        lines.append(f"LOCATION:{ics_escape(bench['room'])}")
+    lines.append("END:VEVENT")
+    return "".join(ics_line(line) for line in lines)
+
+async def export_ics_chunks(query: dict) -> AsyncIterator[bytes]:
+    dtstamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "".join(ics_line(line) for line in [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Clean Bench Reservation//Export//JA",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:クリーンベンチ予約",
+        "X-WR-TIMEZONE:Asia/Tokyo",
+    ]).encode("utf-8")
+    
+    events = []
+    try:
+        async for reservation in iter_export_reservations(query):
+            events.append(reservation_vevent(reservation, dtstamp))
+            if len(events) >= EXPORT_CHUNK_ROWS:
+                yield "".join(events).encode("utf-8")
+                events = []
     except Exception as e:
-        logger.error(f"=== 削除処理中にエラー発生 ===")
-        logger.error(f"エラー内容: {str(e)}")
-        logger.error(f"エラータイプ: {type(e)}")
-        raise HTTPException(status_code=500, detail=f"削除処理中にエラーが発生しました: {str(e)}")
+        # END:VCALENDAR を送らずに切断し、途中までのカレンダーを完全なものに見せない
+        logger.error(f"iCalendarエクスポート中にエラーが発生しました: {str(e)}")
+        raise
+    events.append(ics_line("END:VCALENDAR"))
+    yield "".join(events).encode("utf-8")
 
-@api_router.get("/benches")
-async def get_benches():
-    """Get available benches"""
+def export_filename(extension: str, date_from: Optional[str], date_to: Optional[str]) -> str:
+    span = "_".join(part for part in (date_from, date_to) if part) or "all"
+    return f"reservations_{re.sub(r'[^0-9A-Za-z_-]', '', span)}.{extension}"
+
+@api_router.get("/export.csv", dependencies=[Depends(verify_admin_token)])
+async def export_reservations_csv(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    bench_id: Optional[str] = None,
+    user_name: Optional[str] = None
+):
+    """Stream reservations as CSV (start_time order)"""
+    await bench_registry.ensure_fresh()
+    query = export_query(date_from, date_to, bench_id, user_name)
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    logger.info(f"CSVエクスポート: {query}")
+    return StreamingResponse(
+        export_csv_chunks(query),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{export_filename("csv", date_from, date_to)}"'}
+    )
+
+@api_router.get("/export.ics", dependencies=[Depends(verify_admin_token)])
+async def export_reservations_ics(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    bench_id: Optional[str] = None,
+    user_name: Optional[str] = None
+):
+    """Stream reservations as an iCalendar feed (one VEVENT per reservation)"""
+    await bench_registry.ensure_fresh()
+    query = export_query(date_from, date_to, bench_id, user_name)
+    if not await ensure_database_connection():
+        raise HTTPException(status_code=503, detail="データベース接続に問題があります。しばらく待ってから再試行してください。")
+    logger.info(f"iCalendarエクスポート: {query}")
+    return StreamingResponse(
+        export_ics_chunks(query),
+        media_type="text/calendar",
+        headers={"Content-Disposition": f'attachment; filename="{export_filename("ics", date_from, date_to)}"'}
+    )
+
+# 古い予約のアーカイブ（月ごとのパーティション、日ごとの gzip メンバーと索引）
+# クリーンアップは削除の前にここへ書き出し、30日より前の日付の取得はここから読む
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'archive'))
+ARCHIVE_RANGE_MAX_DAYS = 366
+# パーティションのロック（複数プロセス間）を待つ時間と、停止したプロセスのロックとみなすまでの時間
+ARCHIVE_LOCK_TIMEOUT_SECONDS = 30.0
+ARCHIVE_LOCK_STALE_SECONDS = 600.0
+
+class ReservationArchive:
+    """Compressed, month-partitioned archive of reservations on the local filesystem.
+    
+    Each partition is one data file holding a separate gzip member per day, plus
+    a small JSON index (day -> byte offset, length, count). Reading a day
+    memory-maps the data file and decompresses only that day's member, so range
+    reads touch only the partitions and days they cover. Re-archiving a day
+    merges with the archived rows (by id) and writes a new data file generation;
+    the index is replaced last, so readers never see a half-written partition.
+    Writers hold a per-partition lock file (created exclusively) for the whole
+    read-merge-replace, so processes sharing the directory do not overwrite each
+    other's days. File I/O is blocking: call from a worker thread.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = Path(directory) if directory else None
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, Tuple[int, dict]] = {}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+    
+    def _index_path(self, partition: str) -> Path:
+        return self.directory / f"{partition}.index.json"
+    
+    def _index(self, partition: str) -> Optional[dict]:
+        path = self._index_path(partition)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._indexes.get(partition)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        index = json.loads(path.read_text(encoding="utf-8"))
+        self._indexes[partition] = (mtime, index)
+        return index
+    
+    def partitions(self) -> List[str]:
+        if not self.enabled or not self.directory.is_dir():
+            return []
+        return sorted(path.name[:7] for path in self.directory.glob("????-??.index.json"))
+    
+    def _read_members(self, index: dict, days: Iterable[str]) -> Iterator[Tuple[str, List[dict]]]:
+        entries = [(day, index["days"][day]) for day in days if day in index["days"]]
+        if not entries:
+            return
+        with open(self.directory / index["file"], "rb") as data_file, \
+                mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for day, entry in entries:
+                member = gzip.decompress(data[entry["offset"]:entry["offset"] + entry["length"]])
+                yield day, [json.loads(line) for line in member.splitlines() if line]
+    
+    def read_range(self, date_from: str, date_to: str, bench_id: Optional[str] = None) -> Iterator[dict]:
+        """Archived reservations on JST dates date_from..date_to (inclusive), in start_time order"""
+        for partition in self.partitions():
+            if not date_from[:7] <= partition <= date_to[:7]:
+                continue
+            index = self._index(partition)
+            if index is None:
+                continue
+            days = sorted(day for day in index["days"] if date_from <= day <= date_to)
+            for _, rows in self._read_members(index, days):
+                for row in rows:
+                    if bench_id is None or row.get("bench_id") == bench_id:
+                        yield row
+    
+    def read_day(self, day: str, bench_id: Optional[str] = None) -> List[dict]:
+        return list(self.read_range(day, day, bench_id))
+    
+    def write(self, reservations: List[dict]) -> int:
+        """Archive reservations (stored-document dicts), merging with already archived days"""
+        by_partition: Dict[str, Dict[str, List[dict]]] = {}
+        for reservation in reservations:
+            reservation = {key: value for key, value in reservation.items() if key != "_id"}
+            day = reservation_day(reservation["start_time"])
+            by_partition.setdefault(day[:7], {}).setdefault(day, []).append(reservation)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for partition, days in sorted(by_partition.items()):
+                with self._partition_lock(partition):
+                    self._write_partition(partition, days)
+        return len(reservations)
+    
+    @contextmanager
+    def _partition_lock(self, partition: str) -> Iterator[None]:
+        """Lease on one partition across processes: a lock file created with O_EXCL, taken over once stale"""
+        path = self.directory / f"{partition}.lock"
+        deadline = time.monotonic() + ARCHIVE_LOCK_TIMEOUT_SECONDS
+        while True:
+            try:
+                with open(path, "xb") as lock_file:
+                    lock_file.write(f"{socket.gethostname()}:{os.getpid()}".encode("utf-8"))
+                break
+            except FileExistsError:
+                try:
+                    stale = time.time() - path.stat().st_mtime > ARCHIVE_LOCK_STALE_SECONDS
+                except FileNotFoundError:
+                    continue  # 直前に解放された
+                if stale:
+                    # 書き込み中に停止したプロセスのロック
+                    logger.warning(f"古いアーカイブのロックを解除します: {path}")
+                    path.unlink(missing_ok=True)
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"アーカイブのパーティション {partition} がロックされています: {path}")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            path.unlink(missing_ok=True)
+    
+    def _write_partition(self, partition: str, new_days: Dict[str, List[dict]]) -> None:
+        index = self._index(partition) or {"partition": partition, "generation": 0, "file": None, "days": {}}
+        old_file = index["file"]
+        generation = index["generation"] + 1
+        merged_days: Dict[str, Dict[str, dict]] = {}
+        # 既にアーカイブ済みの日は id で統合する（同じ id は新しい方を残す）
+        if old_file:
+            for day, rows in self._read_members(index, sorted(set(new_days) & set(index["days"]))):
+                merged_days[day] = {row["id"]: row for row in rows}
+        for day, rows in new_days.items():
+            merged_days.setdefault(day, {}).update({row["id"]: row for row in rows})
+        
+        days = {}
+        while True:
+            file_name = f"{partition}.{generation}.jsonl.gz"
+            try:
+                # 既存のファイルは上書きしない（途中で停止した書き込みの残りは次の世代で置き換える）
+                output = open(self.directory / file_name, "xb")
+                break
+            except FileExistsError:
+                generation += 1
+        with output:
+            old_data = open(self.directory / old_file, "rb") if old_file else None
+            try:
+                for day in sorted(set(index["days"]) | set(merged_days)):
+                    if day in merged_days:
+                        rows = sorted(merged_days[day].values(), key=lambda row: (row["start_time"], row.get("bench_id", "")))
+                        lines = "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows)
+                        member = gzip.compress(lines.encode("utf-8"), compresslevel=9)
+                        count = len(rows)
+                    else:
+                        # 変更のない日は圧縮済みのメンバーをそのまま写す
+                        entry = index["days"][day]
+                        old_data.seek(entry["offset"])
+                        member = old_data.read(entry["length"])
+                        count = entry["count"]
+                    days[day] = {"offset": output.tell(), "length": len(member), "count": count}
+                    output.write(member)
+            finally:
+                if old_data:
+                    old_data.close()
+            output.flush()
+            os.fsync(output.fileno())
+        
+        new_index = {
+            "partition": partition,
+            "generation": generation,
+            "file": file_name,
+            "days": days,
+            "count": sum(entry["count"] for entry in days.values()),
+            "bytes": sum(entry["length"] for entry in days.values()),
+            "updated_at": datetime.now(JST).isoformat(),
+        }
+        temporary = self._index_path(partition).with_suffix(".tmp")
+        temporary.write_text(json.dumps(new_index, ensure_ascii=False), encoding="utf-8")
+        os.replace(temporary, self._index_path(partition))
+        if old_file:
+            (self.directory / old_file).unlink(missing_ok=True)
+    
+    def stats(self) -> dict:
+        partitions = [index for index in (self._index(partition) for partition in self.partitions()) if index]
+        return {
+            "enabled": self.enabled,
+            "partitions": len(partitions),
+            "days": sum(len(index["days"]) for index in partitions),
+            "reservations": sum(index["count"] for index in partitions),
+            "compressed_bytes": sum(index["bytes"] for index in partitions),
+            "oldest_day": min((min(index["days"]) for index in partitions if index["days"]), default=None),
+            "newest_day": max((max(index["days"]) for index in partitions if index["days"]), default=None),
+        }
+
+reservation_archive = ReservationArchive(ARCHIVE_DIR)
+
+async def archive_reservations_before(cutoff: str) -> Tuple[int, int]:
+    """Move reservations starting before cutoff into the archive, one month at a time.
+    
+    Only documents that were written to the archive are deleted, so a reservation
+    inserted meanwhile is never lost. Returns (archived, deleted).
+    """
+    archived = deleted = 0
+    
+    async def flush(rows: List[dict]) -> None:
+        nonlocal archived, deleted
+        archived += await asyncio.to_thread(reservation_archive.write, rows)
+        ids = [row["id"] for row in rows]
+        for start in range(0, len(ids), 1000):
+            deleted += (await db.reservations.delete_many({"id": {"$in": ids[start:start + 1000]}})).deleted_count
+    
+    pending: List[dict] = []
+    cursor = db.reservations.find({"start_time": {"$lt": cutoff}}, {"_id": False}).sort("start_time", 1)
+    async for reservation in cursor:
+        if "id" not in reservation or "start_time" not in reservation:
+            continue
+        if pending and reservation_day(reservation["start_time"])[:7] != reservation_day(pending[-1]["start_time"])[:7]:
+            await flush(pending)
+            pending = []
+        pending.append(reservation)
+    if pending:
+        await flush(pending)
+    return archived, deleted
+
+async def fetch_archived_day_payload(day: str, bench_id: Optional[str] = None) -> EncodedPayload:
+    """An old day's reservations: archived rows plus any still in the live collection (live wins).
+    
+    Reads the reservations collection directly, so old days never get a day snapshot.
+    """
+    archived = await asyncio.to_thread(reservation_archive.read_day, day, bench_id)
+    query = {"start_time": jst_date_range_query(day, day)}
+    if bench_id:
+        query["bench_id"] = bench_id
+    try:
+        live = await asyncio.wait_for(db.reservations.find(query, {"_id": False}).to_list(None), timeout=10.0)
+    except (asyncio.TimeoutError, PyMongoError) as e:
+        logger.error(f"アーカイブ対象日の予約の取得に失敗しました（{day}）: {str(e)}")
+        raise database_unavailable(e)
+    rows = {row["id"]: row for row in dump_reservation_list(build_reservation_list(archived))}
+    rows.update({row["id"]: row for row in dump_reservation_list(build_reservation_list(live))})
+    return EncodedPayload(sorted(rows.values(), key=lambda row: row["start_time"]), reservations_to_columns)
+
+@api_router.get("/archive/reservations", response_model=List[Reservation])
+async def get_archived_reservations(request: Request, date_from: str, date_to: str, bench_id: Optional[str] = None, layout: str = "rows"):
+    """アーカイブ済みの予約（date_from〜date_to、対象の月のパーティションだけを読む）"""
+    validate_layout(layout)
+    try:
+        first_day = parser.parse(date_from).date()
+        last_day = parser.parse(date_to).date()
+    except (ValueError, OverflowError):
+        raise HTTPException(status_code=400, detail="無効な日付形式です")
+    if first_day > last_day:
+        raise HTTPException(status_code=400, detail="date_from は date_to 以前の日付を指定してください")
+    if (last_day - first_day).days >= ARCHIVE_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"期間は{ARCHIVE_RANGE_MAX_DAYS}日以内で指定してください")
+    if not reservation_archive.enabled:
+        return negotiated_response(request, EncodedPayload([], reservations_to_columns), layout)
+    
+    rows = await asyncio.to_thread(lambda: list(reservation_archive.read_range(first_day.isoformat(), last_day.isoformat(), bench_id)))
+    return negotiated_response(request, EncodedPayload(dump_reservation_list(build_reservation_list(rows)), reservations_to_columns), layout)
+
+async def purge_old_reservations(days_to_keep: int) -> dict:
+    """Archive (when enabled) and delete reservations that started more than days_to_keep days ago"""
+    # 削除基準日時を計算
+    cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+    cutoff_jst = JST.localize(cutoff_date.replace(hour=0, minute=0, second=0, microsecond=0))
+    logger.info(f"削除基準日時: {cutoff_jst.isoformat()}")
+    
+    # 削除対象データの確認
+    query = {"start_time": {"$lt": cutoff_jst.isoformat()}}
+    old_reservations = await db.reservations.find(query).to_list(1000)
+    logger.info(f"削除対象の予約数: {len(old_reservations)}")
+    
+    if len(old_reservations) == 0:
+        return {
+            "message": "削除対象のデータはありません",
+            "deleted_count": 0,
+            "cutoff_date": cutoff_jst.isoformat()
+        }
+    
+    # 削除実行
+    archived_count = 0
+    if reservation_archive.enabled:
+        # アーカイブに書き出せた予約だけを削除する
+        archived_count, deleted_count = await archive_reservations_before(cutoff_jst.isoformat())
+    else:
+        delete_result = await db.reservations.delete_many(query)
+        deleted_count = delete_result.deleted_count
+    await db.day_snapshots.delete_many({"_id": {"$lt": cutoff_jst.date().isoformat()}})
+    # 個別の削除の代わりに「この日より前はすべて削除」を1件記録
+    await append_reservation_events([{"op": "purge", "before_day": cutoff_jst.date().isoformat()}])
+    await mark_all_days_changed()
+    
+    logger.info(f"削除完了: {deleted_count}件（アーカイブ: {archived_count}件）")
+    
     return {
-        "benches": [
-            {"id": "front", "name": "手前"},
-            {"id": "back", "name": "奥"}
-        ]
+        "message": "古い予約データをアーカイブして削除しました" if reservation_archive.enabled else "古い予約データを削除しました",
+        "deleted_count": deleted_count,
+        "archived_count": archived_count,
+        "cutoff_date": cutoff_jst.isoformat(),
+        "days_kept": days_to_keep
     }
 
 @api_router.post("/cleanup/old-data")
@@ -457,40 +3181,40 @@ async def cleanup_old_data(days_to_keep: int = 30):
         if not await ensure_database_connection():
             raise HTTPException(status_code=503, detail="データベース接続に問題があります")
         
-        # 削除基準日時を計算
-        cutoff_date = datetime.now() - timedelta(days=days_to_keep)
-        cutoff_jst = JST.localize(cutoff_date.replace(hour=0, minute=0, second=0, microsecond=0))
-        logger.info(f"削除基準日時: {cutoff_jst.isoformat()}")
-        
-        # 削除対象データの確認
-        query = {"start_time": {"$lt": cutoff_jst.isoformat()}}
-        old_reservations = await db.reservations.find(query).to_list(1000)
-        logger.info(f"削除対象の予約数: {len(old_reservations)}")
-        
-        if len(old_reservations) == 0:
-            return {
-                "message": "削除対象のデータはありません",
-                "deleted_count": 0,
-                "cutoff_date": cutoff_jst.isoformat()
-            }
-        
-        # 削除実行
-        delete_result = await db.reservations.delete_many(query)
-        deleted_count = delete_result.deleted_count
-        
-        logger.info(f"削除完了: {deleted_count}件")
-        
-        return {
-            "message": f"古い予約データを削除しました",
-            "deleted_count": deleted_count,
-            "cutoff_date": cutoff_jst.isoformat(),
-            "days_kept": days_to_keep
-        }
+        return await purge_old_reservations(days_to_keep)
         
     except Exception as e:
         logger.error(f"データクリーンアップエラー: {str(e)}")
         raise HTTPException(status_code=500, detail=f"データクリーンアップ中にエラーが発生しました: {str(e)}")
 
+async def count_reservation_status(today) -> dict:
+    """Reservation counts shown by /cleanup/status, relative to today (a JST date)"""
+    # 全件数はコレクションのメタデータから取得する（全件走査を避ける）
+    total_count = await db.reservations.estimated_document_count()
+    
+    # 今日以降の予約数
+    today_jst = JST.localize(datetime.combine(today, datetime.min.time()))
+    future_count = await db.reservations.count_documents({
+        "start_time": {"$gte": today_jst.isoformat()}
+    })
+    
+    # 過去の予約数
+    past_count = total_count - future_count
+    
+    # 30日より古いデータ数
+    cutoff_30_days = datetime.now() - timedelta(days=30)
+    cutoff_30_jst = JST.localize(cutoff_30_days.replace(hour=0, minute=0, second=0, microsecond=0))
+    old_count = await db.reservations.count_documents({
+        "start_time": {"$lt": cutoff_30_jst.isoformat()}
+    })
+    
+    return {
+        "total_reservations": total_count,
+        "future_reservations": future_count,
+        "past_reservations": past_count,
+        "old_data_30days": old_count
+    }
+
 @api_router.get("/cleanup/status")
 async def cleanup_status():
     """データベースの状況とクリーンアップ情報を取得"""
@@ -500,31 +3224,17 @@ async def cleanup_status():
             raise HTTPException(status_code=503, detail="データベース接続に問題があります")
         
         # 全予約数を取得
-        total_count = await db.reservations.count_documents({})
-        
-        # 今日以降の予約数
+        # 件数は予約が変更されるまでキャッシュ（日付が変わると別のキー）
         today = datetime.now().date()
-        today_jst = JST.localize(datetime.combine(today, datetime.min.time()))
-        future_count = await db.reservations.count_documents({
-            "start_time": {"$gte": today_jst.isoformat()}
-        })
-        
-        # 過去の予約数
-        past_count = total_count - future_count
-        
-        # 30日より古いデータ数
-        cutoff_30_days = datetime.now() - timedelta(days=30)
-        cutoff_30_jst = JST.localize(cutoff_30_days.replace(hour=0, minute=0, second=0, microsecond=0))
-        old_count = await db.reservations.count_documents({
-            "start_time": {"$lt": cutoff_30_jst.isoformat()}
-        })
+        counts, _ = await read_cache.get_or_load(
+            f"status:{today.isoformat()}", ["any"], lambda: count_reservation_status(today),
+            encode=json_to_bytes, decode=json.loads
+        )
         
         return {
-            "total_reservations": total_count,
-            "future_reservations": future_count,
-            "past_reservations": past_count,
-            "old_data_30days": old_count,
-            "cleanup_recommended": old_count > 0,
+            **counts,
+            "cleanup_recommended": counts["old_data_30days"] > 0,
+            "archive": await asyncio.to_thread(reservation_archive.stats),
             "database_status": "healthy" if connection_status["healthy"] else "unhealthy",
             "last_check": connection_status["last_check"]
         }
@@ -533,9 +3243,583 @@ async def cleanup_status():
         logger.error(f"ステータス取得エラー: {str(e)}")
         raise HTTPException(status_code=500, detail=f"ステータス取得中にエラーが発生しました: {str(e)}")
 
+@api_router.get("/admin/pool", dependencies=[Depends(verify_admin_token)])
+async def get_pool_stats():
+    """接続プールの設定と計測値（チェックアウト待ち時間、使用中・利用可能な接続数、接続の作成・切断）"""
+    return {
+        "timestamp": datetime.now(JST).isoformat(),
+        "profile": mongo_pool_profile,
+        "options": mongo_client_options,
+        **pool_monitor.snapshot()
+    }
+
+@api_router.get("/admin/slow-ops", dependencies=[Depends(verify_admin_token)])
+async def get_slow_ops(limit: int = 20, reset: bool = False):
+    """クエリの形ごとの実行回数・所要時間のパーセンタイルと、最も遅かった実行例（合計時間の多い順）"""
+    snapshot = slow_op_recorder.snapshot(max(1, min(limit, SLOW_OP_MAX_SHAPES)))
+    if reset:
+        slow_op_recorder.reset()
+    return {"timestamp": datetime.now(JST).isoformat(), **snapshot}
+
+@api_router.get("/admin/metrics", dependencies=[Depends(verify_admin_token)])
+async def get_metrics():
+    """アドミッション制御と読み込み共有の状況"""
+    return {
+        "timestamp": datetime.now(JST).isoformat(),
+        "admission": admission_controller.metrics(),
+        "reservation_reads": reservation_reads.stats(),
+        "read_cache": read_cache.stats()
+    }
+
+# リクエスト単位のプロファイル（秘密のヘッダーか、管理者が有効にした後の数件のみ）
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')  # 空ならヘッダーでは有効にできない
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'bench-profiles'))
+PROFILE_DIR_MAX_BYTES = int(os.environ.get('PROFILE_DIR_MAX_BYTES', str(50 * 1024 * 1024)))
+PROFILE_ARM_MAX_REQUESTS = 20
+PROFILE_ID_PATTERN = re.compile(r'^[0-9A-Za-z-]+$')
+
+class ProfileStore:
+    """cProfile dumps (.prof) plus a JSON summary each, pruned oldest-first to max_bytes"""
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+    
+    def path(self, profile_id: str) -> Optional[Path]:
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.prof"
+        return path if path.is_file() else None
+    
+    def save(self, profile_id: str, profile: cProfile.Profile, summary: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(str(self.directory / f"{profile_id}.prof"))
+        summary["size_bytes"] = (self.directory / f"{profile_id}.prof").stat().st_size
+        (self.directory / f"{profile_id}.json").write_text(json.dumps(summary, ensure_ascii=False), encoding="utf-8")
+        self.prune()
+    
+    def prune(self) -> None:
+        files = sorted(self.directory.glob("*.prof"), key=lambda path: path.stat().st_mtime, reverse=True)
+        total = 0
+        for index, path in enumerate(files):
+            total += path.stat().st_size
+            if total > self.max_bytes and index > 0:  # 保存したばかりのものは残す
+                path.unlink(missing_ok=True)
+                path.with_suffix(".json").unlink(missing_ok=True)
+    
+    def list(self, limit: int) -> List[dict]:
+        if not self.directory.is_dir():
+            return []
+        summaries = []
+        for path in sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True)[:limit]:
+            try:
+                summaries.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return summaries
+
+class RequestProfiler:
+    """Decides which requests to profile and keeps the admin toggle state.
+    
+    cProfile allows one active profiler per thread, so only one request is
+    profiled at a time; others arriving meanwhile run normally. Coroutines of
+    other requests interleaving on the event loop show up in the profile too,
+    so profile when the instance is quiet or look at the request's own frames.
+    """
+    
+    def __init__(self, store: ProfileStore, secret: str = PROFILE_SECRET):
+        self.store = store
+        self.secret = secret
+        self.active = False
+        self.armed = {"remaining": 0, "path_prefix": None, "expires_at": None}
+    
+    def arm(self, requests: int, path_prefix: Optional[str], ttl_seconds: float) -> None:
+        self.armed = {"remaining": requests, "path_prefix": path_prefix, "expires_at": time.time() + ttl_seconds}
+    
+    def disarm(self) -> None:
+        self.armed = {"remaining": 0, "path_prefix": None, "expires_at": None}
+    
+    def wants(self, path: str, token: Optional[str]) -> bool:
+        """Whether to profile this request; consumes one armed slot when the toggle matches"""
+        if self.active:
+            return False
+        if self.secret and token and hmac.compare_digest(token, self.secret):
+            return True
+        armed = self.armed
+        if armed["remaining"] <= 0 or time.time() > (armed["expires_at"] or 0):
+            return False
+        if armed["path_prefix"] and not path.startswith(armed["path_prefix"]):
+            return False
+        armed["remaining"] -= 1
+        return True
+    
+    def status(self) -> dict:
+        armed = self.armed
+        expired = armed["expires_at"] is not None and time.time() > armed["expires_at"]
+        return {
+            "header_enabled": bool(self.secret),
+            "remaining": 0 if expired else armed["remaining"],
+            "path_prefix": armed["path_prefix"],
+            "expires_at": datetime.fromtimestamp(armed["expires_at"], JST).isoformat() if armed["expires_at"] and not expired else None,
+            "active": self.active,
+            "directory": str(self.store.directory),
+            "max_bytes": self.store.max_bytes,
+        }
+
+class ProfilingMiddleware:
+    """ASGI middleware running cProfile around requests chosen by a RequestProfiler.
+    
+    The saved profile's id is returned in the X-Profile-Id response header.
+    """
+    
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = next((value.decode("latin-1") for name, value in scope.get("headers", []) if name == b"x-profile-token"), None)
+        if not self.profiler.wants(scope["path"], token):
+            await self.app(scope, receive, send)
+            return
+        
+        profile_id = f"{datetime.now(JST):%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        status_code = None
+        
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+        
+        profile = cProfile.Profile()
+        self.profiler.active = True
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.disable()
+            self.profiler.active = False
+            summary = {
+                "id": profile_id,
+                "time": datetime.now(JST).isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            try:
+                await asyncio.to_thread(self.profiler.store.save, profile_id, profile, summary)
+            except OSError as e:
+                logger.error(f"プロファイルの保存に失敗しました ({profile_id}): {str(e)}")
+
+request_profiler = RequestProfiler(ProfileStore(PROFILE_DIR, PROFILE_DIR_MAX_BYTES))
+
+class ProfilingToggle(BaseModel):
+    requests: int = Field(default=1, ge=1, le=PROFILE_ARM_MAX_REQUESTS)
+    path_prefix: Optional[str] = None
+    ttl_seconds: float = Field(default=600, gt=0, le=3600)
+
+@api_router.get("/admin/profiling", dependencies=[Depends(verify_admin_token)])
+async def get_profiling_status():
+    """プロファイル対象の設定（残り件数、対象のパス、有効期限）"""
+    return request_profiler.status()
+
+@api_router.post("/admin/profiling", dependencies=[Depends(verify_admin_token)])
+async def arm_profiling(toggle: ProfilingToggle):
+    """次に届く requests 件（path_prefix で始まるパスのみ、ttl_seconds 秒以内）をプロファイルする"""
+    request_profiler.arm(toggle.requests, toggle.path_prefix, toggle.ttl_seconds)
+    return request_profiler.status()
+
+@api_router.delete("/admin/profiling", dependencies=[Depends(verify_admin_token)])
+async def disarm_profiling():
+    request_profiler.disarm()
+    return request_profiler.status()
+
+@api_router.get("/admin/profiles", dependencies=[Depends(verify_admin_token)])
+async def list_profiles(limit: int = 50):
+    """保存済みのプロファイル（新しい順）"""
+    return {"profiles": await asyncio.to_thread(request_profiler.store.list, max(1, min(limit, 200)))}
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(verify_admin_token)])
+async def get_profile(profile_id: str, format: str = "text", sort: str = "cumulative", limit: int = 50):
+    """format=text は上位 limit 件の関数（sort 順）、format=pstats は pstats / snakeviz で開けるファイル"""
+    path = request_profiler.store.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません")
+    if format == "pstats":
+        return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+    if format != "text":
+        raise HTTPException(status_code=400, detail="format には text または pstats を指定してください")
+    if sort not in ("cumulative", "tottime", "calls"):
+        raise HTTPException(status_code=400, detail="sort には cumulative、tottime、calls のいずれかを指定してください")
+    
+    def render() -> str:
+        stream = io.StringIO()
+        pstats.Stats(str(path), stream=stream).sort_stats(sort).print_stats(max(1, min(limit, 500)))
+        return stream.getvalue()
+    
+    return PlainTextResponse(await asyncio.to_thread(render))
+
+# 起動時のキャッシュのウォームアップ（今日から CACHE_WARM_DAYS 日分）
+# 終わるまでは /health/ready が 503 を返し、ロードバランサーがトラフィックを流さないようにする
+CACHE_WARM_DAYS = int(os.environ.get('CACHE_WARM_DAYS', '7'))  # 0 で無効
+CACHE_WARM_CONCURRENCY = int(os.environ.get('CACHE_WARM_CONCURRENCY', '4'))
+
+warmup_status = {
+    "state": "pending",
+    "targets": 0,
+    "warmed": 0,
+    "errors": {},
+    "started_at": None,
+    "duration_seconds": None
+}
+
+async def warm_day(day: str) -> None:
+    """Load one day's payload into read_cache and the reservations the double-booking check reads for it"""
+    await load_day_payload(day)
+    # (bench_id, start_time) インデックスと該当ドキュメントを Mongo のキャッシュに載せる
+    await db.reservations.find(
+        {"bench_id": {"$in": list(bench_registry.active_ids())}, "start_time": jst_date_range_query(day, day)},
+        {"_id": False, "bench_id": True, "start_time": True, "end_time": True}
+    ).to_list(None)
+
+async def warm_caches(days_ahead: int = CACHE_WARM_DAYS) -> None:
+    """Warm day snapshots and the week views covering the next days_ahead days, a few at a time"""
+    today = datetime.now(JST).date()
+    days = [today + timedelta(days=offset) for offset in range(days_ahead)]
+    week_starts = sorted({day - timedelta(days=day.weekday()) for day in days})
+    targets = [(f"day:{day.isoformat()}", lambda day=day: warm_day(day.isoformat())) for day in days]
+    targets += [
+        (f"week:{start.isoformat()}",
+         lambda start=start: load_week_payload([(start + timedelta(days=offset)).isoformat() for offset in range(7)]))
+        for start in week_starts
+    ]
+    warmup_status.update({
+        "state": "warming",
+        "targets": len(targets),
+        "warmed": 0,
+        "errors": {},
+        "started_at": datetime.now(JST).isoformat(),
+        "duration_seconds": None
+    })
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(CACHE_WARM_CONCURRENCY)
+    
+    async def warm(name: str, load: Callable[[], Awaitable[Any]]) -> None:
+        async with semaphore:
+            try:
+                await asyncio.wait_for(load(), timeout=15.0)
+                warmup_status["warmed"] += 1
+            except Exception as e:
+                warmup_status["errors"][name] = str(e) or type(e).__name__
+    
+    await asyncio.gather(*(warm(name, load) for name, load in targets))
+    warmup_status["duration_seconds"] = round(time.monotonic() - started, 3)
+    # 一部が失敗しても通常の読み込みで補えるため ready にする（DB障害は /health/ready の接続確認で判定）
+    warmup_status["state"] = "ready"
+    if warmup_status["errors"]:
+        logger.warning(f"キャッシュのウォームアップで失敗した対象: {warmup_status['errors']}")
+    logger.info(f"キャッシュのウォームアップ完了: {warmup_status['warmed']}/{len(targets)}件 {warmup_status['duration_seconds']}秒")
+
+@api_router.get("/health/live")
+async def liveness_check():
+    """Liveness: the process is serving requests (no database access)"""
+    return {"status": "alive", "timestamp": datetime.now(JST).isoformat()}
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    """Readiness: the warm-up has finished and the database is reachable"""
+    ready = warmup_status["state"] == "ready" and await ensure_database_connection()
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "timestamp": datetime.now(JST).isoformat(),
+        "database": "connected" if connection_status["healthy"] else "disconnected",
+        "warmup": warmup_status
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+# 定期ジョブのスケジューラー（起動時に開始、終了時に停止）
+# 複数インスタンスで動かす場合は Mongo のリース（scheduler_leases）を持つ1台だけがリーダー用ジョブを実行する
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+SCHEDULER_LEASE_TTL_SECONDS = float(os.environ.get('SCHEDULER_LEASE_TTL_SECONDS', '30'))
+SCHEDULED_CLEANUP_CRON = os.environ.get('SCHEDULED_CLEANUP_CRON', '0 3 * * *')
+SCHEDULED_CLEANUP_DAYS = int(os.environ.get('SCHEDULED_CLEANUP_DAYS', '0'))  # 0 で無効（既定、有効にするには7以上を指定）
+
+class CronSchedule:
+    """Minimal 5-field cron expression (minute hour day-of-month month day-of-week), evaluated in JST.
+    
+    Supports *, lists, ranges and steps; day-of-week 0 and 7 are Sunday. As in cron, when both
+    day fields are restricted a day matches if either does.
+    """
+    
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression must have 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        )
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+    
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> frozenset:
+        values = set()
+        for part in field.split(","):
+            base, _, step = part.partition("/")
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start, end = (int(value) for value in base.split("-", 1))
+            else:
+                start = int(base)
+                end = high if step else start
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"invalid cron field: {field!r}")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+    
+    def _day_matches(self, moment: datetime) -> bool:
+        day_match = moment.day in self.days
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+    
+    def next_after(self, moment: datetime) -> datetime:
+        candidate = moment.astimezone(JST).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = JST.localize(datetime(candidate.year + candidate.month // 12, candidate.month % 12 + 1, 1))
+            elif not self._day_matches(candidate):
+                candidate = JST.localize(datetime.combine(candidate.date() + timedelta(days=1), datetime.min.time()))
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron expression never fires: {self.expression!r}")
+
+class ScheduledJob:
+    """A periodic coroutine: every `interval` seconds or on a cron schedule, plus random jitter"""
+    
+    def __init__(self, name: str, func: Callable[[], Awaitable[Any]], interval: Optional[float] = None,
+                 cron: Optional[str] = None, jitter: float = 0.0, timeout: float = 60.0, leader_only: bool = True):
+        if (interval is None) == (cron is None):
+            raise ValueError("specify exactly one of interval and cron")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.leader_only = leader_only
+        self.next_run_at: Optional[datetime] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started_at: Optional[str] = None
+        self.last_duration_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+    
+    def schedule_next(self) -> float:
+        """Seconds until the next run (including jitter); also records next_run_at"""
+        now = datetime.now(JST)
+        if self.cron:
+            delay = (self.cron.next_after(now) - now).total_seconds()
+        else:
+            delay = self.interval
+        delay += random.uniform(0, self.jitter)
+        self.next_run_at = now + timedelta(seconds=delay)
+        return delay
+    
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "schedule": self.cron.expression if self.cron else f"every {self.interval:g}s",
+            "leader_only": self.leader_only,
+            "next_run_at": self.next_run_at.isoformat() if self.next_run_at else None,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started_at": self.last_started_at,
+            "last_duration_seconds": self.last_duration_seconds,
+            "last_error": self.last_error
+        }
+
+class MongoLease:
+    """Leader lock: one lease document owned by one instance until it stops renewing it"""
+    
+    def __init__(self, collection, name: str, owner: str, ttl_seconds: float):
+        self.collection = collection
+        self.name = name
+        self.owner = owner
+        self.ttl = timedelta(seconds=ttl_seconds)
+    
+    async def acquire(self) -> bool:
+        """Take over an expired lease or renew our own; False while another instance holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl, "renewed_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # 有効なリースを他のインスタンスが保持している（条件に合わず upsert が _id で衝突）
+            return False
+        return lease is not None and lease.get("owner") == self.owner
+    
+    async def release(self) -> None:
+        await self.collection.delete_one({"_id": self.name, "owner": self.owner})
+
+class JobScheduler:
+    """Runs ScheduledJobs as background tasks; leader-only jobs run only while holding the lease.
+    
+    Each job runs in its own task with a timeout, and a run is skipped if the previous one is
+    still going, so slow jobs neither overlap nor block request handling.
+    """
+    
+    def __init__(self, lease: MongoLease):
+        self.lease = lease
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.is_leader = False
+        self._tasks: List[asyncio.Task] = []
+        self._runs: set = set()
+    
+    def add_job(self, job: ScheduledJob) -> None:
+        self.jobs[job.name] = job
+    
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        if any(job.leader_only for job in self.jobs.values()):
+            await self._renew_lease()
+            self._tasks.append(asyncio.ensure_future(self._lease_loop()))
+        self._tasks.extend(asyncio.ensure_future(self._job_loop(job)) for job in self.jobs.values())
+        logger.info(f"スケジューラー開始: {', '.join(self.jobs)}（リーダー: {self.is_leader}）")
+    
+    async def stop(self) -> None:
+        tasks = self._tasks + list(self._runs)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                # 次のインスタンスがリースの期限切れを待たずに引き継げるようにする
+                await self.lease.release()
+            except Exception as e:
+                logger.warning(f"リースの解放に失敗しました: {str(e)}")
+    
+    async def _renew_lease(self) -> None:
+        try:
+            leader = await self.lease.acquire()
+        except Exception as e:
+            logger.warning(f"リースの更新に失敗しました: {str(e)}")
+            leader = False
+        if leader != self.is_leader:
+            logger.info(f"スケジューラーのリーダー{'になりました' if leader else 'ではなくなりました'}: {self.lease.owner}")
+        self.is_leader = leader
+    
+    async def _lease_loop(self) -> None:
+        # 期限の1/3ごとに更新し、1回失敗しても期限切れにならないようにする
+        while True:
+            await asyncio.sleep(self.lease.ttl.total_seconds() / 3)
+            await self._renew_lease()
+    
+    async def _job_loop(self, job: ScheduledJob) -> None:
+        while True:
+            await asyncio.sleep(job.schedule_next())
+            if job.running or (job.leader_only and not self.is_leader):
+                job.skipped += 1
+                continue
+            run = asyncio.ensure_future(self.run_job(job))
+            self._runs.add(run)
+            run.add_done_callback(self._runs.discard)
+    
+    async def run_job(self, job: ScheduledJob) -> None:
+        job.running = True
+        job.last_started_at = datetime.now(JST).isoformat()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(job.func(), timeout=job.timeout)
+            job.last_error = None
+        except asyncio.TimeoutError:
+            job.failures += 1
+            job.last_error = f"{job.timeout:g}秒でタイムアウトしました"
+            logger.error(f"ジョブ {job.name} がタイムアウトしました（{job.timeout:g}秒）")
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error(f"ジョブ {job.name} でエラーが発生しました: {str(e)}")
+        finally:
+            job.runs += 1
+            job.running = False
+            job.last_duration_seconds = round(time.monotonic() - started, 3)
+    
+    def status(self) -> dict:
+        return {
+            "owner": self.lease.owner,
+            "is_leader": self.is_leader,
+            "started": bool(self._tasks),
+            "jobs": [job.status() for job in self.jobs.values()]
+        }
+
+async def scheduled_cleanup() -> None:
+    # 手動のクリーンアップと同じく保持期間は最低7日（設定ミスで直近の予約を消さない）
+    if SCHEDULED_CLEANUP_DAYS < 7:
+        raise ValueError(f"保持期間は最低7日必要です（SCHEDULED_CLEANUP_DAYS={SCHEDULED_CLEANUP_DAYS}）")
+    if not await ensure_database_connection():
+        raise RuntimeError("データベース接続に問題があります")
+    result = await purge_old_reservations(SCHEDULED_CLEANUP_DAYS)
+    logger.info(f"定期クリーンアップ: {result.get('message')}（{result.get('deleted_count', 0)}件）")
+
+scheduler = JobScheduler(MongoLease(
+    db.scheduler_leases, "scheduler-leader",
+    f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}",
+    SCHEDULER_LEASE_TTL_SECONDS
+))
+# 接続状態は各インスタンスで確認（障害からの復帰をリクエストを待たずに検知）
+scheduler.add_job(ScheduledJob("check_database_connection", check_database_connection, interval=60, jitter=5, timeout=10, leader_only=False))
+if SCHEDULED_CLEANUP_DAYS > 0:
+    scheduler.add_job(ScheduledJob("cleanup_old_data", scheduled_cleanup, cron=SCHEDULED_CLEANUP_CRON, jitter=60, timeout=600))
+
+@api_router.get("/admin/scheduler", dependencies=[Depends(verify_admin_token)])
+async def get_scheduler_status():
+    """定期ジョブの状態（次回実行時刻、実行回数、直近のエラー、リーダーかどうか）"""
+    return {"timestamp": datetime.now(JST).isoformat(), **scheduler.status()}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# アドミッション制御の内側で計測する（待ち行列の時間はプロファイルに含めない）
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+
+app.add_middleware(
+    AdmissionControlMiddleware,
+    controller=admission_controller,
+    exempt_paths=ADMISSION_EXEMPT_PATHS,
+    trusted_proxy_hops=TRUSTED_PROXY_HOPS
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -551,8 +3835,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    logger.info(f"接続プール設定: {mongo_pool_profile} {mongo_client_options}")
+    if REDIS_URL and redis_asyncio is None:
+        logger.warning("REDIS_URL が設定されていますが redis パッケージがないため、L2キャッシュを使わずに起動します")
+    try:
+        await ensure_indexes()
+        await migrate_reservation_documents()
+        await bench_registry.refresh(force=True)
+        day_snapshot_status["transactions"] = await detect_transaction_support()
+        logger.info(f"スナップショット更新のトランザクション: {'有効' if day_snapshot_status['transactions'] else '無効（スタンドアロン）'}")
+    except Exception as e:
+        logger.error(f"起動時のデータベース準備に失敗しました: {str(e)}")
+    if SCHEDULER_ENABLED:
+        await scheduler.start()
+    if CACHE_WARM_DAYS > 0:
+        # 起動は待たせず裏で実行し、完了までは /health/ready で未準備を返す
+        app.state.warmup_task = asyncio.ensure_future(warm_caches())
+    else:
+        warmup_status["state"] = "ready"
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    warmup_task = getattr(app.state, "warmup_task", None)
+    if warmup_task:
+        warmup_task.cancel()
+    await scheduler.stop()
+    await read_cache.close()
     client.close()
 
 # For Vercel deployment compatibility
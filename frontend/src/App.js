@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import "./App.css";
 import axios from "axios";
 
@@ -32,6 +32,54 @@ api.interceptors.response.use(
 
 
 
+// 書き込みリクエスト用の Idempotency-Key
+// 同じ内容の再送には同じキーを使い、サーバー側での二重登録を防ぐ
+const idempotencyKeys = new Map();
+
+const getIdempotencyKey = (operation, payload) => {
+  const fingerprint = `${operation}:${JSON.stringify(payload)}`;
+  if (!idempotencyKeys.has(fingerprint)) {
+    const key = window.crypto?.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    idempotencyKeys.set(fingerprint, key);
+  }
+  return idempotencyKeys.get(fingerprint);
+};
+
+// サーバーが応答した場合（ネットワークエラー・5xx以外）はキーを破棄する
+const releaseIdempotencyKey = (operation, payload, err = null) => {
+  const status = err?.response?.status;
+  if (!err || (status && status < 500)) {
+    idempotencyKeys.delete(`${operation}:${JSON.stringify(payload)}`);
+  }
+};
+
+// 予約の重複（409）で返される空き時間の提案をメッセージにする
+const describeSuggestions = (suggestions) => {
+  if (!suggestions) return '';
+  const slots = [...(suggestions.same_bench || []), ...(suggestions.other_benches || [])]
+    .map((slot) => `${slot.bench_name} ${slot.start_time.substring(11, 16)}-${slot.end_time.substring(11, 16)}`);
+  return slots.length ? `（空いている時間: ${slots.join('、')}）` : '';
+};
+
+// 差分（GET /changes）を表示中の一覧に反映する
+const applyChanges = (reservations, changes) => {
+  const byId = new Map(reservations.map((reservation) => [reservation.id, reservation]));
+  changes.forEach((change) => {
+    if (change.op === 'purge') {
+      byId.forEach((reservation, id) => {
+        if (reservation.start_time.substring(0, 10) < change.before_day) byId.delete(id);
+      });
+    } else if (change.op === 'delete') {
+      byId.delete(change.id);
+    } else {
+      byId.set(change.id, change.reservation);
+    }
+  });
+  return [...byId.values()].sort((a, b) => (a.start_time < b.start_time ? -1 : 1));
+};
+
 const App = () => {
   const [reservations, setReservations] = useState([]);
   const [selectedDate, setSelectedDate] = useState(new Date().toISOString().split('T')[0]);
@@ -39,6 +87,9 @@ const App = () => {
   const [editingReservation, setEditingReservation] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [userSuggestions, setUserSuggestions] = useState([]);
+  // 表示中の一覧がどの変更（seq）まで反映済みか
+  const changeCursor = useRef({ date: null, seq: null });
 
   // Form state
   const [formData, setFormData] = useState({
@@ -68,7 +119,12 @@ const App = () => {
         }
       };
       
+      // 一覧より先に現在の seq を取得（間の変更は次の差分で重複して届くだけ）
+      const cursor = await api.get('/changes', { params: { date: selectedDate } })
+        .then((changes) => changes.data.next_since)
+        .catch(() => null);
       const response = await api.get('/reservations', requestConfig);
+      changeCursor.current = { date: selectedDate, seq: cursor };
       
       // レスポンスデータの検証
       if (!Array.isArray(response.data)) {
@@ -138,31 +194,77 @@ const App = () => {
     }
   };
 
+  // 書き込み後は変更分だけを取得し、取得できない場合は一覧を読み込み直す
+  const syncReservations = async () => {
+    const { date, seq } = changeCursor.current;
+    if (date !== selectedDate || seq === null) {
+      await loadReservations();
+      return;
+    }
+    try {
+      const response = await api.get('/changes', { params: { since: seq, date } });
+      if (response.data.reset) {
+        await loadReservations();
+        return;
+      }
+      setReservations((current) => applyChanges(current, response.data.changes));
+      changeCursor.current = { date, seq: response.data.next_since };
+      if (response.data.has_more) await syncReservations();
+    } catch (err) {
+      console.warn('差分の取得に失敗したため一覧を読み込み直します:', err);
+      await loadReservations();
+    }
+  };
+
   useEffect(() => {
     loadReservations();
   }, [selectedDate]);
 
+  // 利用者名の入力候補（入力が止まってから前方一致で検索）
+  useEffect(() => {
+    const prefix = formData.user_name.trim();
+    if (!(showCreateForm || editingReservation) || !prefix) {
+      setUserSuggestions([]);
+      return undefined;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await api.get('/users', { params: { prefix, limit: 8 } });
+        setUserSuggestions(response.data.users.map((user) => user.user_name));
+      } catch (err) {
+        setUserSuggestions([]); // 候補の取得失敗は入力の妨げにしない
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [formData.user_name, showCreateForm, editingReservation]);
+
   // Create reservation
   const createReservation = async (e) => {
     e.preventDefault();
+    const reservationData = {
+      ...formData,
+      start_time: `${selectedDate}T${formData.start_time}:00`,
+      end_time: `${selectedDate}T${formData.end_time}:00`
+    };
+    
     try {
       setLoading(true);
       setError('');
       
-      const reservationData = {
-        ...formData,
-        start_time: `${selectedDate}T${formData.start_time}:00`,
-        end_time: `${selectedDate}T${formData.end_time}:00`
-      };
-      
-      await api.post('/reservations', reservationData);
+      await api.post('/reservations', reservationData, {
+        headers: { 'Idempotency-Key': getIdempotencyKey('create', reservationData) }
+      });
+      releaseIdempotencyKey('create', reservationData);
       
       // Reset form and refresh
       setFormData({ bench_id: 'front', user_name: '', start_time: '', end_time: '' });
       setShowCreateForm(false);
-      await loadReservations();
+      await syncReservations();
     } catch (err) {
-      setError(err.response?.data?.detail || '予約の作成に失敗しました');
+      releaseIdempotencyKey('create', reservationData, err);
+      const detail = err.response?.data?.detail || '予約の作成に失敗しました';
+      const suggestions = describeSuggestions(err.response?.data?.suggestions);
+      setError(suggestions ? `${detail}${suggestions}` : detail);
     } finally {
       setLoading(false);
     }
@@ -171,23 +273,28 @@ const App = () => {
   // Update reservation
   const updateReservation = async (e) => {
     e.preventDefault();
+    const updateData = {
+      user_name: formData.user_name,
+      start_time: `${selectedDate}T${formData.start_time}:00`,
+      end_time: `${selectedDate}T${formData.end_time}:00`
+    };
+    const updateKeyPayload = { id: editingReservation.id, ...updateData };
+    
     try {
       setLoading(true);
       setError('');
       
-      const updateData = {
-        user_name: formData.user_name,
-        start_time: `${selectedDate}T${formData.start_time}:00`,
-        end_time: `${selectedDate}T${formData.end_time}:00`
-      };
-      
-      await api.put(`/reservations/${editingReservation.id}`, updateData);
+      await api.put(`/reservations/${editingReservation.id}`, updateData, {
+        headers: { 'Idempotency-Key': getIdempotencyKey('update', updateKeyPayload) }
+      });
+      releaseIdempotencyKey('update', updateKeyPayload);
       
       // Reset form and refresh
       setFormData({ bench_id: 'front', user_name: '', start_time: '', end_time: '' });
       setEditingReservation(null);
-      await loadReservations();
+      await syncReservations();
     } catch (err) {
+      releaseIdempotencyKey('update', updateKeyPayload, err);
       setError(err.response?.data?.detail || '予約の更新に失敗しました');
     } finally {
       setLoading(false);
@@ -417,11 +524,18 @@ const App = () => {
                   type="text"
                   value={formData.user_name}
                   onChange={(e) => setFormData({...formData, user_name: e.target.value})}
+                  list="user-name-suggestions"
+                  autoComplete="off"
                   required
                   placeholder="お名前を入力してください"
                   maxLength={50}
                   title="1文字以上50文字以下で入力してください"
                 />
+                <datalist id="user-name-suggestions">
+                  {userSuggestions.map((name) => (
+                    <option key={name} value={name} />
+                  ))}
+                </datalist>
                 <small style={{color: '#666', fontSize: '0.8rem'}}>
                   1-50文字（特殊文字は使用不可）
                 </small>
@@ -504,8 +618,8 @@ const App = () => {
                           setEditingReservation(null);
                           setFormData({ bench_id: 'front', user_name: '', start_time: '', end_time: '' });
                           
-                          // 予約リストを再読み込み
-                          await loadReservations();
+                          // 予約リストに変更分を反映
+                          await syncReservations();
                           console.log('✅ 削除処理が完了しました');
                           
                         } catch (error) {
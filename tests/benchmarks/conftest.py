@@ -0,0 +1,13 @@
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
+
+# server.py は import 時に Motor クライアントを生成するため、
+# ベンチマークでは実際に接続しないローカルURLを先に設定しておく
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench_reservation_benchmark")
+
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
@@ -0,0 +1,185 @@
+"""時刻パース・重複予約の確認クエリ・入力検証・一覧構築とシリアライズ・利用率集計・読み込みキャッシュのマイクロベンチマーク
+
+実行方法と基準値との比較は README の「パフォーマンス計測」を参照。
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import server  # noqa: E402
+
+SIZES = [10, 1_000, 100_000]
+
+# フロントエンド・API利用者から実際に届く形式を混在させる
+TIME_FORMATS = [
+    lambda dt: dt.isoformat(),                                    # 2025-07-01T09:00:00+09:00
+    lambda dt: dt.astimezone(server.pytz.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),  # JS toISOString()
+    lambda dt: dt.replace(tzinfo=None).isoformat(),               # タイムゾーンなし
+    lambda dt: dt.strftime("%Y-%m-%d %H:%M"),                     # 手入力形式
+]
+
+
+def make_reservations(count, seed=0):
+    """7:00-22:00・30分刻みの予約をDBの格納形式で生成（順不同）"""
+    rng = random.Random(seed)
+    base = server.JST.localize(datetime(2025, 7, 1))
+    reservations = []
+    for i in range(count):
+        day = base + timedelta(days=i // 60)
+        slot = rng.randrange(0, 28)
+        start = day + timedelta(hours=7, minutes=30 * slot)
+        end = start + timedelta(minutes=30 * rng.randint(1, min(4, 30 - slot)))
+        reservations.append({
+            "_id": i,
+            "id": f"res-{i:07d}",
+            "bench_id": rng.choice(["front", "back"]),
+            "user_name": f"利用者{rng.randrange(50)}",
+            "start_time": start.isoformat(),
+            "end_time": end.isoformat(),
+            "created_at": base.isoformat(),
+        })
+    rng.shuffle(reservations)
+    return reservations
+
+
+def make_time_strings(count, seed=0):
+    rng = random.Random(seed)
+    base = server.JST.localize(datetime(2025, 7, 1, 7))
+    return [
+        TIME_FORMATS[i % len(TIME_FORMATS)](base + timedelta(minutes=30 * rng.randrange(30)))
+        for i in range(count)
+    ]
+
+
+@pytest.mark.benchmark(group="parse_jst_time")
+def test_parse_jst_time_mixed_formats(benchmark):
+    time_strings = make_time_strings(1_000)
+
+    def parse_all():
+        for value in time_strings:
+            server.parse_jst_time(value)
+
+    benchmark(parse_all)
+
+
+@pytest.mark.benchmark(group="double-booking-probe")
+@pytest.mark.parametrize("size", [10, 1_000])
+def test_double_booking_probe_without_conflict(benchmark, monkeypatch, size):
+    # mongomock（プロセス内・インデックスなし）なので、ネットワーク往復を除いたクエリ組み立てと照合の費用を測る
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    loop = asyncio.new_event_loop()
+    database = mongomock_motor.AsyncMongoMockClient()["bench_reservation_benchmark"]
+    monkeypatch.setattr(server, "db", database)
+    loop.run_until_complete(database.reservations.insert_many(make_reservations(size)))
+    # 既存予約はすべて別日なので一致しない（最悪ケース）
+    start, end = "2099-01-01T09:00:00+09:00", "2099-01-01T10:00:00+09:00"
+
+    def probe():
+        return loop.run_until_complete(server.check_double_booking("front", start, end, "res-0000000"))
+
+    try:
+        assert benchmark(probe) is False
+    finally:
+        loop.close()
+
+
+@pytest.mark.benchmark(group="validators")
+def test_reservation_create_validation(benchmark):
+    time_strings = make_time_strings(200)
+    payloads = [
+        {
+            "bench_id": "front" if i % 2 else "back",
+            "user_name": f"  利用者{i}  ",
+            "start_time": time_strings[i],
+            "end_time": time_strings[(i + 1) % len(time_strings)],
+        }
+        for i in range(len(time_strings))
+    ]
+
+    def validate_all():
+        for payload in payloads:
+            server.ReservationCreate(**payload)
+
+    benchmark(validate_all)
+
+
+@pytest.mark.benchmark(group="build-reservation-list")
+@pytest.mark.parametrize("size", SIZES)
+def test_build_reservation_list(benchmark, size):
+    reservations = make_reservations(size)
+    rounds = 3 if size >= 100_000 else 20
+    result = benchmark.pedantic(server.build_reservation_list, args=(reservations,), rounds=rounds)
+    assert len(result) == size
+
+
+@pytest.mark.benchmark(group="serialize-reservation-list")
+@pytest.mark.parametrize("encoder", ["jsonable_encoder", "type_adapter"])
+def test_serialize_reservation_list(benchmark, encoder):
+    # 以前の jsonable_encoder と、キャッシュ済み TypeAdapter による一括変換の比較
+    reservations = server.build_reservation_list(make_reservations(1_000))
+    serialize = server.jsonable_encoder if encoder == "jsonable_encoder" else server.dump_reservation_list
+    result = benchmark(serialize, reservations)
+    assert result == server.jsonable_encoder(reservations)
+
+
+@pytest.mark.benchmark(group="utilization")
+def test_utilization_matrix_one_year(benchmark):
+    # 4台 × 365日、空き枠を挟みながら 7:00-22:00 を埋める（約1万件）
+    rng = random.Random(0)
+    days = [(datetime(2025, 1, 1) + timedelta(days=i)).date().isoformat() for i in range(365)]
+    rows = []
+    for day_index in range(len(days)):
+        for bench_index in range(4):
+            minute = 7 * 60
+            while True:
+                minute += 30 * rng.randint(0, 3)
+                duration = 30 * rng.randint(1, 4)
+                if minute + duration > 22 * 60:
+                    break
+                rows.append((bench_index, day_index, minute, minute + duration))
+                minute += duration
+    intervals = np.array(rows, dtype=np.intp)
+    bench_ids = ["a", "b", "c", "d"]
+
+    def summarize():
+        occupancy = server.build_occupancy_matrix(intervals, len(bench_ids), len(days))
+        return server.summarize_utilization(occupancy, intervals, bench_ids, days)
+
+    result = benchmark(summarize)
+    assert result["reservation_count"] == len(rows)
+
+
+@pytest.mark.benchmark(group="read-cache")
+@pytest.mark.parametrize("tier", ["l1", "l2"])
+def test_read_cache_hit(benchmark, tier):
+    # L2 は fakeredis（プロセス内）なので、ネットワーク往復を除いたエンコード・デコードの費用を測る
+    fakeredis = pytest.importorskip("fakeredis")
+    loop = asyncio.new_event_loop()
+    cache = server.TwoTierCache(fakeredis.FakeAsyncRedis(), ttl_seconds=60)
+    payload = server.EncodedPayload(
+        server.jsonable_encoder(server.build_reservation_list(make_reservations(60))),
+        server.reservations_to_columns
+    )
+
+    async def load():
+        return payload
+
+    def read():
+        if tier == "l2":
+            cache.entries.clear()
+        return loop.run_until_complete(cache.get_or_load(
+            "day:2025-07-01:*", server.day_scopes(["2025-07-01"]), load,
+            encode=server.payload_to_bytes, decode=server.reservations_payload_from_bytes
+        ))
+
+    try:
+        read()
+        _, source = benchmark(read)
+        assert source == tier
+    finally:
+        loop.close()
@@ -0,0 +1,17 @@
+import server
+
+from .conftest import ADMIN_HEADERS
+
+
+def test_admin_requires_matching_token(client, db):
+    assert client.get("/api/admin/metrics").status_code == 403
+    assert client.get("/api/admin/metrics", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/api/admin/metrics", headers=ADMIN_HEADERS).status_code == 200
+
+
+def test_admin_fails_closed_without_token(client, db, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", None)
+    assert client.get("/api/admin/metrics", headers=ADMIN_HEADERS).status_code == 503
+
+    monkeypatch.setattr(server, "ADMIN_AUTH_DISABLED", True)
+    assert client.get("/api/admin/metrics").status_code == 200
@@ -0,0 +1,70 @@
+"""アドミッション制御（レート制限と同時実行数の上限）"""
+import asyncio
+
+import server
+
+
+def test_rate_limit_per_client(client, db, monkeypatch):
+    controller = server.admission_controller
+    monkeypatch.setattr(controller, "rate", 0.5)
+    monkeypatch.setattr(controller, "burst", 2)
+    monkeypatch.setattr(controller, "_buckets", {})
+
+    statuses = [client.get("/api/benches").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    limited = client.get("/api/benches")
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+
+    # ヘルスチェックは制限されない
+    assert client.get("/api/health/live").status_code == 200
+
+
+def test_spoofed_forwarded_for_does_not_reset_bucket(client, db, monkeypatch):
+    controller = server.admission_controller
+    monkeypatch.setattr(controller, "rate", 0.5)
+    monkeypatch.setattr(controller, "burst", 2)
+    monkeypatch.setattr(controller, "_buckets", {})
+
+    statuses = [client.get("/api/benches", headers={"X-Forwarded-For": f"203.0.113.{number}"}).status_code
+                for number in range(4)]
+    assert statuses == [200, 200, 429, 429]
+    assert list(controller._buckets) == ["testclient"]
+
+
+def test_client_key_behind_trusted_proxies():
+    def scope(*forwarded):
+        return {"client": ("10.0.0.2", 443), "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded]}
+
+    direct = server.AdmissionControlMiddleware(None, server.admission_controller)
+    assert direct.client_key(scope("203.0.113.7")) == "10.0.0.2"
+
+    # プロキシが付けた右端だけを信頼し、クライアントが送った左側は無視する
+    proxied = server.AdmissionControlMiddleware(None, server.admission_controller, trusted_proxy_hops=1)
+    assert proxied.client_key(scope("1.1.1.1, 2.2.2.2, 198.51.100.4")) == "198.51.100.4"
+    assert proxied.client_key(scope("1.1.1.1", "198.51.100.4")) == "198.51.100.4"
+    assert proxied.client_key(scope()) == "10.0.0.2"
+
+    two_hops = server.AdmissionControlMiddleware(None, server.admission_controller, trusted_proxy_hops=2)
+    assert two_hops.client_key(scope("1.1.1.1, 198.51.100.4, 10.0.0.9")) == "198.51.100.4"
+    assert two_hops.client_key(scope("10.0.0.9")) == "10.0.0.2"
+
+
+def test_concurrency_limit_sheds_when_queue_is_full_or_slow(run):
+    controller = server.AdmissionController(rate=0, burst=0, max_concurrent=1, max_queue=1, queue_timeout=0.05)
+
+    async def main():
+        assert await controller.acquire() is None
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        full = await controller.acquire()
+        timed_out = await waiter
+        controller.release()
+        admitted = await controller.acquire()
+        controller.release()
+        return full, timed_out, admitted
+
+    assert run(main) == ("queue_full", "queue_timeout", None)
+    metrics = controller.metrics()
+    assert (metrics["admitted"], metrics["rejected_queue_full"], metrics["rejected_queue_timeout"]) == (2, 1, 1)
+    assert metrics["active"] == 0
@@ -0,0 +1,66 @@
+"""古い予約のアーカイブ"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+def old_reservation(reservation_id: str, start: datetime, bench_id: str = "front") -> dict:
+    return {"id": reservation_id, "bench_id": bench_id, "user_name": "山田", "user_key": "山田", "version": 1,
+            "start_time": start.isoformat(), "end_time": (start + timedelta(hours=1)).isoformat(),
+            "created_at": start.isoformat()}
+
+
+def test_archive_round_trip_and_merge(tmp_path):
+    archive = server.ReservationArchive(str(tmp_path))
+    first = server.JST.localize(datetime(2025, 7, 1, 9))
+    # UTC で書かれた時刻も JST の日付（7/1）のパーティション・日に入る
+    utc = old_reservation("utc", first + timedelta(hours=3))
+    utc["start_time"] = "2025-06-30T18:00:00+00:00"
+    assert archive.write([old_reservation("a", first), utc, old_reservation("b", first + timedelta(days=30))]) == 3
+
+    assert sorted(row["id"] for row in archive.read_day("2025-07-01")) == ["a", "utc"]
+    assert archive.partitions() == ["2025-07"]
+
+    # 同じ日を再びアーカイブすると id で統合され、他の日はそのまま残る
+    updated = old_reservation("a", first, bench_id="back")
+    archive.write([updated, old_reservation("c", first + timedelta(hours=5))])
+    assert sorted((row["id"], row["bench_id"]) for row in archive.read_day("2025-07-01")) == [("a", "back"), ("c", "front"), ("utc", "front")]
+    assert [row["id"] for row in archive.read_range("2025-07-02", "2025-07-31")] == ["b"]
+    assert archive.stats()["reservations"] == 4
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["2025-07.2.jsonl.gz", "2025-07.index.json"]
+
+
+def test_archive_never_overwrites_generation_files_or_locked_partitions(tmp_path, monkeypatch):
+    archive = server.ReservationArchive(str(tmp_path))
+    start = server.JST.localize(datetime(2025, 7, 1, 9))
+    # 停止したプロセスが途中まで書いた世代のファイル
+    (tmp_path / "2025-07.1.jsonl.gz").write_bytes(b"partial")
+    archive.write([old_reservation("a", start)])
+    assert (tmp_path / "2025-07.1.jsonl.gz").read_bytes() == b"partial"
+    assert [row["id"] for row in archive.read_day("2025-07-01")] == ["a"]
+
+    # 他のプロセスが書き込み中のパーティションは待ってからタイムアウトする
+    monkeypatch.setattr(server, "ARCHIVE_LOCK_TIMEOUT_SECONDS", 0.1)
+    (tmp_path / "2025-07.lock").write_bytes(b"other:1")
+    with pytest.raises(TimeoutError):
+        archive.write([old_reservation("b", start)])
+    assert [row["id"] for row in archive.read_day("2025-07-01")] == ["a"]
+
+
+def test_old_days_read_archive_and_live_rows_without_snapshot(client, run, db, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "reservation_archive", server.ReservationArchive(str(tmp_path)))
+    start = (datetime.now(server.JST) - timedelta(days=40)).replace(hour=9, minute=0, second=0, microsecond=0)
+    day = start.date().isoformat()
+    run(db.reservations.insert_one, old_reservation("archived", start))
+
+    result = run(server.purge_old_reservations, 30)
+    assert (result["archived_count"], result["deleted_count"]) == (1, 1)
+    # 削除後に書き込まれた予約（まだコレクションに残っている）
+    run(db.reservations.insert_one, old_reservation("live", start + timedelta(hours=2)))
+
+    response = client.get("/api/reservations", params={"date": day})
+    assert response.status_code == 200
+    assert [row["id"] for row in response.json()] == ["archived", "live"]
+    assert run(db.day_snapshots.find_one, {"_id": day}) is None
@@ -0,0 +1,16 @@
+import server
+
+from .test_reservations import reservation
+
+
+def test_create_picks_up_bench_added_elsewhere_after_ttl(client, run, db):
+    run(server.bench_registry.refresh, True)
+    # 別インスタンスが登録したベンチ（このインスタンスのキャッシュにはまだない）
+    run(db.benches.insert_one, {"id": "lab", "name": "実験室", "room": None, "order": 2, "active": True})
+
+    assert client.post("/api/reservations", json=reservation(bench_id="lab")).status_code == 422
+
+    server.bench_registry._loaded_at -= server.BENCH_REGISTRY_TTL_SECONDS
+    response = client.post("/api/reservations", json=reservation(bench_id="lab"))
+    assert response.status_code == 200
+    assert response.json()["bench_id"] == "lab"
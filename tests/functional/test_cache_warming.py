@@ -0,0 +1,17 @@
+"""起動時のキャッシュのウォームアップ"""
+from datetime import datetime, timedelta
+
+import server
+
+from .test_reservations import reservation
+
+
+def test_warmed_day_is_served_from_cache(client, run, db):
+    assert client.post("/api/reservations", json=reservation(days_ahead=1)).status_code == 200
+    day = (datetime.now(server.JST).date() + timedelta(days=1)).isoformat()
+
+    run(server.warm_day, day)
+    response = client.get("/api/reservations", params={"date": day})
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "HIT-L1"
+    assert [item["user_name"] for item in response.json()] == ["山田"]
@@ -0,0 +1,58 @@
+"""変更履歴と差分同期（GET /changes）"""
+from datetime import datetime, timedelta
+
+import server
+
+from .test_reservations import reservation, slot
+
+
+def changes(client, **params) -> dict:
+    response = client.get("/api/changes", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def summary(body: dict) -> list:
+    return [(change["op"], change.get("id"), change.get("reservation", {}).get("user_name")) for change in body["changes"]]
+
+
+def test_changes_are_compacted_per_reservation_and_day(client):
+    day1 = (datetime.now(server.JST).date() + timedelta(days=2)).isoformat()
+    day2 = (datetime.now(server.JST).date() + timedelta(days=3)).isoformat()
+    initial = changes(client, date=day1)
+    assert initial["reset"] is True
+    since = initial["next_since"]
+
+    first, second, third = (client.post("/api/reservations", json=reservation(user_name=f"利用者{hour}", days_ahead=2, hour=hour)).json()["id"]
+                            for hour in (9, 11, 13))
+    assert client.put(f"/api/reservations/{first}", json={"user_name": "変更後"}).status_code == 200
+    start_time, end_time = slot(3, 10)
+    assert client.put(f"/api/reservations/{second}", json={"start_time": start_time, "end_time": end_time}).status_code == 200
+    assert client.delete(f"/api/reservations/{third}").status_code == 200
+
+    # 作成・変更・削除が予約ごとの最新1件にまとまり、移動元の日には削除として届く
+    assert summary(changes(client, since=since, date=day1)) == [("upsert", first, "変更後"), ("delete", second, None), ("delete", third, None)]
+    assert summary(changes(client, since=since, date=day2)) == [("upsert", second, "利用者11")]
+
+    everything = changes(client, since=since)
+    assert len(everything["changes"]) == 4
+    assert changes(client, since=everything["next_since"]) == {
+        "since": everything["next_since"], "next_since": everything["next_since"], "reset": False, "has_more": False, "changes": []
+    }
+
+
+def test_changes_page_and_reset(client, run, db):
+    since = changes(client)["next_since"]
+    for hour in (9, 11, 13):
+        assert client.post("/api/reservations", json=reservation(hour=hour)).status_code == 200
+
+    page = changes(client, since=since, limit=2)
+    assert (len(page["changes"]), page["has_more"]) == (2, True)
+    rest = changes(client, since=page["next_since"])
+    assert (len(rest["changes"]), rest["has_more"]) == (1, False)
+
+    assert changes(client, since=rest["next_since"] + 10)["reset"] is True
+    # 保持期間を過ぎて削除されたイベントがあれば一覧の取り直しを求める
+    run(db.reservation_events.delete_many, {"seq": {"$lte": since + 1}})
+    assert changes(client, since=since)["reset"] is True
+    assert client.get("/api/changes", params={"limit": 0}).status_code == 400
@@ -0,0 +1,34 @@
+"""日付指定の一覧（日別スナップショット）の読み込みエラー"""
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError
+
+import server
+
+
+def tomorrow() -> str:
+    return (datetime.now(server.JST).date() + timedelta(days=1)).isoformat()
+
+
+@pytest.mark.parametrize("error, status_code", [
+    (AutoReconnect("primary stepped down"), 503),
+    (ServerSelectionTimeoutError("no servers"), 503),
+    (NetworkTimeout("socket timed out"), 504),
+])
+def test_driver_errors_map_to_unavailable(client, db, monkeypatch, error, status_code):
+    async def failing(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(type(db.day_snapshots), "find_one", failing)
+    response = client.get("/api/reservations", params={"date": tomorrow()})
+    assert response.status_code == status_code
+    assert server.connection_status["healthy"] is False
+
+
+def test_snapshot_insert_failure_is_unavailable(client, db, monkeypatch):
+    async def failing(*args, **kwargs):
+        raise AutoReconnect("not primary")
+
+    monkeypatch.setattr(type(db.day_snapshots), "insert_one", failing)
+    assert client.get("/api/reservations", params={"date": tomorrow()}).status_code == 503
@@ -0,0 +1,57 @@
+"""予約の削除と一括削除"""
+from datetime import datetime, timedelta
+
+import server
+
+from .test_reservations import reservation
+
+
+def create(client, **kwargs) -> str:
+    response = client.post("/api/reservations", json=reservation(**kwargs))
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def day(days_ahead: int) -> str:
+    return (datetime.now(server.JST).date() + timedelta(days=days_ahead)).isoformat()
+
+
+def test_delete_then_not_found(client):
+    reservation_id = create(client)
+    deleted = client.delete(f"/api/reservations/{reservation_id}")
+    assert deleted.status_code == 200
+    assert deleted.json()["deleted_id"] == reservation_id
+    assert client.delete(f"/api/reservations/{reservation_id}").status_code == 404
+
+
+def test_bulk_delete_by_ids_reports_each_id(client):
+    first, second = create(client, hour=9), create(client, hour=11)
+    response = client.request("DELETE", "/api/reservations", json={"ids": [first, "missing", second]})
+    assert response.status_code == 200
+    assert response.json()["deleted_count"] == 2
+    assert response.json()["results"] == [
+        {"id": first, "status": "deleted"},
+        {"id": "missing", "status": "not_found"},
+        {"id": second, "status": "deleted"},
+    ]
+
+
+def test_bulk_delete_by_bench_and_range(client):
+    kept = [create(client, bench_id="back", days_ahead=1), create(client, days_ahead=4)]
+    removed = [create(client, days_ahead=1), create(client, days_ahead=2)]
+
+    response = client.request("DELETE", "/api/reservations",
+                              json={"bench_id": "front", "date_from": day(1), "date_to": day(3)})
+    assert response.status_code == 200
+    assert sorted(result["id"] for result in response.json()["results"]) == sorted(removed)
+
+    remaining = client.get("/api/reservations").json()
+    assert sorted(row["id"] for row in remaining) == sorted(kept)
+
+
+def test_bulk_delete_requires_ids_or_full_range(client):
+    create(client)
+    assert client.request("DELETE", "/api/reservations", json={"bench_id": "front"}).status_code == 400
+    assert client.request("DELETE", "/api/reservations", json={"date_from": day(1)}).status_code == 400
+    assert client.request("DELETE", "/api/reservations", json={"date_from": day(3), "date_to": day(1)}).status_code == 400
+    assert len(client.get("/api/reservations").json()) == 1
@@ -0,0 +1,37 @@
+"""CSV / iCalendar のエクスポート"""
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+from .conftest import ADMIN_HEADERS
+from .test_reservations import reservation
+
+
+def test_exports_stream_reservations(client):
+    assert client.post("/api/reservations", json=reservation()).status_code == 200
+
+    csv = client.get("/api/export.csv", headers=ADMIN_HEADERS)
+    assert csv.status_code == 200
+    assert csv.text.lstrip("\ufeff").splitlines()[1].split(",")[4] == "山田"
+
+    ics = client.get("/api/export.ics", headers=ADMIN_HEADERS)
+    assert ics.status_code == 200
+    assert ics.text.count("BEGIN:VEVENT") == 1
+    assert ics.text.rstrip().endswith("END:VCALENDAR")
+
+
+@pytest.mark.parametrize("path", ["/api/export.csv", "/api/export.ics"])
+def test_cursor_error_after_header_aborts_the_stream(client, monkeypatch, path):
+    assert client.post("/api/reservations", json=reservation()).status_code == 200
+    original = server.iter_export_reservations
+
+    async def failing(query):
+        async for item in original(query):
+            yield item
+        raise AutoReconnect("connection lost")
+
+    monkeypatch.setattr(server, "iter_export_reservations", failing)
+    # 正常終了したレスポンスとして届かない（ヘッダー送信後なので接続ごと切られる）
+    with pytest.raises(AutoReconnect):
+        client.get(path, headers=ADMIN_HEADERS)
@@ -0,0 +1,58 @@
+"""レスポンス形式のネゴシエーション（MessagePack・圧縮・列指向）"""
+import gzip
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+from .test_reservations import reservation
+
+
+@pytest.fixture
+def day(client) -> str:
+    # 圧縮の対象になるよう1日に複数の予約を作る
+    for hour in range(7, 21):
+        response = client.post("/api/reservations", json=reservation(
+            bench_id="front" if hour % 2 else "back", user_name=f"利用者{hour}", days_ahead=2, hour=hour, minutes=30))
+        assert response.status_code == 200
+    return (datetime.now(server.JST).date() + timedelta(days=2)).isoformat()
+
+
+def test_msgpack_and_columns_match_json(client, day):
+    msgpack = pytest.importorskip("msgpack")
+    plain = client.get("/api/reservations", params={"date": day}, headers={"Accept-Encoding": "identity"})
+    assert plain.headers["content-type"] == "application/json"
+    assert plain.headers["Vary"] == "Accept, Accept-Encoding"
+    rows = plain.json()
+    assert len(rows) == 14
+
+    packed = client.get("/api/reservations", params={"date": day},
+                        headers={"Accept": "application/msgpack", "Accept-Encoding": "identity"})
+    assert packed.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(packed.content) == rows
+
+    columns = client.get("/api/reservations", params={"date": day, "layout": "columns"}).json()
+    assert columns["count"] == 14
+    assert columns["columns"]["id"] == [row["id"] for row in rows]
+
+
+def test_compression_follows_accept_encoding(client, day):
+    response = client.get("/api/reservations", params={"date": day}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.json()) == 14  # httpx が展開する
+
+    raw = server.EncodedPayload(response.json()).encode("json", "rows", "gzip")
+    assert gzip.decompress(raw) == server.EncodedPayload(response.json()).encode("json", "rows")
+
+    assert server.negotiate_encoding("gzip;q=0.8, br;q=0.9") == ("br" if server.brotli is not None else "gzip")
+    assert server.negotiate_encoding("br;q=0, gzip;q=0") is None
+    assert server.negotiate_encoding(None) is None
+
+
+def test_unsupported_format_and_layout(client, day):
+    assert client.get("/api/reservations", params={"date": day}, headers={"Accept": "text/csv"}).status_code == 406
+    assert client.get("/api/reservations", params={"date": day, "layout": "bogus"}).status_code == 400
+    # ブラウザ・axios の既定の Accept は JSON になる
+    browser = client.get("/api/reservations", params={"date": day}, headers={"Accept": "application/json, text/plain, */*"})
+    assert browser.headers["content-type"] == "application/json"
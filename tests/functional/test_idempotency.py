@@ -0,0 +1,63 @@
+"""Idempotency-Key による書き込みの再送"""
+import server
+
+from .test_reservations import reservation
+
+
+def test_replay_returns_stored_result_without_writing_again(client, run, db):
+    body = reservation()
+    first = client.post("/api/reservations", json=body, headers={"Idempotency-Key": "k1"})
+    replay = client.post("/api/reservations", json=body, headers={"Idempotency-Key": "k1"})
+
+    assert first.status_code == replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json()["id"] == first.json()["id"]
+    assert run(db.reservations.count_documents, {}) == 1
+
+
+def test_same_key_with_different_body_is_rejected(client):
+    assert client.post("/api/reservations", json=reservation(), headers={"Idempotency-Key": "k2"}).status_code == 200
+    mismatch = client.post("/api/reservations", json=reservation(hour=11), headers={"Idempotency-Key": "k2"})
+    assert mismatch.status_code == 422
+
+
+def test_key_is_released_when_result_cannot_be_stored(client, run, db, monkeypatch):
+    async def broken(*args):
+        raise RuntimeError("write concern timeout")
+
+    async def no_wait(seconds):
+        return None
+
+    monkeypatch.setattr(server, "complete_idempotent_request", broken)
+    monkeypatch.setattr(server.asyncio, "sleep", no_wait)
+    assert client.post("/api/reservations", json=reservation(), headers={"Idempotency-Key": "k3"}).status_code == 200
+
+    # 保留のままだと再送が 409 になり続ける
+    assert run(db.idempotency_keys.count_documents, {}) == 0
+
+
+def test_replayed_update_carries_the_etag(client):
+    created = client.post("/api/reservations", json=reservation()).json()
+    url = f"/api/reservations/{created['id']}"
+    headers = {"Idempotency-Key": "k4", "If-Match": server.reservation_etag(created["version"])}
+    first = client.put(url, json={"user_name": "佐藤"}, headers=headers)
+    replay = client.put(url, json={"user_name": "佐藤"}, headers=headers)
+
+    assert first.status_code == replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.headers["ETag"] == first.headers["ETag"]
+
+
+def test_committed_write_keeps_key_when_event_append_fails(client, run, db, monkeypatch):
+    async def broken(events, session=None):
+        raise RuntimeError("primary stepped down")
+
+    monkeypatch.setattr(server, "append_reservation_events", broken)
+    body = reservation()
+    first = client.post("/api/reservations", json=body, headers={"Idempotency-Key": "k5"})
+    retry = client.post("/api/reservations", json=body, headers={"Idempotency-Key": "k5"})
+
+    # 予約は保存済みなので、再送は自分の予約と重複(409)にならず同じ結果を返す
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert run(db.reservations.count_documents, {}) == 1
@@ -0,0 +1,129 @@
+"""管理用コマンド（manage.py）"""
+import argparse
+import collections
+import os
+import random
+from datetime import date, timedelta
+
+import mongomock_motor
+import pytest
+
+import manage
+import server
+
+
+def explain(keys: int, docs: int, returned: int, stage: str = "IXSCAN") -> dict:
+    return {
+        "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": stage, "indexName": "bench_id_1_start_time_1"}}},
+        "executionStats": {"nReturned": returned, "totalKeysExamined": keys, "totalDocsExamined": docs},
+    }
+
+
+def test_audit_flags_unselective_index_scans():
+    assert manage.audit_explain(explain(5000, 5000, 1))["flags"] == ["UNSELECTIVE"]
+    assert manage.audit_explain(explain(50, 50, 1))["flags"] == []  # 読み取りが少なければ比率は見ない
+    assert manage.audit_explain(explain(900, 900, 100))["flags"] == []
+    assert manage.audit_explain(explain(900, 900, 100), max_examined_ratio=5)["flags"] == ["UNSELECTIVE"]
+
+    # 削除は返却件数ではなく削除対象の件数と比べる
+    delete = explain(1000, 1000, 0)
+    delete["executionStats"]["executionStages"] = {"stage": "DELETE", "nWouldDelete": 1000}
+    assert manage.audit_explain(delete)["flags"] == []
+
+
+def test_audit_queries_exits_non_zero_on_unselective_plan(run, db, monkeypatch, capsys):
+    client = mongomock_motor.AsyncMongoMockClient()
+    audit_db = client["plan_audit"]
+    run(audit_db.reservations.insert_one, {"id": "r1", "bench_id": "front", "user_name": "山田", "user_key": "山田",
+                                           "start_time": "2025-07-01T09:00:00+09:00", "end_time": "2025-07-01T10:00:00+09:00"})
+    monkeypatch.setattr(server, "client", client)
+
+    async def ensure_indexes():
+        pass
+
+    monkeypatch.setattr(server, "ensure_indexes", ensure_indexes)
+    args = argparse.Namespace(database="plan_audit", no_seed=True, keep=True, max_examined_ratio=manage.AUDIT_MAX_EXAMINED_RATIO)
+
+    async def selective(self, command, *args, **kwargs):
+        return explain(1, 1, 1)
+
+    monkeypatch.setattr(type(audit_db), "command", selective)
+    assert run(manage.audit_queries, args) == 0
+
+    async def unselective(self, command, *args, **kwargs):
+        return explain(20000, 20000, 1)
+
+    monkeypatch.setattr(type(audit_db), "command", unselective)
+    assert run(manage.audit_queries, args) == 1
+    assert "NG UNSELECTIVE" in capsys.readouterr().out
+
+
+def test_generated_reservations_follow_booking_rules():
+    days = [date(2025, 7, 1) + timedelta(days=offset) for offset in range(20)]
+    bench_ids = manage.seed_bench_ids(3)
+    documents = list(manage.generate_reservations(random.Random(1), days, bench_ids, 20, 0.6, 2.0))
+    assert bench_ids[2] == "bench-03"
+    assert len({document["id"] for document in documents}) == len(documents)
+
+    booked = collections.defaultdict(list)
+    for document in documents:
+        start, end = server.parse_jst_time(document["start_time"]), server.parse_jst_time(document["end_time"])
+        server.validate_booking_window(start, end)
+        booked[(document["bench_id"], start.date())].append((start, end))
+    for bookings in booked.values():
+        bookings.sort()
+        assert all(earlier[1] <= later[0] for earlier, later in zip(bookings, bookings[1:]))
+
+    assert len(list(manage.generate_reservations(random.Random(1), days, bench_ids, 20, 0.6, 2.0, limit=17))) == 17
+
+
+def seed_args(**overrides) -> argparse.Namespace:
+    args = dict(database="seed_test", date_from="2025-07-01", days=5, benches=2, users=10, occupancy=0.6, peak_skew=2.0,
+                reservations=None, seed=0, batch_size=50, concurrency=2, drop=False, yes_really=False)
+    return argparse.Namespace(**{**args, **overrides})
+
+
+def test_seed_refuses_non_empty_database_without_drop(run, monkeypatch):
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client)
+    invalidations = []
+
+    async def mark_all_days_changed():
+        invalidations.append(1)
+
+    monkeypatch.setattr(server, "mark_all_days_changed", mark_all_days_changed)
+    args = seed_args()
+    assert run(manage.seed_reservations, args) == 0
+    seeded = run(client["seed_test"].reservations.count_documents, {})
+    assert seeded > 0
+    assert sorted(run(client["seed_test"].benches.distinct, "id")) == sorted(manage.seed_bench_ids(2))
+
+    assert run(manage.seed_reservations, args) == 2
+    args.drop, args.reservations = True, 10
+    assert run(manage.seed_reservations, args) == 0
+    assert run(client["seed_test"].reservations.count_documents, {}) == 10
+    # アプリが読んでいないデータベースなので、キャッシュには触れない
+    assert invalidations == []
+
+
+def test_seed_drop_on_production_database_needs_confirmation(run, db, monkeypatch):
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client)
+    invalidations = []
+
+    async def mark_all_days_changed():
+        invalidations.append(1)
+
+    monkeypatch.setattr(server, "mark_all_days_changed", mark_all_days_changed)
+    args = seed_args(database=os.environ["DB_NAME"], drop=True, reservations=10)
+    assert run(manage.seed_reservations, args) == 2
+    assert run(client[os.environ["DB_NAME"]].reservations.count_documents, {}) == 0
+
+    args.yes_really = True
+    assert run(manage.seed_reservations, args) == 0
+    assert run(client[os.environ["DB_NAME"]].reservations.count_documents, {}) == 10
+    assert invalidations == [1]
+
+    # --database は省略できない
+    with pytest.raises(SystemExit):
+        manage.main(["seed", "--drop"])
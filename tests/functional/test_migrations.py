@@ -0,0 +1,18 @@
+"""起動時の予約ドキュメントの移行"""
+import server
+
+
+def test_migration_runs_once_then_only_on_request(client, run, db):
+    # 起動時に移行済みとして記録される
+    assert run(db.migrations.find_one, {"_id": server.RESERVATION_MIGRATION_ID}) is not None
+
+    run(db.reservations.insert_one, {"id": "legacy", "bench_id": "front", "user_name": "Ｙａｍａｄａ",
+                                     "start_time": "2025-07-01T09:00:00+09:00", "end_time": "2025-07-01T10:00:00+09:00"})
+    run(server.migrate_reservation_documents)
+    legacy = run(db.reservations.find_one, {"id": "legacy"})
+    assert "version" not in legacy and "user_key" not in legacy
+
+    run(server.migrate_reservation_documents, True)
+    legacy = run(db.reservations.find_one, {"id": "legacy"})
+    assert legacy["version"] == 1
+    assert legacy["user_key"] == "yamada"
@@ -0,0 +1,43 @@
+"""接続プールの設定と計測値"""
+import pytest
+from pymongo import monitoring
+
+import server
+
+from .conftest import ADMIN_HEADERS
+
+
+def test_pool_options_from_profile_and_overrides(monkeypatch):
+    monkeypatch.setenv("MONGO_POOL_PROFILE", "multi-worker")
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "4")
+    profile, options = server.load_mongo_client_options("single-node")
+    assert profile == "multi-worker"
+    assert options["maxPoolSize"] == 4
+    assert options["minPoolSize"] == server.MONGO_POOL_PROFILES["multi-worker"]["minPoolSize"]
+    assert options["serverSelectionTimeoutMS"] == server.MONGO_COMMON_OPTIONS["serverSelectionTimeoutMS"]
+
+    monkeypatch.setenv("MONGO_POOL_PROFILE", "unknown")
+    with pytest.raises(ValueError):
+        server.load_mongo_client_options("single-node")
+
+
+def test_pool_endpoint_reports_monitor_events(client, monkeypatch):
+    monitor = server.PoolMonitor()
+    monkeypatch.setattr(server, "pool_monitor", monitor)
+    address = ("db.example", 27017)
+    monitor.pool_created(monitoring.PoolCreatedEvent(address, {}))
+    for connection_id in range(3):
+        monitor.connection_created(monitoring.ConnectionCreatedEvent(address, connection_id))
+    monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+    monitor.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, 1, 0.012))
+    monitor.connection_closed(monitoring.ConnectionClosedEvent(address, 2, "idle"))
+    monitor.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(address, "timeout", 5.0))
+
+    response = client.get("/api/admin/pool", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    pool = response.json()["pools"]["db.example:27017"]
+    assert (pool["open"], pool["in_use"], pool["available"]) == (2, 1, 1)
+    assert pool["closed_by_reason"] == {"idle": 1}
+    assert pool["checkout_failures_by_reason"] == {"timeout": 1}
+    assert response.json()["checkout_wait_ms"]["samples"] == 2
+    assert response.json()["options"] == server.mongo_client_options
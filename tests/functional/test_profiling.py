@@ -0,0 +1,65 @@
+"""リクエストのプロファイル取得（ヘッダーと管理者トグル）"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+import server
+
+from .conftest import ADMIN_HEADERS
+
+
+@pytest.fixture
+def profiler(monkeypatch, tmp_path):
+    # ミドルウェアが同じオブジェクトを参照しているので、属性だけ差し替える
+    profiler = server.request_profiler
+    monkeypatch.setattr(profiler, "store", server.ProfileStore(str(tmp_path), 50 * 1024 * 1024))
+    monkeypatch.setattr(profiler, "secret", "s3cret")
+    monkeypatch.setattr(profiler, "armed", {"remaining": 0, "path_prefix": None, "expires_at": None})
+    return profiler
+
+
+def test_token_header_profiles_request(client, profiler):
+    assert "x-profile-id" not in client.get("/api/benches").headers
+    assert "x-profile-id" not in client.get("/api/benches", headers={"X-Profile-Token": "wrong"}).headers
+
+    profile_id = client.get("/api/benches", headers={"X-Profile-Token": "s3cret"}).headers["x-profile-id"]
+
+    text = client.get(f"/api/admin/profiles/{profile_id}", headers=ADMIN_HEADERS)
+    assert text.status_code == 200
+    assert text.headers["content-type"].startswith("text/plain")
+    assert "function calls" in text.text
+    binary = client.get(f"/api/admin/profiles/{profile_id}", params={"format": "pstats"}, headers=ADMIN_HEADERS)
+    assert binary.status_code == 200
+    assert binary.headers["content-type"] == "application/octet-stream"
+    assert binary.content
+
+    assert client.get("/api/admin/profiles/..%2Fetc", headers=ADMIN_HEADERS).status_code == 404
+    assert client.get("/api/admin/profiles/nope", headers=ADMIN_HEADERS).status_code == 404
+
+
+def test_admin_toggle_profiles_next_matching_requests(client, profiler):
+    response = client.post("/api/admin/profiling", json={"requests": 2, "path_prefix": "/api/benches"},
+                           headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+
+    # 対象外のパスは数に含めない
+    assert "x-profile-id" not in client.get("/api/reservations").headers
+    profiled = ["x-profile-id" in client.get("/api/benches").headers for _ in range(3)]
+    assert profiled == [True, True, False]
+    assert client.get("/api/admin/profiling", headers=ADMIN_HEADERS).json()["remaining"] == 0
+    assert len(client.get("/api/admin/profiles", headers=ADMIN_HEADERS).json()["profiles"]) == 2
+
+    assert client.post("/api/admin/profiling", json={"requests": 100}, headers=ADMIN_HEADERS).status_code == 422
+
+
+def test_profiling_runs_inside_admission_control_in_both_apps():
+    # 後から登録したものほど外側になる。待ち行列の時間はどちらのアプリでもプロファイルに含めない
+    path = Path(__file__).resolve().parents[2] / "api" / "index.py"
+    spec = importlib.util.spec_from_file_location("vercel_index", path)
+    vercel = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(vercel)
+
+    expected = ["CORSMiddleware", "AdmissionControlMiddleware", "ProfilingMiddleware"]
+    assert [m.cls.__name__ for m in server.app.user_middleware] == expected
+    assert [m.cls.__name__ for m in vercel.app.user_middleware] == expected
@@ -0,0 +1,43 @@
+"""読み込みキャッシュ（L2 なしでのプロセス間の無効化）"""
+from datetime import datetime, timedelta
+
+import server
+
+from .test_reservations import reservation, slot
+
+
+def test_write_in_one_instance_invalidates_another_without_redis(client, run):
+    day = (datetime.now(server.JST).date() + timedelta(days=1)).isoformat()
+    # 別のワーカーの L1 を模擬する（書き込みはアプリの read_cache 側で行われる）
+    other = server.create_read_cache()
+    assert other.redis is None and server.read_cache is not other
+
+    async def read():
+        payload, source = await other.get_or_load(f"day:{day}:*", server.day_scopes([day]),
+                                                  lambda: server.fetch_day_payload(day))
+        return len(payload.data), source
+
+    assert run(read) == (0, "load")
+    assert run(read) == (0, "l1")
+
+    assert client.post("/api/reservations", json=reservation(days_ahead=1)).status_code == 200
+    assert run(read) == (1, "load")
+    assert run(read) == (1, "l1")
+
+
+def test_week_view_sees_writes_from_another_instance(client, run, db):
+    tomorrow = (datetime.now(server.JST).date() + timedelta(days=1)).isoformat()
+    created = client.post("/api/reservations", json=reservation(days_ahead=1, hour=9)).json()
+
+    def counts():
+        week = client.get("/api/reservations/week", params={"start": tomorrow}).json()
+        return week["days"][0]["reservation_count"]
+
+    assert counts() == 1
+
+    # 別のワーカーでの書き込み（このプロセスのカウンターは進まない）
+    start_time, end_time = slot(1, 11)
+    document = {**created, "id": "other-worker", "user_name": "佐藤", "start_time": start_time, "end_time": end_time}
+    run(db.reservations.insert_one, dict(document))
+    run(server.append_reservation_events, [server.upsert_event(document)])
+    assert counts() == 2
@@ -0,0 +1,44 @@
+"""起動時のウォームアップと readiness"""
+import server
+
+from .test_reservations import reservation
+
+
+def test_ready_only_after_warmup(client, run, db, monkeypatch):
+    monkeypatch.setattr(server, "warmup_status", {"state": "pending"})
+    assert client.get("/api/health/live").status_code == 200
+    not_ready = client.get("/api/health/ready")
+    assert not_ready.status_code == 503
+    assert not_ready.json()["status"] == "not_ready"
+
+    assert client.post("/api/reservations", json=reservation(days_ahead=1)).status_code == 200
+    run(server.warm_caches, 3)
+    status = server.warmup_status
+    assert status["state"] == "ready"
+    # 3日分と、それを含む週（1つか2つ）
+    assert status["warmed"] == status["targets"] >= 4
+    assert status["errors"] == {}
+    assert client.get("/api/health/ready").status_code == 200
+
+
+def test_failed_targets_are_reported_but_do_not_block_readiness(client, run, db, monkeypatch):
+    monkeypatch.setattr(server, "warmup_status", {"state": "pending"})
+
+    async def failing(day):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server, "warm_day", failing)
+    run(server.warm_caches, 2)
+    assert server.warmup_status["state"] == "ready"
+    assert sorted(server.warmup_status["errors"].values()) == ["boom", "boom"]
+    assert client.get("/api/health/ready").json()["warmup"]["warmed"] == server.warmup_status["targets"] - 2
+
+
+def test_not_ready_while_database_is_down(client, db, monkeypatch):
+    monkeypatch.setattr(server, "warmup_status", {"state": "ready"})
+
+    async def disconnected():
+        return False
+
+    monkeypatch.setattr(server, "ensure_database_connection", disconnected)
+    assert client.get("/api/health/ready").status_code == 503
@@ -0,0 +1,39 @@
+"""予約の作成・取得・重複チェック"""
+from datetime import datetime, timedelta
+
+import server
+
+
+def slot(days_ahead: int, hour: int, minutes: int = 60) -> tuple:
+    day = datetime.now(server.JST).date() + timedelta(days=days_ahead)
+    start = server.JST.localize(datetime.combine(day, datetime.min.time())) + timedelta(hours=hour)
+    return start.isoformat(), (start + timedelta(minutes=minutes)).isoformat()
+
+
+def reservation(bench_id="front", user_name="山田", days_ahead=1, hour=9, minutes=60) -> dict:
+    start_time, end_time = slot(days_ahead, hour, minutes)
+    return {"bench_id": bench_id, "user_name": user_name, "start_time": start_time, "end_time": end_time}
+
+
+def test_create_and_list_by_date(client):
+    created = client.post("/api/reservations", json=reservation())
+    assert created.status_code == 200
+    day = created.json()["start_time"][:10]
+
+    listed = client.get(f"/api/reservations?date={day}")
+    assert listed.status_code == 200
+    assert [row["id"] for row in listed.json()] == [created.json()["id"]]
+
+
+def test_overlapping_reservation_is_rejected(client):
+    assert client.post("/api/reservations", json=reservation(hour=9, minutes=90)).status_code == 200
+
+    conflict = client.post("/api/reservations", json=reservation(user_name="佐藤", hour=10))
+    assert conflict.status_code == 409
+    # 別のベンチなら同じ時間帯でも予約できる
+    assert client.post("/api/reservations", json=reservation(bench_id="back", hour=10)).status_code == 200
+
+
+def test_booking_window_is_enforced(client):
+    assert client.post("/api/reservations", json=reservation(hour=6)).status_code == 400
+    assert client.post("/api/reservations", json=reservation(hour=9, minutes=45)).status_code == 400
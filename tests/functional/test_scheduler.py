@@ -0,0 +1,41 @@
+"""定期ジョブ（リーダーのリースと古いデータのクリーンアップ）"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+
+def test_lease_has_one_owner_until_released_or_expired(run, db):
+    first = server.MongoLease(db.scheduler_leases, "scheduler-leader", "a", 30)
+    second = server.MongoLease(db.scheduler_leases, "scheduler-leader", "b", 30)
+
+    assert run(first.acquire) is True
+    assert run(second.acquire) is False
+    assert run(first.acquire) is True  # 自分のリースは更新できる
+
+    run(first.release)
+    assert run(second.acquire) is True
+    assert run(first.acquire) is False
+
+    # 更新が止まって期限切れになったリースは引き継げる
+    run(db.scheduler_leases.update_one, {"_id": "scheduler-leader"},
+        {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert run(first.acquire) is True
+
+
+def test_scheduled_cleanup_is_opt_in_and_uses_service(run, db, monkeypatch):
+    assert "cleanup_old_data" not in server.scheduler.jobs
+
+    old = (datetime.now(server.JST) - timedelta(days=40)).replace(hour=9, minute=0, second=0, microsecond=0)
+    run(db.reservations.insert_one, {"id": "old", "bench_id": "front", "user_name": "山田",
+                                     "start_time": old.isoformat(), "end_time": (old + timedelta(hours=1)).isoformat()})
+
+    monkeypatch.setattr(server, "SCHEDULED_CLEANUP_DAYS", 3)
+    with pytest.raises(ValueError):
+        run(server.scheduled_cleanup)
+    assert run(db.reservations.count_documents, {}) == 1
+
+    monkeypatch.setattr(server, "SCHEDULED_CLEANUP_DAYS", 30)
+    run(server.scheduled_cleanup)
+    assert run(db.reservations.count_documents, {}) == 0
@@ -0,0 +1,64 @@
+"""同時の同じ読み込みの共有（SingleFlight）"""
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+from .test_reservations import reservation
+
+
+def test_concurrent_calls_share_one_execution(run):
+    flight = server.SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        return await asyncio.gather(*[flight.do("key", load) for _ in range(10)], flight.do("other", load))
+
+    results = run(main)
+    assert results[:10] == [results[0]] * 10
+    assert len(calls) == 2
+    assert flight.stats() == {"in_flight": 0, "executions": 2, "shared": 9}
+    # 完了後は結果を保持しない
+    run(flight.do, "key", load)
+    assert len(calls) == 3
+
+
+def test_errors_reach_every_waiter(run):
+    flight = server.SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*[flight.do("key", fail) for _ in range(3)], return_exceptions=True)
+
+    assert [type(result) for result in run(main)] == [RuntimeError] * 3
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_concurrent_day_reads_query_once(client, run, db, monkeypatch):
+    assert client.post("/api/reservations", json=reservation()).status_code == 200
+    day = (datetime.now(server.JST).date() + timedelta(days=1)).isoformat()
+    fetch_day_payload = server.fetch_day_payload
+    calls = []
+
+    async def slow(day, bench_id=None):
+        calls.append(day)
+        await asyncio.sleep(0.05)
+        return await fetch_day_payload(day, bench_id)
+
+    monkeypatch.setattr(server, "fetch_day_payload", slow)
+
+    async def main():
+        return await asyncio.gather(*[server.load_day_payload(day) for _ in range(10)])
+
+    results = run(main)
+    assert calls == [day]
+    assert sorted(source for _, source in results) == ["load"] * 10
+    assert all(len(payload.data) == 1 for payload, _ in results)
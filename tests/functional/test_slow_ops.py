@@ -0,0 +1,60 @@
+"""遅い操作の記録（クエリの形ごとの集計）"""
+import json
+from types import SimpleNamespace
+
+import server
+
+from .conftest import ADMIN_HEADERS
+
+
+def record(recorder, request_id, command_name, command, duration_ms, reply=None, failure=None):
+    recorder.started(SimpleNamespace(command_name=command_name, command=command, connection_id=("db", 27017),
+                                     request_id=request_id, database_name="bench_reservation"))
+    event = SimpleNamespace(command_name=command_name, connection_id=("db", 27017), request_id=request_id,
+                            duration_micros=int(duration_ms * 1000), database_name="bench_reservation", reply=reply or {"ok": 1})
+    if failure:
+        event.failure = {"errmsg": failure}
+        recorder.failed(event)
+    else:
+        recorder.succeeded(event)
+
+
+def find(month: int, benches: list) -> dict:
+    return {"find": "reservations", "filter": {"start_time": {"$gte": f"2025-{month:02d}", "$lt": "2026"}, "bench_id": {"$in": benches}},
+            "sort": {"start_time": 1}, "lsid": {"id": 1}}
+
+
+def test_commands_group_by_shape_with_slowest_samples(tmp_path):
+    log_file = tmp_path / "slow.log"
+    recorder = server.SlowOpRecorder(threshold_ms=50, samples_per_shape=2, log_file=str(log_file))
+    for request_id, duration_ms in enumerate([10, 60, 200, 80, 5]):
+        # 値の違う同じ形のクエリは1つにまとまる
+        cursor_id = 77 if request_id == 2 else 0
+        record(recorder, request_id, "find", find(request_id + 1, ["front", "back"][:request_id % 2 + 1]), duration_ms,
+               reply={"cursor": {"id": cursor_id, "firstBatch": []}})
+    record(recorder, 10, "getMore", {"getMore": 77, "collection": "reservations"}, 300, reply={"cursor": {"id": 0}})
+    record(recorder, 11, "update", {"update": "reservations", "updates": [{"q": {"id": "x"}, "u": {"$set": {"a": 1}}}]}, 70, failure="boom")
+    record(recorder, 12, "ping", {"ping": 1}, 1000)
+
+    shapes = {shape["fingerprint"]: shape for shape in recorder.snapshot()["shapes"]}
+    find_shape = 'find reservations {"filter":{"start_time":{"$gte":"?","$lt":"?"},"bench_id":{"$in":["?"]}},"sort":{"start_time":1}}'
+    assert set(shapes) == {find_shape, f"getMore <- {find_shape}", 'update reservations {"updates":[{"q":{"id":"?"},"multi":false}]}'}
+    assert (shapes[find_shape]["count"], shapes[find_shape]["slow_count"], shapes[find_shape]["p50_ms"]) == (5, 3, 60.0)
+    assert [sample["duration_ms"] for sample in shapes[find_shape]["slowest"]] == [200.0, 80.0]
+    assert shapes['update reservations {"updates":[{"q":{"id":"?"},"multi":false}]}']["errors"] == 1
+
+    # 閾値を超えた実行だけがログに書かれる（元の値付き、セッション情報なし）
+    lines = log_file.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 5
+    assert "lsid" not in json.loads(lines[0])["command"]
+
+
+def test_slow_ops_endpoint_resets(client, monkeypatch):
+    recorder = server.SlowOpRecorder(threshold_ms=50)
+    monkeypatch.setattr(server, "slow_op_recorder", recorder)
+    record(recorder, 1, "find", find(1, ["front"]), 120)
+
+    response = client.get("/api/admin/slow-ops", params={"reset": "true"}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert [shape["slow_count"] for shape in response.json()["shapes"]] == [1]
+    assert client.get("/api/admin/slow-ops", headers=ADMIN_HEADERS).json()["shapes"] == []
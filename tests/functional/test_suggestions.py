@@ -0,0 +1,51 @@
+"""重複時の空き時間の提案"""
+from datetime import datetime, timedelta
+
+import server
+
+
+def book(client, bench_id: str, start: str, end: str, day: str, **kwargs):
+    return client.post("/api/reservations", json={
+        "bench_id": bench_id, "user_name": "山田", "start_time": f"{day}T{start}:00+09:00", "end_time": f"{day}T{end}:00+09:00"
+    }, **kwargs)
+
+
+def times(slots) -> list:
+    return [(slot["bench_id"], slot["start_time"][11:16]) for slot in slots]
+
+
+def test_conflict_returns_nearest_free_slots(client):
+    day = (datetime.now(server.JST).date() + timedelta(days=3)).isoformat()
+    for bench_id, start, end in [("front", "09:00", "11:00"), ("front", "11:30", "12:00"), ("front", "13:00", "14:00"), ("back", "10:00", "10:30")]:
+        assert book(client, bench_id, start, end, day).status_code == 200
+
+    conflict = book(client, "front", "10:00", "11:00", day, headers={"Idempotency-Key": "conflict"})
+    assert conflict.status_code == 409
+    suggestions = conflict.json()["suggestions"]
+    # 同じ距離なら後の時刻を優先
+    assert times(suggestions["same_bench"]) == [("front", "12:00"), ("front", "08:00"), ("front", "07:30")]
+    assert times(suggestions["other_benches"]) == [("back", "10:30"), ("back", "11:00"), ("back", "09:00")]
+    # 再送しても同じ409と提案が返る
+    replayed = book(client, "front", "10:00", "11:00", day, headers={"Idempotency-Key": "conflict"})
+    assert (replayed.status_code, replayed.json()) == (409, conflict.json())
+
+    suggest = client.get("/api/suggest", params={"bench_id": "front", "start_time": f"{day}T11:00:00+09:00",
+                                                 "end_time": f"{day}T12:30:00+09:00", "count": 2})
+    assert suggest.status_code == 200
+    assert suggest.json()["available"] is False
+    assert len(suggest.json()["same_bench"]) == 2
+
+
+def test_suggest_validates_request(client):
+    day = (datetime.now(server.JST).date() + timedelta(days=3)).isoformat()
+    params = {"bench_id": "front", "start_time": f"{day}T21:00", "end_time": f"{day}T22:00"}
+    assert client.get("/api/suggest", params=params).json()["available"] is True
+    assert client.get("/api/suggest", params={**params, "bench_id": "x"}).status_code == 400
+    assert client.get("/api/suggest", params={**params, "start_time": f"{day}T21:15"}).status_code == 400
+    assert client.get("/api/suggest", params={**params, "start_time": "bad"}).status_code == 400
+    assert client.get("/api/suggest", params={**params, "count": 0}).status_code == 400
+
+
+def test_free_slot_starts_skip_booked_intervals():
+    assert server.free_slot_starts([(420, 480), (450, 600), (1230, 1320)], 60)[:3] == [600, 630, 660]
+    assert server.free_slot_starts([(420, 480), (450, 600), (1230, 1320)], 60)[-1] == 1170
@@ -0,0 +1,55 @@
+"""予約の更新（楽観的排他制御・重複チェック・予約ルール）"""
+import server
+
+from .test_reservations import reservation, slot
+
+
+def create(client, **kwargs) -> dict:
+    response = client.post("/api/reservations", json=reservation(**kwargs))
+    assert response.status_code == 200
+    return response
+
+
+def test_stale_if_match_is_rejected(client):
+    created = create(client)
+    reservation_id, etag = created.json()["id"], server.reservation_etag(created.json()["version"])
+    start_time, end_time = slot(1, 13)
+
+    moved = client.put(f"/api/reservations/{reservation_id}", json={"start_time": start_time, "end_time": end_time},
+                       headers={"If-Match": etag})
+    assert moved.status_code == 200
+    assert moved.headers["ETag"] != etag
+
+    stale = client.put(f"/api/reservations/{reservation_id}", json={"user_name": "佐藤"}, headers={"If-Match": etag})
+    assert stale.status_code == 412
+
+
+def test_moving_onto_another_booking_conflicts(client):
+    create(client, hour=9)
+    other = create(client, hour=12).json()
+    start_time, end_time = slot(1, 9, 30)
+
+    conflict = client.put(f"/api/reservations/{other['id']}", json={"start_time": start_time, "end_time": end_time})
+    assert conflict.status_code == 409
+    # 自分自身との重なりは重複にしない
+    start_time, end_time = slot(1, 12, 90)
+    assert client.put(f"/api/reservations/{other['id']}", json={"start_time": start_time, "end_time": end_time}).status_code == 200
+
+
+def test_update_follows_booking_window(client):
+    reservation_id = create(client).json()["id"]
+    for hour, minutes in ((6, 60), (21, 120), (9, 45)):
+        start_time, end_time = slot(1, hour, minutes)
+        response = client.put(f"/api/reservations/{reservation_id}", json={"start_time": start_time, "end_time": end_time})
+        assert response.status_code == 400, (hour, minutes)
+
+
+def test_update_validates_user_name_like_create(client):
+    reservation_id = create(client).json()["id"]
+
+    for user_name in ["   ", "あ" * 51, "<script>"]:
+        assert client.put(f"/api/reservations/{reservation_id}", json={"user_name": user_name}).status_code == 422
+
+    renamed = client.put(f"/api/reservations/{reservation_id}", json={"user_name": "  佐藤 "})
+    assert renamed.status_code == 200
+    assert renamed.json()["user_name"] == "佐藤"
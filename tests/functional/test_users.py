@@ -0,0 +1,44 @@
+"""利用者ごとの予約一覧と利用者名の検索"""
+from .test_reservations import reservation
+
+
+def test_user_reservations_match_normalized_name_and_page(client, run, db):
+    run(db.reservations.insert_one, {"id": "past", "bench_id": "front", "user_name": "Ｙａｍａｄａ　Taro", "user_key": "yamada taro",
+                                     "start_time": "2020-01-01T09:00:00+09:00", "end_time": "2020-01-01T10:00:00+09:00"})
+    created = []
+    for offset in range(5):
+        payload = {**reservation(user_name="yamada  taro" if offset % 2 else "Yamada Taro", days_ahead=offset + 1), "user_key": "evil"}
+        response = client.post("/api/reservations", json=payload)
+        assert response.status_code == 200
+        assert response.json()["user_key"] == "yamada taro"  # クライアントの値は使わない
+        created.append(response.json()["id"])
+    assert client.post("/api/reservations", json=reservation(bench_id="back", user_name="山田花子")).status_code == 200
+
+    first = client.get("/api/users/YAMADA TARO/reservations", params={"limit": 2}).json()
+    assert [row["id"] for row in first["reservations"]] == created[:2]
+    assert first["next_offset"] == 2
+    last = client.get("/api/users/YAMADA TARO/reservations", params={"limit": 2, "offset": 4}).json()
+    assert [row["id"] for row in last["reservations"]] == created[4:]
+    assert last["next_offset"] is None
+
+    past = client.get("/api/users/yamada taro/reservations", params={"scope": "past"}).json()
+    assert [row["id"] for row in past["reservations"]] == ["past"]
+    assert len(client.get("/api/users/yamada taro/reservations", params={"scope": "all"}).json()["reservations"]) == 6
+
+
+def test_user_reservations_validate_parameters(client):
+    assert client.get("/api/users/x/reservations", params={"scope": "bad"}).status_code == 400
+    assert client.get("/api/users/x/reservations", params={"limit": 0}).status_code == 400
+    assert client.get("/api/users/%20/reservations").status_code == 400
+
+
+def test_user_search_by_prefix(client):
+    for offset, user_name in enumerate(["Yamada Taro", "yamada taro", "Yamamoto", "山田花子"]):
+        assert client.post("/api/reservations", json=reservation(user_name=user_name, days_ahead=offset + 1)).status_code == 200
+
+    users = client.get("/api/users", params={"prefix": "YA"}).json()["users"]
+    assert [user["reservation_count"] for user in users] == [2, 1]
+    assert users[1]["user_name"] == "Yamamoto"
+    assert [user["user_name"] for user in client.get("/api/users", params={"prefix": "山"}).json()["users"]] == ["山田花子"]
+    assert client.get("/api/users", params={"prefix": "."}).json() == {"users": []}
+    assert client.get("/api/users").json() == {"users": []}
@@ -0,0 +1,36 @@
+"""利用率の分析"""
+from datetime import date, timedelta
+
+MONDAY = date(2030, 1, 7)
+
+
+def insert(run, db, reservation_id, bench_id, day, start, end):
+    run(db.reservations.insert_one, {"id": reservation_id, "bench_id": bench_id, "user_name": "山田",
+                                     "start_time": f"{day}T{start}+09:00", "end_time": f"{day}T{end}+09:00"})
+
+
+def test_utilization_summary(client, run, db):
+    for offset in range(3):
+        insert(run, db, f"front-{offset}", "front", MONDAY + timedelta(days=offset), "09:00:00", "10:30:00")
+    insert(run, db, "back", "back", MONDAY, "09:00:00", "09:30:00")
+
+    response = client.get("/api/analytics/utilization", params={"from": MONDAY.isoformat(), "to": (MONDAY + timedelta(days=6)).isoformat()})
+    assert response.status_code == 200
+    summary = response.json()
+    # 7日 x 2台 x 営業時間15時間
+    assert (summary["reservation_count"], summary["booked_minutes"], summary["capacity_minutes"]) == (4, 300, 12600)
+    assert {bench["bench_id"]: bench["booked_minutes"] for bench in summary["benches"]} == {"front": 270, "back": 30}
+    # 9時台: ベンチ前 60分 x 3日 + 奥 30分 / (7日 x 2台 x 60分)
+    assert summary["peak_hours"][0] == {"hour": 9, "utilization": 0.25}
+    assert summary["by_hour"][0] == {"hour": 7, "utilization": 0.0}
+
+    only_back = client.get("/api/analytics/utilization", params={"from": MONDAY.isoformat(), "to": MONDAY.isoformat(), "bench_id": "back"})
+    assert [bench["bench_id"] for bench in only_back.json()["benches"]] == ["back"]
+    assert only_back.json()["booked_minutes"] == 30
+
+
+def test_utilization_rejects_bad_ranges(client):
+    assert client.get("/api/analytics/utilization", params={"bench_id": "nope"}).status_code == 400
+    assert client.get("/api/analytics/utilization", params={"from": "2030-01-02", "to": "2030-01-01"}).status_code == 400
+    assert client.get("/api/analytics/utilization", params={"from": "2029-01-01", "to": "2030-01-02"}).status_code == 400
+    assert client.get("/api/analytics/utilization", params={"from": "garbage"}).status_code == 400
@@ -0,0 +1,55 @@
+"""週表示"""
+from datetime import datetime, timedelta
+
+import server
+
+from .conftest import ADMIN_HEADERS
+from .test_reservations import reservation
+
+
+def test_week_groups_by_day_and_bench_and_invalidates_on_write(client):
+    today = datetime.now(server.JST).date()
+    days_ahead = 7 - today.weekday()  # 来週の月曜日
+    week_start = (today + timedelta(days=days_ahead)).isoformat()
+    first = client.post("/api/reservations", json=reservation(days_ahead=days_ahead, hour=9)).json()
+    client.post("/api/reservations", json=reservation(bench_id="back", days_ahead=days_ahead, hour=9, minutes=120))
+    client.post("/api/reservations", json=reservation(days_ahead=days_ahead + 2, hour=20))
+    client.post("/api/reservations", json=reservation(days_ahead=days_ahead + 7, hour=9))  # 翌週
+
+    response = client.get("/api/reservations/week", params={"start": week_start})
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "MISS"
+    week = response.json()
+    assert (week["start"], len(week["days"])) == (week_start, 7)
+    monday, _, wednesday = week["days"][:3]
+    assert {bench: len(rows) for bench, rows in monday["benches"].items()} == {"front": 1, "back": 1}
+    assert (monday["reservation_count"], monday["occupied_minutes"]) == (2, 180)
+    assert wednesday["reservation_count"] == 1
+    assert sum(day["reservation_count"] for day in week["days"]) == 3  # 翌週の予約は含まない
+
+    assert client.get("/api/reservations/week", params={"start": week_start}).headers["X-Cache"] == "HIT"
+    assert client.delete(f"/api/reservations/{first['id']}").status_code == 200
+    refreshed = client.get("/api/reservations/week", params={"start": week_start})
+    assert refreshed.headers["X-Cache"] == "MISS"
+    assert refreshed.json()["days"][0]["reservation_count"] == 1
+
+
+def test_week_defaults_to_this_monday_and_rejects_bad_dates(client):
+    today = datetime.now(server.JST).date()
+    assert client.get("/api/reservations/week").json()["start"] == (today - timedelta(days=today.weekday())).isoformat()
+    assert client.get("/api/reservations/week", params={"start": "not-a-date"}).status_code == 400
+
+
+def test_occupancy_counts_capacity_of_every_listed_bench(client):
+    today = datetime.now(server.JST).date()
+    days_ahead = 7 - today.weekday()
+    client.post("/api/reservations", json=reservation(days_ahead=days_ahead, hour=9, minutes=60))
+    client.post("/api/reservations", json=reservation(bench_id="back", days_ahead=days_ahead, hour=9, minutes=60))
+    # 無効化したベンチも予約が残っていれば表示され、その分の予約可能時間も分母に含める
+    for bench_id in ("front", "back"):
+        assert client.put(f"/api/benches/{bench_id}", json={"active": False}, headers=ADMIN_HEADERS).status_code == 200
+
+    week_start = (today + timedelta(days=days_ahead)).isoformat()
+    monday = client.get("/api/reservations/week", params={"start": week_start}).json()["days"][0]
+    assert set(monday["benches"]) == {"front", "back"}
+    assert monday["occupancy_rate"] == round(120 / (2 * 15 * 60), 4)